@@ -0,0 +1,176 @@
+"""
+Local stand-ins for the services the pipeline talks to: an S3 server (moto)
+holding synthetic works in the layout of the OCR output bucket, and a minimal
+OpenPecha API that accepts uploads.
+"""
+import gzip
+import hashlib
+import json
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from typing import Dict, Iterator, List, Tuple
+
+
+@dataclass(frozen=True)
+class Dataset:
+    """
+    Shape of the synthetic bucket: every work has the same number of Google
+    Vision batches, image groups per batch and pages per image group.
+    """
+
+    works: int = 20
+    batches: int = 1
+    image_groups: int = 2
+    pages: int = 50
+    page_size: int = 8 * 1024
+    seed: int = 0
+
+    def to_dict(self) -> Dict[str, int]:
+        return asdict(self)
+
+    @property
+    def page_count(self) -> int:
+        return self.works * self.batches * self.image_groups * self.pages
+
+
+def get_hash(work_id: str) -> str:
+    # Same as download.get_hash; duplicated so the dataset can be generated
+    # before the pipeline (and its S3 client) is imported
+    return hashlib.md5(str.encode(work_id)).hexdigest()[:2]
+
+
+def work_ids(dataset: Dataset) -> List[str]:
+    return [f"W{100000 + i}" for i in range(dataset.works)]
+
+
+def iter_objects(dataset: Dataset) -> Iterator[Tuple[str, bytes]]:
+    """
+    Yield (key, body) for every object of the synthetic bucket. Pages are
+    gzipped JSON with incompressible text, sized like real Vision output.
+    """
+    rng = random.Random(dataset.seed)
+    for work_id in work_ids(dataset):
+        work_prefix = f"Works/{get_hash(work_id)}/{work_id}/vision"
+        for batch in range(1, dataset.batches + 1):
+            batch_prefix = f"{work_prefix}/batch{batch:03d}"
+            yield f"{batch_prefix}/info.json", json.dumps(
+                {"timestamp": "2022-01-01T00:00:00", "batch": batch}
+            ).encode()
+            for group in range(1, dataset.image_groups + 1):
+                image_group = f"I{work_id[1:]}{group:02d}"
+                for page in range(1, dataset.pages + 1):
+                    text = rng.randbytes(dataset.page_size // 2).hex()
+                    body = gzip.compress(
+                        json.dumps(
+                            {"textAnnotations": [{"description": text}]}
+                        ).encode(),
+                        mtime=0,
+                    )
+                    yield (
+                        f"{batch_prefix}/output/{image_group}/"
+                        f"{image_group}{page:04d}.json.gz",
+                        body,
+                    )
+
+
+class LocalS3:
+    """
+    A moto S3 server on a free local port.
+
+    Usage:
+        with LocalS3() as s3:
+            os.environ["AWS_ENDPOINT_URL"] = s3.endpoint_url
+    """
+
+    def __init__(self):
+        from moto.server import ThreadedMotoServer
+
+        self.server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+        self.endpoint_url = ""
+
+    def __enter__(self) -> "LocalS3":
+        self.server.start()
+        host, port = self.server.get_host_and_port()
+        self.endpoint_url = f"http://{host}:{port}"
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.stop()
+
+    def client(self):
+        import boto3
+
+        return boto3.client(
+            "s3",
+            endpoint_url=self.endpoint_url,
+            region_name="us-east-1",
+            aws_access_key_id="testing",
+            aws_secret_access_key="testing",
+        )
+
+    def populate(self, bucket: str, dataset: Dataset, max_workers: int = 32) -> int:
+        """
+        Create the bucket and upload the synthetic works.
+
+        Returns:
+            Total size of the uploaded objects in bytes.
+        """
+        client = self.client()
+        client.create_bucket(Bucket=bucket)
+
+        def upload(item: Tuple[str, bytes]) -> int:
+            key, body = item
+            client.put_object(Bucket=bucket, Key=key, Body=body)
+            return len(body)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return sum(executor.map(upload, iter_objects(dataset)))
+
+
+class _OpenPechaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    ids = count(1)
+    lock = threading.Lock()
+
+    def do_POST(self):
+        remaining = int(self.headers["Content-Length"])
+        while remaining > 0:
+            remaining -= len(self.rfile.read(min(remaining, 1024 * 1024)))
+        with self.lock:
+            pecha_id = f"P{next(self.ids):06d}"
+        response = json.dumps({"id": pecha_id, "title": "benchmark"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class OpenPechaStub:
+    """
+    Local HTTP server standing in for the OpenPecha API /pecha endpoint. It
+    drains the uploaded body and answers with a new pecha ID.
+    """
+
+    def __init__(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _OpenPechaHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self) -> "OpenPechaStub":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.shutdown()
+        self.server.server_close()
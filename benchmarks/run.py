@@ -0,0 +1,327 @@
+"""
+Offline benchmarks of the pipeline against a local S3 server and OpenPecha stub.
+
+A moto S3 server is filled with synthetic works in the layout of the OCR
+output bucket (Works/<hash>/<work>/vision/<batch>/...), the pipeline's S3
+client is pointed at it through AWS_ENDPOINT_URL, and uploads go to a local
+stand-in for the OpenPecha API. BUDA lookups return synthetic scan info.
+
+Each benchmark is timed over several repeats and appended as one JSON line
+per benchmark to the output file, together with the dataset parameters and
+the git commit, so runs with the same parameters can be compared over time.
+The change against the previous matching record is printed.
+
+Requires moto: pip install "bdrc_work_to_pecha_pipeline[bench]"
+
+# Run every benchmark on the default dataset
+python -m benchmarks.run
+
+# A larger dataset, only the download and full pipeline benchmarks
+python -m benchmarks.run --works 100 --pages 200 --benchmarks download_ocr_data run_pipeline
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from unittest.mock import patch
+
+from benchmarks.fixtures import Dataset, LocalS3, OpenPechaStub, work_ids
+
+OCR_OUTPUT_BUCKET = "ocr.bdrc.io"
+
+DEFAULT_OUTPUT = "benchmark_results.jsonl"
+
+
+@dataclass
+class BenchmarkContext:
+    dataset: Dataset
+    dataset_bytes: int
+    work_dir: Path
+
+    def fresh_dir(self, name: str) -> Path:
+        path = self.work_dir / name
+        shutil.rmtree(path, ignore_errors=True)
+        path.mkdir(parents=True)
+        return path
+
+    def jobs(self) -> List[Tuple[str, str]]:
+        return [
+            (work_id, f"batch{batch:03d}")
+            for work_id in work_ids(self.dataset)
+            for batch in range(1, self.dataset.batches + 1)
+        ]
+
+
+# A benchmark returns the number of items and bytes it processed
+Benchmark = Callable[[BenchmarkContext], Tuple[int, int]]
+
+# Modules whose import time is measured: the CLIs' entry points
+IMPORT_MODULES = [
+    "bdrc_work_to_pecha_pipeline.batch_runner",
+    "bdrc_work_to_pecha_pipeline.list_works",
+    "bdrc_work_to_pecha_pipeline.pecha_upload",
+]
+
+
+def bench_import(ctx: BenchmarkContext) -> Tuple[int, int]:
+    # Every module is imported in a fresh interpreter, as when a CLI starts
+    # or a worker process is spawned
+    for module in IMPORT_MODULES:
+        subprocess.run([sys.executable, "-c", f"import {module}"], check=True)
+    return len(IMPORT_MODULES), 0
+
+
+def bench_list_all_work_ids(ctx: BenchmarkContext) -> Tuple[int, int]:
+    from bdrc_work_to_pecha_pipeline.list_works import list_all_work_ids
+
+    found = list_all_work_ids()
+    assert len(found) == ctx.dataset.works, found
+    return len(found), 0
+
+
+def bench_get_work_details(ctx: BenchmarkContext) -> Tuple[int, int]:
+    from bdrc_work_to_pecha_pipeline.list_works import get_work_details
+
+    details = get_work_details()
+    assert len(details) == ctx.dataset.works, details
+    return len(details), 0
+
+
+def download_all(data_dir: Path, ctx: BenchmarkContext) -> int:
+    from bdrc_work_to_pecha_pipeline.pecha_upload import OcrEngine, download_ocr_data
+
+    downloaded = 0
+    for work_id, batch in ctx.jobs():
+        result = download_ocr_data(
+            work_id, batch, OcrEngine.GOOGLE_VISION, base_data_dir=str(data_dir)
+        )
+        assert result.ok, result.failed
+        downloaded += len(result.downloaded)
+    return downloaded
+
+
+def bench_download_ocr_data(ctx: BenchmarkContext) -> Tuple[int, int]:
+    downloaded = download_all(ctx.fresh_dir("download"), ctx)
+    return downloaded, ctx.dataset_bytes
+
+
+def bench_zip_folder(ctx: BenchmarkContext) -> Tuple[int, int]:
+    from bdrc_work_to_pecha_pipeline.utils import zip_folder
+
+    data_dir = ctx.work_dir / "zip_input"
+    if not data_dir.exists():
+        download_all(data_dir, ctx)
+    total_size = 0
+    for work_id in work_ids(ctx.dataset):
+        zip_path = Path(zip_folder(data_dir / work_id))
+        total_size += zip_path.stat().st_size
+        zip_path.unlink()
+    return ctx.dataset.works, total_size
+
+
+def bench_run_pipeline(
+    ctx: BenchmarkContext, streaming: bool = False
+) -> Tuple[int, int]:
+    from bdrc_work_to_pecha_pipeline.pecha_upload import OcrEngine, run_pipeline
+
+    data_dir = ctx.fresh_dir("pipeline")
+    for work_id, batch in ctx.jobs():
+        pecha_id = run_pipeline(
+            work_id,
+            batch,
+            OcrEngine.GOOGLE_VISION,
+            base_data_dir=str(data_dir),
+            streaming=streaming,
+        )
+        assert pecha_id, f"Upload failed for {work_id}/{batch}"
+    return len(ctx.jobs()), ctx.dataset_bytes
+
+
+BENCHMARKS: Dict[str, Benchmark] = {
+    "import": bench_import,
+    "list_all_work_ids": bench_list_all_work_ids,
+    "get_work_details": bench_get_work_details,
+    "download_ocr_data": bench_download_ocr_data,
+    "zip_folder": bench_zip_folder,
+    "run_pipeline": bench_run_pipeline,
+    "run_pipeline_streaming": lambda ctx: bench_run_pipeline(ctx, streaming=True),
+}
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(
+    name: str, benchmark: Benchmark, ctx: BenchmarkContext, repeats: int
+) -> Dict[str, Any]:
+    seconds: List[float] = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        items, size = benchmark(ctx)
+        seconds.append(time.perf_counter() - start)
+    median = statistics.median(seconds)
+    return {
+        "benchmark": name,
+        "params": ctx.dataset.to_dict(),
+        "repeats": repeats,
+        "seconds": [round(s, 4) for s in seconds],
+        "median_seconds": round(median, 4),
+        "min_seconds": round(min(seconds), 4),
+        "items": items,
+        "bytes": size,
+        "items_per_second": round(items / median, 2) if median else None,
+        "mb_per_second": round(size / median / 1e6, 2) if median and size else None,
+    }
+
+
+def find_previous(
+    output: Path, name: str, params: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    if not output.exists():
+        return None
+    previous = None
+    with open(output) as f:
+        for line in f:
+            record = json.loads(line)
+            if record["benchmark"] == name and record["params"] == params:
+                previous = record
+    return previous
+
+
+def run_benchmarks(
+    names: List[str], dataset: Dataset, repeats: int
+) -> List[Dict[str, Any]]:
+    """
+    Start the local services, run the selected benchmarks and return their
+    result records.
+    """
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    with LocalS3() as s3, OpenPechaStub() as api, tempfile.TemporaryDirectory() as tmp:
+        # Must be set before the pipeline modules create their S3 clients
+        os.environ["AWS_ENDPOINT_URL"] = s3.endpoint_url
+        os.environ["AWS_DEFAULT_REGION"] = "us-east-1"
+        dataset_bytes = s3.populate(OCR_OUTPUT_BUCKET, dataset)
+        print(
+            f"Loaded {dataset.page_count} page(s), {dataset_bytes / 1e6:.1f} MB "
+            f"into {s3.endpoint_url}"
+        )
+
+        from bdrc_work_to_pecha_pipeline.buda_cache import configure_buda_cache
+        from bdrc_work_to_pecha_pipeline.uploader import configure_uploader
+
+        logging.getLogger().setLevel(logging.WARNING)
+        configure_uploader(base_url=api.url)
+        configure_buda_cache(cache_dir=Path(tmp) / "buda_cache")
+        ctx = BenchmarkContext(dataset, dataset_bytes, Path(tmp))
+
+        records = []
+        with patch(
+            "bdrc_work_to_pecha_pipeline.metadata.get_buda_scan_info",
+            lambda work_id: {
+                "source_metadata": {
+                    "id": f"http://purl.bdrc.io/resource/{work_id}",
+                    "title": "benchmark",
+                    "languages": ["bo"],
+                }
+            },
+        ):
+            for name in names:
+                records.append(run_benchmark(name, BENCHMARKS[name], ctx, repeats))
+                print(f"{name}: {records[-1]['median_seconds']:.3f}s")
+        return records
+
+
+def main():
+    """
+    Main function to run the script.
+    """
+    defaults = Dataset()
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline against a local S3 server"
+    )
+    parser.add_argument(
+        "--benchmarks",
+        nargs="+",
+        choices=sorted(BENCHMARKS),
+        default=list(BENCHMARKS),
+        help="Benchmarks to run (default: all)",
+    )
+    parser.add_argument("--works", type=int, default=defaults.works)
+    parser.add_argument("--batches", type=int, default=defaults.batches)
+    parser.add_argument("--image-groups", type=int, default=defaults.image_groups)
+    parser.add_argument(
+        "--pages", type=int, default=defaults.pages, help="Pages per image group"
+    )
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=defaults.page_size,
+        help="Approximate size of each page's JSON before gzip, in bytes",
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=DEFAULT_OUTPUT,
+        help="JSON lines file the results are appended to",
+    )
+    args = parser.parse_args()
+
+    dataset = Dataset(
+        works=args.works,
+        batches=args.batches,
+        image_groups=args.image_groups,
+        pages=args.pages,
+        page_size=args.page_size,
+    )
+    records = run_benchmarks(args.benchmarks, dataset, args.repeats)
+
+    output = Path(args.output)
+    run_info = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": get_git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    print()
+    print(f"{'benchmark':<24}{'median s':>10}{'items/s':>12}{'MB/s':>10}{'change':>10}")
+    for record in records:
+        previous = find_previous(output, record["benchmark"], record["params"])
+        change = ""
+        if previous and previous["median_seconds"]:
+            ratio = record["median_seconds"] / previous["median_seconds"] - 1
+            change = f"{ratio:+.1%}"
+        print(
+            f"{record['benchmark']:<24}{record['median_seconds']:>10.3f}"
+            f"{record['items_per_second'] or 0:>12.1f}"
+            f"{record['mb_per_second'] or 0:>10.2f}{change:>10}"
+        )
+    with open(output, "a") as f:
+        for record in records:
+            f.write(json.dumps({**run_info, **record}) + "\n")
+    print(f"\nAppended {len(records)} result(s) to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
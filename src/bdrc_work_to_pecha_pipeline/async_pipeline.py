@@ -0,0 +1,534 @@
+"""
+asyncio variant of the pipeline that runs many batches from a single process.
+
+Listing, downloading, BUDA metadata fetching, zipping and uploading of every
+batch are interleaved on one event loop. S3 is accessed with aiobotocore and
+the OpenPecha API with aiohttp; blocking steps (BUDA lookups, registry access
+and zip compression) run in the default thread pool. Each stage is bounded by
+its own semaphore, so e.g. hundreds of object downloads can be in flight while
+only a few uploads are.
+
+Requires the optional dependencies:
+pip install "bdrc_work_to_pecha_pipeline[async]"
+
+# Process every work ID listed in a file, with 16 batches in flight
+python -m bdrc_work_to_pecha_pipeline.async_pipeline --input work_ids.txt --jobs 16
+
+# Allow 256 concurrent object downloads but only 2 uploads
+python -m bdrc_work_to_pecha_pipeline.async_pipeline --input work_ids.txt --download-limit 256 --upload-limit 2
+
+# Skip batches recorded as published, and record the new ones
+python -m bdrc_work_to_pecha_pipeline.async_pipeline --input work_ids.txt --published published.db
+"""
+import argparse
+import asyncio
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from bdrc_work_to_pecha_pipeline import config
+from bdrc_work_to_pecha_pipeline.batch_runner import (
+    STAGES,
+    Job,
+    add_run_arguments,
+    filter_published,
+    read_input_work_ids,
+    write_summary,
+)
+from bdrc_work_to_pecha_pipeline.download import (
+    DownloadResult,
+    S3Object,
+    get_s3_object,
+    get_s3_prefix,
+    parse_ocr_key,
+)
+from bdrc_work_to_pecha_pipeline.logger import get_logger
+from bdrc_work_to_pecha_pipeline.manifest import SyncManifest, get_manifest_path
+from bdrc_work_to_pecha_pipeline.metadata import get_document_id
+from bdrc_work_to_pecha_pipeline.metrics import (
+    BatchMetrics,
+    MetricsSink,
+    collecting,
+    count,
+    timed,
+)
+from bdrc_work_to_pecha_pipeline.pecha_registry import register_pecha
+from bdrc_work_to_pecha_pipeline.pecha_upload import (
+    OcrEngine,
+    generate_metadata,
+    get_job_data_dir,
+    get_ocr_engine_handlers,
+    get_scan_id,
+)
+from bdrc_work_to_pecha_pipeline.published import PublishedRecord
+from bdrc_work_to_pecha_pipeline.retry import (
+    DEFAULT_RETRY_POLICY,
+    RETRY_STATUS_CODES,
+    RetryableHTTPError,
+    get_limiter,
+)
+from bdrc_work_to_pecha_pipeline.uploader import (
+    DEFAULT_POOL_SIZE,
+    DEFAULT_TIMEOUT,
+    OPENPECHA_API_URL,
+)
+from bdrc_work_to_pecha_pipeline.utils import zip_folder
+
+logger = get_logger(__name__)
+
+# Default number of operations allowed at once in each stage. The download
+# limit counts objects, the others count batches.
+DEFAULT_STAGE_CONCURRENCY = {
+    "download": 128,
+    "metadata": 16,
+    "zip": os.cpu_count() or 1,
+    "upload": 4,
+}
+
+# Default number of batches in flight
+DEFAULT_JOB_CONCURRENCY = 16
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def require_async_dependencies():
+    try:
+        import aiohttp
+        from aiobotocore.config import AioConfig
+        from aiobotocore.session import get_session
+    except ImportError as e:
+        raise ImportError(
+            "The async pipeline requires the 'aiobotocore' and 'aiohttp' packages; "
+            'install them with pip install "bdrc_work_to_pecha_pipeline[async]"'
+        ) from e
+    return aiohttp, AioConfig, get_session
+
+
+class AsyncPipeline:
+    """
+    Shared S3 client, HTTP session and stage semaphores for running batches
+    concurrently on one event loop.
+
+    Usage:
+        async with AsyncPipeline() as pipeline:
+            pecha_id = await pipeline.run(work_id, batch_number, ocr_engine)
+
+    An S3 client and HTTP session can be passed in instead of being created
+    (and are then not closed).
+    """
+
+    def __init__(
+        self,
+        base_data_dir: str = "./data",
+        stage_concurrency: Optional[Dict[str, int]] = None,
+        sync: bool = False,
+        s3_client: Any = None,
+        http_session: Any = None,
+    ):
+        self.base_data_dir = base_data_dir
+        self.sync = sync
+        self.stage_concurrency = {
+            **DEFAULT_STAGE_CONCURRENCY,
+            **(stage_concurrency or {}),
+        }
+        self.stage_limits = {
+            stage: asyncio.Semaphore(limit)
+            for stage, limit in self.stage_concurrency.items()
+        }
+        self.s3_client = s3_client
+        self.http_session = http_session
+        self._owned: List[Any] = []
+
+    async def __aenter__(self) -> "AsyncPipeline":
+        if self.s3_client is None or self.http_session is None:
+            aiohttp, AioConfig, get_session = require_async_dependencies()
+        if self.s3_client is None:
+            aws_access_key_id, aws_secret_access_key = config.get_aws_credentials()
+            client = get_session().create_client(
+                "s3",
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key,
+                config=AioConfig(
+                    max_pool_connections=self.stage_concurrency["download"],
+                    retries=config.S3_SINGLE_ATTEMPT_RETRIES,
+                ),
+            )
+            self.s3_client = await client.__aenter__()
+            self._owned.append(client)
+        if self.http_session is None:
+            connect_timeout, read_timeout = DEFAULT_TIMEOUT
+            self.http_session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=connect_timeout, sock_read=read_timeout
+                )
+            )
+            self._owned.append(self.http_session)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        for resource in reversed(self._owned):
+            await resource.__aexit__(*exc)
+        self._owned = []
+
+    async def iter_objects(
+        self, prefix: str, key_filter: Optional[Callable[[str], bool]] = None
+    ) -> AsyncIterator[S3Object]:
+        """
+        Stream the objects under a prefix page by page, like download.iter_s3_keys.
+        """
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        async for page in paginator.paginate(
+            Bucket=config.OCR_OUTPUT_BUCKET, Prefix=prefix
+        ):
+            count("list_pages")
+            count("objects_listed", len(page.get("Contents", [])))
+            for entry in page.get("Contents", []):
+                if key_filter is None or key_filter(entry["Key"]):
+                    yield get_s3_object(entry)
+
+    async def get_work_batches(self, work_id: str) -> List[Job]:
+        """
+        Discover every (work_id, ocr_engine, batch_number) of a work, like
+        pecha_upload.get_work_batches.
+        """
+        jobs = set()
+        for engine in (
+            OcrEngine.GOOGLE_VISION_ENGINE,
+            OcrEngine.GOOGLE_BOOKS,
+            OcrEngine.GOOGLE_VISION,
+        ):
+            try:
+                async for obj in self.iter_objects(
+                    f"{get_s3_prefix(work_id)}{engine}/"
+                ):
+                    parts = obj.key.split("/")
+                    if len(parts) > 4 and parts[4].startswith("batch"):
+                        jobs.add((work_id, engine, parts[4]))
+            except Exception as e:
+                logger.error(f"Error checking engine {engine}: {e}")
+        return sorted(jobs)
+
+    async def download_object(
+        self,
+        obj: S3Object,
+        local_file_path: Path,
+        manifest: Optional[SyncManifest] = None,
+    ) -> str:
+        """
+        Async counterpart of download.download_s3_file. Transient errors are
+        retried with the shared retry policy. Checksums and file writes run in
+        a worker thread so they do not block the event loop.
+        """
+        if manifest is not None:
+            if await asyncio.to_thread(
+                manifest.is_current, obj.key, obj.size, obj.etag, local_file_path
+            ):
+                count("objects_skipped")
+                return "skipped"
+        elif local_file_path.exists():
+            count("objects_skipped")
+            return "skipped"
+
+        async with self.stage_limits["download"]:
+            local_file_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file_path = local_file_path.with_name(f"{local_file_path.name}.part")
+
+            async def get_object() -> None:
+                response = await self.s3_client.get_object(
+                    Bucket=config.OCR_OUTPUT_BUCKET, Key=obj.key
+                )
+                async with response["Body"] as body:
+                    f = await asyncio.to_thread(open, tmp_file_path, "wb")
+                    try:
+                        while chunk := await body.read(DOWNLOAD_CHUNK_SIZE):
+                            await asyncio.to_thread(f.write, chunk)
+                    finally:
+                        await asyncio.to_thread(f.close)
+
+            try:
+                with timed("s3_get"):
+                    await DEFAULT_RETRY_POLICY.call_async(get_object)
+                os.replace(tmp_file_path, local_file_path)
+            finally:
+                tmp_file_path.unlink(missing_ok=True)
+        count("objects_downloaded")
+        count("bytes_downloaded", local_file_path.stat().st_size)
+        if manifest is not None:
+            manifest.record(obj.key, obj.size, obj.etag)
+        return "downloaded"
+
+    async def download_ocr_data(
+        self, work_id: str, batch_number: str, ocr_engine: str, base_data_dir: str
+    ) -> DownloadResult:
+        """
+        Download a batch, starting downloads as the listing pages arrive.
+        """
+        key_filter, _, get_local_path = get_ocr_engine_handlers(ocr_engine)
+        prefix = f"{get_s3_prefix(work_id)}{ocr_engine}/{batch_number}/"
+        manifest = None
+        if self.sync:
+            manifest = SyncManifest.load(get_manifest_path(work_id, base_data_dir))
+
+        tasks: Dict[str, asyncio.Task] = {}
+        async for obj in self.iter_objects(prefix, key_filter):
+            local_file_path = get_local_path(
+                *parse_ocr_key(obj.key), obj.key, base_data_dir
+            )
+            tasks[obj.key] = asyncio.create_task(
+                self.download_object(obj, local_file_path, manifest)
+            )
+        outcomes = await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+        result = DownloadResult()
+        for key, outcome in zip(tasks, outcomes):
+            if isinstance(outcome, BaseException):
+                result.failed[key] = str(outcome)
+            elif outcome == "skipped":
+                result.skipped.append(key)
+            else:
+                result.downloaded.append(key)
+        if manifest is not None:
+            manifest.save()
+        logger.info(
+            f"Downloaded {len(result.downloaded)}, skipped {len(result.skipped)}, "
+            f"failed {len(result.failed)} file(s) for {work_id}/{ocr_engine}/{batch_number}"
+        )
+        return result
+
+    async def create_pecha(self, metadata: dict, data_file: Path) -> Optional[str]:
+        """
+        Async counterpart of pecha_upload.create_pecha for zip archives.
+
+        Like uploader.PechaUploader, 429 and 503 responses are retried with
+        the shared retry policy under the process's "openpecha" limiter.
+        """
+        aiohttp, _, _ = require_async_dependencies()
+        work_id = get_scan_id(metadata)
+        limiter = get_limiter("openpecha", DEFAULT_POOL_SIZE)
+
+        async def post() -> Optional[Dict[str, Any]]:
+            with open(data_file, "rb") as f:
+                form = aiohttp.FormData()
+                form.add_field("metadata", json.dumps(metadata))
+                form.add_field(
+                    "data", f, filename=data_file.name, content_type="application/zip"
+                )
+                async with self.http_session.post(
+                    f"{OPENPECHA_API_URL}/pecha", data=form
+                ) as response:
+                    logger.info(f"API response code: {response.status}")
+                    if response.status in RETRY_STATUS_CODES:
+                        raise RetryableHTTPError(response, response.status)
+                    if not response.ok:
+                        logger.error(
+                            "❌ Failed to create Pecha: %s", await response.text()
+                        )
+                        return None
+                    return await response.json()
+
+        async with self.stage_limits["upload"]:
+            with timed("upload"):
+                try:
+                    response_json = await DEFAULT_RETRY_POLICY.call_async(
+                        post, limiter=limiter
+                    )
+                except RetryableHTTPError as e:
+                    logger.error(f"❌ Failed to create Pecha: {e}")
+                    return None
+        if response_json is None:
+            return None
+
+        pecha_id = response_json.get("id")
+        logger.info(f"Work ID: {work_id}, Pecha ID: {pecha_id}")
+        if work_id and pecha_id:
+            await asyncio.to_thread(register_pecha, work_id, pecha_id)
+        return pecha_id
+
+    async def run(
+        self,
+        work_id: str,
+        batch_number: str,
+        ocr_engine: str,
+        base_data_dir: Optional[str] = None,
+    ) -> Optional[str]:
+        """
+        Async counterpart of pecha_upload.run_pipeline.
+
+        Returns:
+            The ID of the created pecha, or None if the upload failed.
+        """
+        base_data_dir = base_data_dir or self.base_data_dir
+        work_path = Path(base_data_dir) / work_id
+
+        with timed("download"):
+            download_result = await self.download_ocr_data(
+                work_id, batch_number, ocr_engine, base_data_dir
+            )
+        if not download_result.ok:
+            count("objects_failed", len(download_result.failed))
+            raise RuntimeError(
+                f"{len(download_result.failed)} file(s) failed to download for "
+                f"{work_id}/{ocr_engine}/{batch_number}"
+            )
+
+        async with self.stage_limits["metadata"]:
+            with timed("metadata"):
+                metadata = await asyncio.to_thread(
+                    generate_metadata, work_path, ocr_engine, batch_number
+                )
+
+        async with self.stage_limits["zip"]:
+            with timed("zip"):
+                zip_path = await asyncio.to_thread(zip_folder, work_path)
+        count("bytes_archived", Path(zip_path).stat().st_size)
+
+        return await self.create_pecha(metadata, Path(zip_path))
+
+    async def run_job(self, job: Job, data_dir: Path) -> Dict[str, Any]:
+        """
+        Run one job, returning a batch_runner-style summary record with the
+        job's metrics.
+        """
+        work_id, ocr_engine, batch_number = job
+        record: Dict[str, Any] = {
+            "work_id": work_id,
+            "ocr_engine": ocr_engine,
+            "batch_number": batch_number,
+            "status": "failed",
+            "pecha_id": None,
+            "error": None,
+        }
+        metrics = BatchMetrics()
+        start = asyncio.get_running_loop().time()
+        try:
+            with collecting(metrics), metrics.stage("total"):
+                pecha_id = await self.run(
+                    work_id,
+                    batch_number,
+                    ocr_engine,
+                    str(get_job_data_dir(data_dir, job)),
+                )
+            if pecha_id:
+                record["status"] = "succeeded"
+                record["pecha_id"] = pecha_id
+            else:
+                record["error"] = "Pecha upload failed"
+        except Exception as e:
+            record["error"] = str(e)
+        record["duration"] = round(asyncio.get_running_loop().time() - start, 3)
+        record["metrics"] = metrics.to_dict()
+        return record
+
+
+async def run_works(
+    work_ids: List[str],
+    data_dir: str = "./data",
+    max_jobs: int = DEFAULT_JOB_CONCURRENCY,
+    stage_concurrency: Optional[Dict[str, int]] = None,
+    sync: bool = False,
+    metrics_sink: Optional[MetricsSink] = None,
+    published: Optional[PublishedRecord] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Discover and run every batch of the given works on the current event loop.
+
+    Batches start as soon as their work has been listed, with at most
+    max_jobs batches in flight. Each finished job record is written to
+    metrics_sink, if given. Batches found in the published record are not
+    run, and the ones uploaded are added to it.
+
+    Returns:
+        One batch_runner-style summary record per job.
+    """
+    data_dir_path = Path(data_dir).resolve()
+    job_slots = asyncio.Semaphore(max_jobs)
+
+    async with AsyncPipeline(
+        str(data_dir_path), stage_concurrency, sync=sync
+    ) as pipeline:
+
+        async def run_slot(job: Job) -> Dict[str, Any]:
+            async with job_slots:
+                record = await pipeline.run_job(job, data_dir_path)
+            if metrics_sink:
+                metrics_sink.add(record)
+            if published and record["pecha_id"]:
+                published.add(get_document_id(*job), record["pecha_id"])
+            if record["status"] == "succeeded":
+                logger.info(f"✅ Successfully processed {'/'.join(job)}")
+            else:
+                logger.error(f"❌ Error processing {'/'.join(job)}: {record['error']}")
+            return record
+
+        async def run_work(work_id: str) -> List[Dict[str, Any]]:
+            jobs = await pipeline.get_work_batches(work_id)
+            if not jobs:
+                logger.warning(f"No OCR data found for work ID: {work_id}")
+            if published:
+                jobs = filter_published(jobs, published)
+            return list(await asyncio.gather(*(run_slot(job) for job in jobs)))
+
+        results = await asyncio.gather(*(run_work(w) for w in work_ids))
+    return [record for records in results for record in records]
+
+
+def main():
+    """
+    Main function to run the script.
+    """
+    parser = argparse.ArgumentParser(
+        description="Run the pipeline for a list of work IDs on one event loop"
+    )
+    add_run_arguments(
+        parser,
+        (
+            "--input",
+            "--summary",
+            "--data-dir",
+            "--sync",
+            "--metrics",
+            "--prometheus-textfile",
+            "--published",
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=DEFAULT_JOB_CONCURRENCY,
+        help="Number of batches in flight",
+    )
+    for stage in STAGES:
+        parser.add_argument(
+            f"--{stage}-limit",
+            type=int,
+            default=DEFAULT_STAGE_CONCURRENCY[stage],
+            help=f"Maximum number of concurrent {stage} operations",
+        )
+    args = parser.parse_args()
+
+    work_ids = read_input_work_ids(args.input)
+
+    started_at = datetime.now(timezone.utc)
+    published = PublishedRecord(args.published) if args.published else None
+    records = asyncio.run(
+        run_works(
+            work_ids,
+            data_dir=args.data_dir,
+            max_jobs=args.jobs,
+            stage_concurrency={
+                stage: getattr(args, f"{stage}_limit") for stage in STAGES
+            },
+            sync=args.sync,
+            metrics_sink=MetricsSink(args.metrics, args.prometheus_textfile),
+            published=published,
+        )
+    )
+    if published:
+        published.close()
+    write_summary(records, started_at, args.summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,531 @@
+"""
+Run the pipeline over many works, scheduling (work, engine, batch) jobs across a process pool.
+
+# Process every work ID listed in a file (e.g. the output of list_works --output)
+python -m bdrc_work_to_pecha_pipeline.batch_runner --input work_ids.txt
+
+# Read work IDs from stdin and save a JSON summary
+cat work_ids.txt | python -m bdrc_work_to_pecha_pipeline.batch_runner --summary summary.json
+
+# Run 8 jobs at once but let only 2 of them upload at the same time
+python -m bdrc_work_to_pecha_pipeline.batch_runner --input work_ids.txt --workers 8 --upload-limit 2
+
+# Plan batches and downloads from a local catalog instead of listing S3
+python -m bdrc_work_to_pecha_pipeline.batch_runner --input work_ids.txt --catalog catalog.db
+
+# Re-run over existing data, only fetching files whose size or ETag changed
+python -m bdrc_work_to_pecha_pipeline.batch_runner --input work_ids.txt --sync
+
+# Stream OCR files from S3 into in-memory archives instead of ./data
+python -m bdrc_work_to_pecha_pipeline.batch_runner --input work_ids.txt --streaming
+
+# Record per-batch stage timings and byte counts, plus a Prometheus textfile
+python -m bdrc_work_to_pecha_pipeline.batch_runner --input work_ids.txt --metrics m.jsonl --prometheus-textfile m.prom
+
+# Write registry entries to S3 every 5 minutes instead of after every pecha
+python -m bdrc_work_to_pecha_pipeline.batch_runner --input work_ids.txt --batch-registry 300
+
+# Checkpoint finished stages so that re-running after a crash resumes each job
+python -m bdrc_work_to_pecha_pipeline.batch_runner --input work_ids.txt --state job_state.db
+
+# Only process batches that are not in the local record of published batches
+python -m bdrc_work_to_pecha_pipeline.batch_runner --input work_ids.txt --published published.db
+
+# Give every download thread its own S3 client with a pool of 16 connections
+python -m bdrc_work_to_pecha_pipeline.batch_runner --input work_ids.txt --s3-client-scope thread --s3-pool-size 16
+
+# Keep downloaded works and archives under 50 GB, evicting uploaded works first
+python -m bdrc_work_to_pecha_pipeline.batch_runner --input work_ids.txt --scratch-budget 50
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bdrc_work_to_pecha_pipeline.catalog import Catalog
+from bdrc_work_to_pecha_pipeline.config import S3Options, configure_s3
+from bdrc_work_to_pecha_pipeline.job_state import JobStateStore
+from bdrc_work_to_pecha_pipeline.logger import get_logger
+from bdrc_work_to_pecha_pipeline.metadata import get_document_id, prefetch_buda_data
+from bdrc_work_to_pecha_pipeline.metrics import BatchMetrics, MetricsSink
+from bdrc_work_to_pecha_pipeline.pecha_registry import (
+    DEFAULT_FLUSH_INTERVAL,
+    RegistryBatch,
+    flush_journals,
+)
+from bdrc_work_to_pecha_pipeline.pecha_upload import get_work_batches, run_pipeline
+from bdrc_work_to_pecha_pipeline.published import PublishedRecord
+from bdrc_work_to_pecha_pipeline.scratch import GB, SCRATCH_DB_NAME, ScratchSpace
+
+logger = get_logger(__name__)
+
+STAGES = ("download", "metadata", "zip", "upload")
+
+Job = Tuple[str, str, str]
+
+# Worker registry journals, under the data directory
+REGISTRY_JOURNAL_DIR = ".registry_journal"
+
+# Per-stage semaphores shared by every worker process and the worker's own
+# catalog, job state, published record and scratch space connections, set by
+# _init_worker
+_stage_limits: Optional[Dict[str, Any]] = None
+_catalog: Optional[Catalog] = None
+_job_state: Optional[JobStateStore] = None
+_published: Optional[PublishedRecord] = None
+_scratch: Optional[ScratchSpace] = None
+
+
+def read_work_ids(lines: Iterable[str]) -> List[str]:
+    """
+    Parse work IDs from lines of text, one ID per line.
+
+    Blank lines, '#' comments and lines containing whitespace (e.g. log output
+    captured together with the IDs) are ignored. Duplicates are dropped while
+    preserving order.
+    """
+    work_ids: List[str] = []
+    seen = set()
+    for line in lines:
+        work_id = line.strip()
+        if not work_id or work_id.startswith("#") or len(work_id.split()) > 1:
+            continue
+        if work_id not in seen:
+            seen.add(work_id)
+            work_ids.append(work_id)
+    return work_ids
+
+
+def discover_jobs(
+    work_ids: List[str], max_workers: int = 8, catalog: Optional[Catalog] = None
+) -> List[Job]:
+    """
+    Find every (work_id, ocr_engine, batch_number) job for the given works.
+    """
+    jobs: List[Job] = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        all_batches = executor.map(lambda w: get_work_batches(w, catalog), work_ids)
+        for work_id, batches in zip(work_ids, all_batches):
+            if not batches:
+                logger.warning(f"No OCR data found for work ID: {work_id}")
+            jobs.extend(sorted(batches))
+    return jobs
+
+
+def filter_published(jobs: List[Job], published: PublishedRecord) -> List[Job]:
+    """
+    Drop the jobs whose batch is already in the published record.
+    """
+    return [job for job in jobs if get_document_id(*job) not in published]
+
+
+def _init_worker(
+    stage_limits: Dict[str, Any],
+    catalog_path: Optional[str],
+    registry_journal_dir: Optional[str] = None,
+    registry_flush_interval: Optional[float] = None,
+    state_path: Optional[str] = None,
+    published_path: Optional[str] = None,
+    s3_options: Optional[Dict[str, Any]] = None,
+    scratch_path: Optional[str] = None,
+    scratch_budget: Optional[int] = None,
+) -> None:
+    global _stage_limits, _catalog, _job_state, _published, _scratch
+    if s3_options:
+        configure_s3(**s3_options)
+    _stage_limits = stage_limits
+    _catalog = Catalog(catalog_path) if catalog_path else None
+    _job_state = JobStateStore(state_path) if state_path else None
+    _published = PublishedRecord(published_path) if published_path else None
+    if scratch_path and scratch_budget is not None:
+        _scratch = ScratchSpace(scratch_path, scratch_budget)
+    if registry_journal_dir:
+        # Whatever the worker has not flushed when the pool shuts down is
+        # flushed from its journal by run_jobs
+        RegistryBatch(
+            Path(registry_journal_dir) / f"{os.getpid()}.jsonl",
+            (
+                registry_flush_interval
+                if registry_flush_interval is not None
+                else DEFAULT_FLUSH_INTERVAL
+            ),
+        ).activate()
+
+
+def run_job(
+    job: Job, data_dir: str, sync: bool = False, streaming: bool = False
+) -> Dict[str, Any]:
+    """
+    Run the pipeline for a single job inside a worker process.
+
+    Returns a summary record for the job, including its stage timings and
+    counters (see metrics.BatchMetrics); errors are captured, not raised.
+    """
+    work_id, ocr_engine, batch_number = job
+    record: Dict[str, Any] = {
+        "work_id": work_id,
+        "ocr_engine": ocr_engine,
+        "batch_number": batch_number,
+        "status": "failed",
+        "pecha_id": None,
+        "error": None,
+    }
+    metrics = BatchMetrics()
+    start = time.monotonic()
+    try:
+        pecha_id = run_pipeline(
+            work_id=work_id,
+            batch_number=batch_number,
+            ocr_engine=ocr_engine,
+            base_data_dir=data_dir,
+            stage_limits=_stage_limits,
+            catalog=_catalog,
+            sync=sync,
+            streaming=streaming,
+            metrics=metrics,
+            job_state=_job_state,
+            published=_published,
+            scratch=_scratch,
+        )
+        if pecha_id:
+            record["status"] = "succeeded"
+            record["pecha_id"] = pecha_id
+        else:
+            record["error"] = "Pecha upload failed"
+    except Exception as e:
+        record["error"] = str(e)
+    record["duration"] = round(time.monotonic() - start, 3)
+    record["metrics"] = metrics.to_dict()
+    return record
+
+
+def build_summary(
+    records: List[Dict[str, Any]], started_at: datetime, finished_at: datetime
+) -> Dict[str, Any]:
+    """
+    Build the machine-readable summary of a batch run.
+    """
+    succeeded = sum(1 for record in records if record["status"] == "succeeded")
+    return {
+        "started_at": started_at.isoformat(),
+        "finished_at": finished_at.isoformat(),
+        "total": len(records),
+        "succeeded": succeeded,
+        "failed": len(records) - succeeded,
+        "jobs": sorted(
+            records,
+            key=lambda r: (r["work_id"], r["ocr_engine"], r["batch_number"]),
+        ),
+    }
+
+
+# Command-line options shared by batch_runner, staged_pipeline and
+# async_pipeline, added with add_run_arguments
+RUN_ARGUMENTS: Dict[str, Dict[str, Any]] = {
+    "--input": {
+        "type": str,
+        "help": "File with one work ID per line (defaults to stdin)",
+    },
+    "--summary": {"type": str, "help": "Output file for the JSON run summary"},
+    "--data-dir": {
+        "type": str,
+        "default": "./data",
+        "help": "Directory for downloaded data",
+    },
+    "--catalog": {
+        "type": str,
+        "help": "Local catalog database to use instead of S3",
+    },
+    "--sync": {
+        "action": "store_true",
+        "help": "Re-download only files whose size or ETag changed",
+    },
+    "--streaming": {
+        "action": "store_true",
+        "help": "Stream OCR files from S3 into the archive instead of downloading them",
+    },
+    "--metrics": {
+        "type": str,
+        "help": "JSON lines file to append per-batch metrics to",
+    },
+    "--prometheus-textfile": {
+        "type": str,
+        "help": "Prometheus textfile to keep updated with the run's totals",
+    },
+    "--state": {
+        "type": str,
+        "metavar": "FILE",
+        "help": "Checkpoint job stages to FILE and skip stages already finished there",
+    },
+    "--published": {
+        "type": str,
+        "metavar": "FILE",
+        "help": "Skip batches recorded as published in FILE and record new ones",
+    },
+    "--scratch-budget": {
+        "type": float,
+        "metavar": "GB",
+        "help": "Disk space downloaded works may use; uploaded works are evicted first",
+    },
+}
+
+
+def add_run_arguments(
+    parser: argparse.ArgumentParser, names: Iterable[str] = tuple(RUN_ARGUMENTS)
+) -> None:
+    """
+    Add some (by default all) of the options in RUN_ARGUMENTS to a parser.
+    """
+    for name in names:
+        parser.add_argument(name, **RUN_ARGUMENTS[name])
+
+
+def read_input_work_ids(path: Optional[str]) -> List[str]:
+    """
+    Read the work IDs of a run from a file, or from stdin if path is None.
+    """
+    if path:
+        with open(path) as f:
+            work_ids = read_work_ids(f)
+    else:
+        work_ids = read_work_ids(sys.stdin)
+    logger.info(f"Read {len(work_ids)} work ID(s)")
+    return work_ids
+
+
+def plan_jobs(
+    work_ids: List[str],
+    catalog: Optional[Catalog] = None,
+    published: Optional[PublishedRecord] = None,
+) -> List[Job]:
+    """
+    Discover the jobs of the given works, drop those already published and
+    fill the BUDA cache for the rest.
+    """
+    jobs = discover_jobs(work_ids, catalog=catalog)
+    if published:
+        found = len(jobs)
+        jobs = filter_published(jobs, published)
+        logger.info(f"Skipping {found - len(jobs)} already published batch(es)")
+    logger.info(f"Found {len(jobs)} batch(es) to process")
+    # Fill the BUDA cache once per work rather than from every batch
+    prefetch_buda_data(work_id for work_id, _, _ in jobs)
+    return jobs
+
+
+def write_summary(
+    records: List[Dict[str, Any]], started_at: datetime, path: Optional[str]
+) -> None:
+    """
+    Log the outcome of a run and write its summary to path, or to stdout if
+    path is None.
+    """
+    summary = build_summary(records, started_at, datetime.now(timezone.utc))
+    logger.info(
+        f"Processed {summary['total']} batch(es): "
+        f"{summary['succeeded']} succeeded, {summary['failed']} failed"
+    )
+    if path:
+        with open(path, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Saved run summary to {path}")
+    else:
+        print(json.dumps(summary, indent=2))
+
+
+def run_jobs(
+    jobs: List[Job],
+    data_dir: str = "./data",
+    max_workers: int = 4,
+    stage_concurrency: Optional[Dict[str, int]] = None,
+    catalog_path: Optional[str] = None,
+    sync: bool = False,
+    streaming: bool = False,
+    registry_flush_interval: Optional[float] = None,
+    metrics_sink: Optional[MetricsSink] = None,
+    state_path: Optional[str] = None,
+    published_path: Optional[str] = None,
+    s3_options: Optional[Dict[str, Any]] = None,
+    scratch_budget: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Run jobs across a process pool.
+
+    Args:
+        jobs: (work_id, ocr_engine, batch_number) tuples to process.
+        data_dir: Root directory for downloaded data and zip files.
+        max_workers: Number of worker processes.
+        stage_concurrency: Optional maximum number of jobs allowed in each
+            stage at once, keyed by stage name (see STAGES).
+        catalog_path: Optional local catalog used instead of listing S3.
+        sync: Only download new, changed or incomplete files.
+        streaming: Package OCR files straight from S3 without using data_dir.
+        registry_flush_interval: If set, workers batch their pecha registry
+            writes and flush them at this interval (in seconds); the rest is
+            flushed once all jobs have finished.
+        metrics_sink: Optional sink each job record is written to as it
+            finishes.
+        state_path: Optional job state database in which workers checkpoint
+            finished stages; stages already finished there are skipped.
+        published_path: Optional record of published batches, which workers
+            consult before running a job and add their uploads to.
+        s3_options: Optional config.S3Options fields applied in every worker.
+        scratch_budget: If set, the bytes that downloaded works and their
+            archives may use in data_dir (see scratch.ScratchSpace).
+
+    Returns:
+        One summary record per job.
+    """
+    # Resolve once so every worker process uses the same absolute data directory
+    data_dir = str(Path(data_dir).resolve())
+    records: List[Dict[str, Any]] = []
+
+    registry_journal_dir = None
+    if registry_flush_interval is not None:
+        registry_journal_dir = str(Path(data_dir) / REGISTRY_JOURNAL_DIR)
+        # Registrations journaled by an earlier run that did not finish
+        flush_journals(registry_journal_dir)
+
+    with multiprocessing.Manager() as manager:
+        stage_limits = {
+            stage: manager.BoundedSemaphore(limit)
+            for stage, limit in (stage_concurrency or {}).items()
+            if limit
+        }
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_worker,
+            initargs=(
+                stage_limits,
+                catalog_path,
+                registry_journal_dir,
+                registry_flush_interval,
+                state_path,
+                published_path,
+                s3_options,
+                str(Path(data_dir) / SCRATCH_DB_NAME),
+                scratch_budget,
+            ),
+        ) as executor:
+            futures = {
+                executor.submit(run_job, job, data_dir, sync, streaming): job
+                for job in jobs
+            }
+            for future in as_completed(futures):
+                work_id, ocr_engine, batch_number = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    # The worker process itself died
+                    record = {
+                        "work_id": work_id,
+                        "ocr_engine": ocr_engine,
+                        "batch_number": batch_number,
+                        "status": "failed",
+                        "pecha_id": None,
+                        "error": str(e),
+                    }
+                if record["status"] == "succeeded":
+                    logger.info(
+                        f"✅ Successfully processed {work_id}/{ocr_engine}/{batch_number}"
+                    )
+                else:
+                    logger.error(
+                        f"❌ Error processing {work_id}/{ocr_engine}/{batch_number}: {record['error']}"
+                    )
+                records.append(record)
+                if metrics_sink:
+                    metrics_sink.add(record)
+
+    if registry_journal_dir:
+        flushed = flush_journals(registry_journal_dir)
+        logger.info(f"Flushed {flushed} batched registration(s) at shutdown")
+    return records
+
+
+def main():
+    """
+    Main function to run the script.
+    """
+    parser = argparse.ArgumentParser(
+        description="Run the pipeline for a list of work IDs"
+    )
+    add_run_arguments(parser)
+    parser.add_argument(
+        "--batch-registry",
+        type=float,
+        metavar="SECONDS",
+        help="Batch pecha registry writes, flushing them at this interval",
+    )
+    parser.add_argument(
+        "--s3-pool-size",
+        type=int,
+        default=S3Options.max_pool_connections,
+        help="HTTP connections per S3 client",
+    )
+    parser.add_argument(
+        "--s3-client-scope",
+        choices=("process", "thread"),
+        default=S3Options.scope,
+        help="Share one S3 client per process or give each thread its own",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Number of worker processes"
+    )
+    for stage in STAGES:
+        parser.add_argument(
+            f"--{stage}-limit",
+            type=int,
+            default=0,
+            help=f"Maximum number of jobs in the {stage} stage at once (0 = no limit)",
+        )
+    args = parser.parse_args()
+
+    work_ids = read_input_work_ids(args.input)
+
+    s3_options = {
+        "max_pool_connections": args.s3_pool_size,
+        "scope": args.s3_client_scope,
+    }
+    configure_s3(**s3_options)
+
+    started_at = datetime.now(timezone.utc)
+    # Worker processes open their own catalog and published record: these are
+    # closed before the pool forks, so no worker inherits a SQLite connection
+    catalog = Catalog(args.catalog) if args.catalog else None
+    published = PublishedRecord(args.published) if args.published else None
+    jobs = plan_jobs(work_ids, catalog, published)
+    if catalog:
+        catalog.close()
+    if published:
+        published.close()
+
+    stage_concurrency = {stage: getattr(args, f"{stage}_limit") for stage in STAGES}
+    records = run_jobs(
+        jobs,
+        data_dir=args.data_dir,
+        max_workers=args.workers,
+        stage_concurrency=stage_concurrency,
+        catalog_path=args.catalog,
+        sync=args.sync,
+        streaming=args.streaming,
+        registry_flush_interval=args.batch_registry,
+        metrics_sink=MetricsSink(args.metrics, args.prometheus_textfile),
+        state_path=args.state,
+        published_path=args.published,
+        s3_options=s3_options,
+        scratch_budget=(
+            int(args.scratch_budget * GB) if args.scratch_budget is not None else None
+        ),
+    )
+    write_summary(records, started_at, args.summary)
+
+
+if __name__ == "__main__":
+    main()
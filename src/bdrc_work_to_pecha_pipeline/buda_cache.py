@@ -0,0 +1,172 @@
+"""
+On-disk cache of BUDA scan info, keyed by work ID.
+
+The scan info of a work is the same for all of its OCR engines and batches, so
+it is fetched from BUDA once and then read from the cache directory, across
+batches, worker processes and re-runs. Entries expire after a TTL, and the
+least recently used entries are evicted when the cache grows past its size
+limit. The directory is only scanned when the size of the entries this
+process wrote takes the cache past the limit, and every EVICT_CHECK_INTERVAL
+puts to account for the entries of other processes.
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from bdrc_work_to_pecha_pipeline.logger import get_logger
+from bdrc_work_to_pecha_pipeline.manifest import write_json_atomic
+
+logger = get_logger(__name__)
+
+DEFAULT_BUDA_CACHE_DIR = Path(".buda_cache")
+
+# Scan info rarely changes; refetch it after a week
+DEFAULT_BUDA_CACHE_TTL = 7 * 24 * 3600.0
+
+# Total size of the cache files above which the least recently used are evicted
+DEFAULT_BUDA_CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+# Puts between scans of the cache directory while it seems below its size limit
+EVICT_CHECK_INTERVAL = 100
+
+
+def get_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+class BudaCache:
+    """
+    Directory of <work_id>.json files holding the scan info and the time it was
+    fetched. File modification times track last use, for eviction.
+
+    Concurrent lookups of the same work in one process share a single fetch.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path = DEFAULT_BUDA_CACHE_DIR,
+        ttl: float = DEFAULT_BUDA_CACHE_TTL,
+        max_size: int = DEFAULT_BUDA_CACHE_MAX_SIZE,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.max_size = max_size
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        # Size of the cache as of the last scan plus what was put since
+        self._size: Optional[int] = None
+        self._puts = 0
+        self._size_lock = threading.Lock()
+
+    def get_path(self, work_id: str) -> Path:
+        return self.cache_dir / f"{work_id}.json"
+
+    def get(self, work_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the cached scan info, or None if it is missing or expired.
+        """
+        path = self.get_path(work_id)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if time.time() - entry.get("fetched_at", 0) >= self.ttl:
+            return None
+        try:
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            pass
+        return entry["data"]
+
+    def put(self, work_id: str, data: Dict[str, Any]) -> None:
+        path = self.get_path(work_id)
+        old_size = get_size(path)
+        write_json_atomic(path, {"fetched_at": time.time(), "data": data})
+        added = get_size(path) - old_size
+        with self._size_lock:
+            self._puts += 1
+            if self._size is not None:
+                self._size += added
+            due = self._size is None or self._size > self.max_size
+            if self._puts % EVICT_CHECK_INTERVAL == 0:
+                due = True
+        if due:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Delete the least recently used entries until the cache fits in max_size.
+
+        Returns:
+            Number of entries deleted.
+        """
+        entries = []
+        total_size = 0
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            total_size -= size
+            evicted += 1
+        with self._size_lock:
+            self._size = total_size
+        if evicted:
+            logger.debug(f"Evicted {evicted} BUDA cache entries")
+        return evicted
+
+    def get_or_fetch(
+        self, work_id: str, fetch: Callable[[str], Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """
+        Return the cached scan info, calling fetch(work_id) and caching its
+        result on a miss. Errors from fetch are not cached.
+        """
+        data = self.get(work_id)
+        if data is not None:
+            return data
+        with self._locks_lock:
+            lock = self._locks.setdefault(work_id, threading.Lock())
+        with lock:
+            # Another thread may have fetched it while this one waited
+            data = self.get(work_id)
+            if data is None:
+                data = fetch(work_id)
+                self.put(work_id, data)
+            return data
+
+
+_buda_cache: Optional[BudaCache] = None
+_buda_cache_options: Dict[str, Any] = {}
+
+
+def configure_buda_cache(**options) -> None:
+    """
+    Set the BudaCache arguments (cache_dir, ttl, max_size) used by
+    get_buda_cache(). Applies to caches created afterwards.
+    """
+    global _buda_cache
+    _buda_cache_options.clear()
+    _buda_cache_options.update(options)
+    _buda_cache = None
+
+
+def get_buda_cache() -> BudaCache:
+    global _buda_cache
+    if _buda_cache is None:
+        _buda_cache = BudaCache(**_buda_cache_options)
+    return _buda_cache
@@ -0,0 +1,290 @@
+"""
+Local SQLite catalog of the objects in the OCR output bucket.
+
+The catalog records every key under 'Works/' together with its size, ETag and
+LastModified date, indexed by work, OCR engine and batch, so that batch
+discovery and download planning can be done without listing S3.
+
+# Build or refresh the whole catalog
+python -m bdrc_work_to_pecha_pipeline.catalog --db catalog.db
+
+# Only re-list hash directories not refreshed in the last 24 hours
+python -m bdrc_work_to_pecha_pipeline.catalog --db catalog.db --max-age 86400
+
+# Re-list the hash directories of specific works
+python -m bdrc_work_to_pecha_pipeline.catalog --db catalog.db --work-ids W1234 W5678
+"""
+import argparse
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bdrc_work_to_pecha_pipeline.download import S3Object, get_hash, iter_s3_objects
+from bdrc_work_to_pecha_pipeline.list_works import (
+    DEFAULT_LISTING_WORKERS,
+    build_work_details,
+    list_all_hash_directories,
+)
+from bdrc_work_to_pecha_pipeline.logger import get_logger
+from bdrc_work_to_pecha_pipeline.sqlite_store import SQLiteStore
+
+logger = get_logger(__name__)
+
+DEFAULT_CATALOG_FILE = "catalog.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    key TEXT PRIMARY KEY,
+    hash_dir TEXT NOT NULL,
+    work_id TEXT,
+    ocr_engine TEXT,
+    batch TEXT,
+    size INTEGER,
+    etag TEXT,
+    last_modified TEXT
+);
+CREATE INDEX IF NOT EXISTS objects_work ON objects (work_id, ocr_engine, batch);
+CREATE INDEX IF NOT EXISTS objects_hash_dir ON objects (hash_dir);
+CREATE TABLE IF NOT EXISTS hash_dirs (
+    hash_dir TEXT PRIMARY KEY,
+    refreshed_at REAL NOT NULL,
+    object_count INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL
+);
+"""
+
+
+def parse_key(key: str) -> Tuple[str, Optional[str], Optional[str], Optional[str]]:
+    """
+    Split a key such as 'Works/a1/W1234/vision/batch001/...' into its hash
+    directory, work ID, OCR engine and batch. Missing levels are None.
+    """
+    parts = key.split("/")
+    hash_dir = "/".join(parts[:2]) + "/"
+    work_id = parts[2] if len(parts) >= 4 else None
+    ocr_engine = parts[3] if len(parts) >= 5 else None
+    batch = parts[4] if len(parts) >= 6 else None
+    return hash_dir, work_id, ocr_engine, batch
+
+
+def to_row(obj: Dict[str, Any]) -> Tuple:
+    """
+    Convert an S3 listing entry into an objects table row.
+    """
+    key = obj["Key"]
+    last_modified = obj.get("LastModified")
+    if last_modified is not None and not isinstance(last_modified, str):
+        last_modified = last_modified.isoformat()
+    return (
+        key,
+        *parse_key(key),
+        obj.get("Size"),
+        obj.get("ETag", "").strip('"') or None,
+        last_modified,
+    )
+
+
+def list_hash_dir(hash_dir: str) -> List[Dict[str, Any]]:
+    """
+    List every object under a hash directory.
+    """
+    return list(iter_s3_objects(hash_dir))
+
+
+def fingerprint(rows: Iterable[Tuple]) -> str:
+    """
+    Digest of the keys and ETags of a hash directory, used to tell whether a
+    re-listing found any change.
+    """
+    md5 = hashlib.md5()
+    for row in sorted(rows):
+        md5.update(f"{row[0]}\0{row[6]}\n".encode())
+    return md5.hexdigest()
+
+
+class Catalog(SQLiteStore):
+    """
+    SQLite-backed index of the OCR output bucket. Open one Catalog per
+    process (see sqlite_store.SQLiteStore).
+    """
+
+    def __init__(self, path: str = DEFAULT_CATALOG_FILE):
+        super().__init__(path, SCHEMA)
+
+    def _query(self, sql: str, params: Tuple = ()) -> List[Tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def add_objects(self, objects: Iterable[Dict[str, Any]]) -> int:
+        """
+        Insert or update listing entries (as returned by list_objects_v2).
+
+        Returns:
+            Number of objects written
+        """
+        rows = [to_row(obj) for obj in objects]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+        return len(rows)
+
+    def replace_hash_dir(
+        self, hash_dir: str, objects: Iterable[Dict[str, Any]]
+    ) -> bool:
+        """
+        Replace everything recorded under a hash directory with a fresh listing.
+
+        Returns:
+            True if the listing differs from what was recorded before
+        """
+        rows = [to_row(obj) for obj in objects]
+        new_fingerprint = fingerprint(rows)
+        with self._lock, self._conn:
+            previous = self._conn.execute(
+                "SELECT fingerprint FROM hash_dirs WHERE hash_dir = ?", (hash_dir,)
+            ).fetchone()
+            self._conn.execute("DELETE FROM objects WHERE hash_dir = ?", (hash_dir,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO hash_dirs VALUES (?, ?, ?, ?)",
+                (hash_dir, time.time(), len(rows), new_fingerprint),
+            )
+        return previous is None or previous[0] != new_fingerprint
+
+    def get_stale_hash_dirs(self, hash_dirs: List[str], max_age: float) -> List[str]:
+        """
+        Return the hash directories not refreshed within the last max_age seconds.
+        """
+        refreshed_at = dict(self._query("SELECT hash_dir, refreshed_at FROM hash_dirs"))
+        cutoff = time.time() - max_age
+        return [d for d in hash_dirs if refreshed_at.get(d, 0) < cutoff]
+
+    def refresh(
+        self,
+        hash_dirs: Optional[List[str]] = None,
+        work_ids: Optional[List[str]] = None,
+        max_age: Optional[float] = None,
+        max_workers: int = DEFAULT_LISTING_WORKERS,
+    ) -> List[str]:
+        """
+        Re-list hash directories from S3 and update the catalog.
+
+        S3 exposes no per-prefix modification marker, so the refresh is made
+        incremental by choosing which hash directories to re-list: the ones
+        given explicitly, the ones holding the given work IDs, and, with
+        max_age, only those not refreshed recently. With no arguments every
+        hash directory is re-listed.
+
+        Returns:
+            The hash directories whose contents changed
+        """
+        if work_ids:
+            hash_dirs = sorted(
+                set(hash_dirs or []) | {f"Works/{get_hash(w)}/" for w in work_ids}
+            )
+        elif hash_dirs is None:
+            hash_dirs = list_all_hash_directories()
+        if max_age is not None:
+            hash_dirs = self.get_stale_hash_dirs(hash_dirs, max_age)
+        logger.info(f"Refreshing {len(hash_dirs)} hash directories")
+
+        changed = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(list_hash_dir, hash_dir): hash_dir
+                for hash_dir in hash_dirs
+            }
+            for future in as_completed(futures):
+                hash_dir = futures[future]
+                try:
+                    objects = future.result()
+                except Exception as e:
+                    logger.error(f"Error listing {hash_dir}: {e}")
+                    continue
+                if self.replace_hash_dir(hash_dir, objects):
+                    changed.append(hash_dir)
+        logger.info(f"{len(changed)} hash directories changed")
+        return sorted(changed)
+
+    def get_keys(self, prefix: str) -> List[str]:
+        """
+        Return the recorded keys under a prefix, in the same order as an S3 listing.
+        """
+        return [row[0] for row in self.get_objects(prefix)]
+
+    def get_objects(self, prefix: str) -> List[S3Object]:
+        """
+        Return (key, size, etag) for every recorded key under a prefix, or
+        every recorded key if the prefix is empty.
+        """
+        if not prefix:
+            rows = self._query("SELECT key, size, etag FROM objects ORDER BY key")
+            return [S3Object(*row) for row in rows]
+        # Range scan on the primary key: every key starting with prefix sorts
+        # between prefix and prefix with its last character incremented.
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        rows = self._query(
+            "SELECT key, size, etag FROM objects WHERE key >= ? AND key < ? "
+            "ORDER BY key",
+            (prefix, upper),
+        )
+        return [S3Object(*row) for row in rows]
+
+    def list_work_ids(self) -> List[str]:
+        """
+        List the recorded work IDs, ordered by hash directory and then work ID.
+        """
+        rows = self._query(
+            "SELECT DISTINCT hash_dir, work_id FROM objects "
+            "WHERE work_id IS NOT NULL ORDER BY hash_dir, work_id"
+        )
+        return [work_id for _, work_id in rows]
+
+    def get_work_details(self) -> Dict[str, Dict]:
+        """
+        Same structure as list_works.get_work_details, built from the catalog.
+        """
+        rows = self._query("SELECT key FROM objects WHERE ocr_engine IS NOT NULL")
+        return build_work_details(row[0] for row in rows)
+
+
+def main():
+    """
+    Main function to run the script.
+    """
+    parser = argparse.ArgumentParser(
+        description="Build or refresh the local catalog of the OCR output bucket"
+    )
+    parser.add_argument(
+        "--db", type=str, default=DEFAULT_CATALOG_FILE, help="Catalog database file"
+    )
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        help="Only re-list hash directories older than this many seconds",
+    )
+    parser.add_argument(
+        "--work-ids", nargs="+", help="Only re-list the hash directories of these works"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_LISTING_WORKERS,
+        help="Number of hash directories to list concurrently",
+    )
+    args = parser.parse_args()
+
+    with Catalog(args.db) as catalog:
+        changed = catalog.refresh(
+            work_ids=args.work_ids, max_age=args.max_age, max_workers=args.workers
+        )
+    for hash_dir in changed:
+        print(hash_dir)
+
+
+if __name__ == "__main__":
+    main()
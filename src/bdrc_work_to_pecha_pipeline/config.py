@@ -1,28 +1,280 @@
+"""
+AWS configuration and lazily created S3 clients.
+
+Nothing is read or created at import time: the credentials file is parsed and
+boto3 imported on the first call to an accessor. Clients are cached per
+process and created again in forked worker processes, which must not reuse
+the parent's connections. A client can be shared by threads; resources and
+Bucket objects cannot, so those are cached per thread.
+
+The connection pool size, the managed transfer settings (multipart threshold
+and chunk size, concurrency within one transfer) and whether each thread gets
+its own client are set with configure_s3().
+
+The module attributes of earlier versions (s3_client, s3_resource,
+bdrc_archive_session, ocr_output_bucket, ...) still resolve, through the
+accessors, but emit a DeprecationWarning.
+"""
 import configparser
 import os
+import threading
+import warnings
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
 
-import boto3
+if TYPE_CHECKING:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
 
 BDRC_ARCHIVE_BUCKET = "archive.tbrc.org"
 OCR_OUTPUT_BUCKET = "ocr.bdrc.io"
 
-aws_credentials_file = os.path.expanduser("~/.aws/credentials")
-config = configparser.ConfigParser()
-config.read(aws_credentials_file)
-
-aws_access_key_id = config.get(
-    "archive_tbrc_org", "aws_access_key_id", fallback="DUMMY_ACCESS_KEY"
-)
-aws_secret_access_key = config.get(
-    "archive_tbrc_org", "aws_secret_access_key", fallback="DUMMY_SECRET_KEY"
-)
-
-bdrc_archive_session = boto3.Session(
-    aws_access_key_id=aws_access_key_id,
-    aws_secret_access_key=aws_secret_access_key,
-)
-
-s3_client = bdrc_archive_session.client("s3")
-s3_resource = bdrc_archive_session.resource("s3")
-bdrc_archive_bucket = s3_resource.Bucket(BDRC_ARCHIVE_BUCKET)
-ocr_output_bucket = s3_resource.Bucket(OCR_OUTPUT_BUCKET)
+# Size of the shared client's HTTP connection pool. Must be at least as large as
+# the number of threads downloading concurrently, otherwise workers queue on sockets.
+S3_MAX_POOL_CONNECTIONS = 64
+
+# botocore retries of clients whose calls go through retry.RetryPolicy, which
+# has to see throttling errors to lower the adaptive limiter's bound
+S3_SINGLE_ATTEMPT_RETRIES = {"mode": "standard", "total_max_attempts": 1}
+
+AWS_CREDENTIALS_FILE = "~/.aws/credentials"
+AWS_CREDENTIALS_PROFILE = "archive_tbrc_org"
+
+MB = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class S3Options:
+    """
+    Settings of the S3 clients handed out by get_s3_client.
+
+    Attributes:
+        max_pool_connections: HTTP connections kept by each client.
+        multipart_threshold: Objects at least this large are downloaded in
+            ranged parts.
+        multipart_chunksize: Size of each part.
+        max_concurrency: Parts of one object fetched at once. OCR pages are
+            far below the threshold, so this only matters for large files;
+            concurrency across files comes from the download thread pool.
+        large_object_threshold: Listed objects at least this large (e.g. the
+            html.zip of Google Books image groups) are downloaded by
+            download.download_ranged, which resumes interrupted downloads and
+            verifies the result against the ETag, in parts of
+            multipart_chunksize bytes, max_concurrency at a time.
+        scope: "process" to share one client between the threads of a
+            process, or "thread" to give every thread its own client (and
+            connection pool).
+    """
+
+    max_pool_connections: int = S3_MAX_POOL_CONNECTIONS
+    multipart_threshold: int = 8 * MB
+    multipart_chunksize: int = 8 * MB
+    max_concurrency: int = 4
+    large_object_threshold: int = 64 * MB
+    scope: str = "process"
+
+    def __post_init__(self):
+        if self.scope not in ("process", "thread"):
+            raise ValueError(f"Unknown S3 client scope: {self.scope}")
+
+
+_lock = threading.Lock()
+_local = threading.local()
+_session: Optional["boto3.Session"] = None
+# Shared clients by whether they make a single attempt per call
+_s3_clients: Dict[bool, Any] = {}
+_pid: Optional[int] = None
+_s3_options = S3Options()
+# Bumped by configure_s3 so that thread-local clients are created again
+_s3_generation = 0
+
+
+@lru_cache(maxsize=None)
+def get_aws_credentials() -> Tuple[str, str]:
+    """
+    Return the (access key ID, secret access key) of the BDRC archive profile,
+    or dummy values when the credentials file does not have it.
+    """
+    config = configparser.ConfigParser()
+    config.read(os.path.expanduser(AWS_CREDENTIALS_FILE))
+    return (
+        config.get(
+            AWS_CREDENTIALS_PROFILE, "aws_access_key_id", fallback="DUMMY_ACCESS_KEY"
+        ),
+        config.get(
+            AWS_CREDENTIALS_PROFILE,
+            "aws_secret_access_key",
+            fallback="DUMMY_SECRET_KEY",
+        ),
+    )
+
+
+def _check_pid() -> None:
+    # Called with _lock held; forget the parent's session and client after a fork
+    global _session, _pid
+    if _pid != os.getpid():
+        _session = None
+        _s3_clients.clear()
+        _pid = os.getpid()
+
+
+def get_session() -> "boto3.Session":
+    """
+    Return this process's boto3 session for the BDRC archive account.
+    """
+    global _session
+    with _lock:
+        _check_pid()
+        if _session is None:
+            import boto3
+
+            aws_access_key_id, aws_secret_access_key = get_aws_credentials()
+            _session = boto3.Session(
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key,
+            )
+        return _session
+
+
+def configure_s3(**options) -> None:
+    """
+    Set the S3Options fields (e.g. max_pool_connections, scope) used by
+    get_s3_client() and get_transfer_config(). Clients created before are
+    replaced; forked worker processes inherit the options.
+    """
+    global _s3_options, _s3_generation
+    s3_options = S3Options(**options)
+    with _lock:
+        _s3_options = s3_options
+        _s3_clients.clear()
+        _s3_generation += 1
+    get_transfer_config.cache_clear()
+
+
+def get_s3_options() -> S3Options:
+    return _s3_options
+
+
+def _create_s3_client(session: "boto3.Session", single_attempt: bool) -> Any:
+    # Called with _lock held, as Session.client is not thread-safe
+    from botocore.config import Config
+
+    return session.client(
+        "s3",
+        config=Config(
+            max_pool_connections=_s3_options.max_pool_connections,
+            retries=S3_SINGLE_ATTEMPT_RETRIES if single_attempt else None,
+        ),
+    )
+
+
+def get_s3_client(single_attempt: bool = False) -> Any:
+    """
+    Return an S3 client for the calling thread: this process's shared client,
+    or with scope "thread" the thread's own one. Its connection pool holds
+    S3Options.max_pool_connections connections.
+
+    Args:
+        single_attempt: Return a client that does not retry failed calls
+            itself, for calls made through retry.RetryPolicy. With botocore
+            retrying throttled calls the policy would never see them, and the
+            adaptive limiter would not back off.
+    """
+    session = get_session()
+    with _lock:
+        if _s3_options.scope == "thread":
+            key = (os.getpid(), _s3_generation)
+            if getattr(_local, "clients_key", None) != key:
+                _local.clients = {}
+                _local.clients_key = key
+            clients = _local.clients
+        else:
+            clients = _s3_clients
+        if single_attempt not in clients:
+            clients[single_attempt] = _create_s3_client(session, single_attempt)
+        return clients[single_attempt]
+
+
+@lru_cache(maxsize=None)
+def get_transfer_config() -> "TransferConfig":
+    """
+    Return the managed transfer settings to pass as Config= to download_file.
+    """
+    from boto3.s3.transfer import TransferConfig
+
+    return TransferConfig(
+        multipart_threshold=_s3_options.multipart_threshold,
+        multipart_chunksize=_s3_options.multipart_chunksize,
+        max_concurrency=_s3_options.max_concurrency,
+    )
+
+
+def get_s3_resource() -> Any:
+    """
+    Return the calling thread's S3 resource.
+    """
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.pid = os.getpid()
+        session = get_session()
+        with _lock:
+            _local.resource = session.resource("s3")
+    return _local.resource
+
+
+def get_bucket(name: str) -> Any:
+    """
+    Return a Bucket object for the calling thread, e.g.
+    get_bucket(OCR_OUTPUT_BUCKET).
+    """
+    return get_s3_resource().Bucket(name)
+
+
+def _read_credentials_file() -> configparser.ConfigParser:
+    config = configparser.ConfigParser()
+    config.read(os.path.expanduser(AWS_CREDENTIALS_FILE))
+    return config
+
+
+# Module attributes created at import time by earlier versions, with the
+# accessor to use instead and a function returning an equivalent value
+_DEPRECATED_ATTRIBUTES: Dict[str, Tuple[str, Callable[[], Any]]] = {
+    "aws_credentials_file": (
+        "AWS_CREDENTIALS_FILE",
+        lambda: os.path.expanduser(AWS_CREDENTIALS_FILE),
+    ),
+    "config": ("get_aws_credentials()", _read_credentials_file),
+    "aws_access_key_id": ("get_aws_credentials()", lambda: get_aws_credentials()[0]),
+    "aws_secret_access_key": (
+        "get_aws_credentials()",
+        lambda: get_aws_credentials()[1],
+    ),
+    "bdrc_archive_session": ("get_session()", get_session),
+    "s3_client": ("get_s3_client()", get_s3_client),
+    "s3_resource": ("get_s3_resource()", get_s3_resource),
+    "bdrc_archive_bucket": (
+        "get_bucket(BDRC_ARCHIVE_BUCKET)",
+        lambda: get_bucket(BDRC_ARCHIVE_BUCKET),
+    ),
+    "ocr_output_bucket": (
+        "get_bucket(OCR_OUTPUT_BUCKET)",
+        lambda: get_bucket(OCR_OUTPUT_BUCKET),
+    ),
+}
+
+
+def __getattr__(name: str) -> Any:
+    """
+    Keep `from bdrc_work_to_pecha_pipeline.config import s3_client` and the
+    like working, with a DeprecationWarning, now that nothing is created at
+    import time.
+    """
+    if name not in _DEPRECATED_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    replacement, get_value = _DEPRECATED_ATTRIBUTES[name]
+    warnings.warn(
+        f"config.{name} is deprecated; use config.{replacement} instead",
+        DeprecationWarning,
+        stacklevel=2,
+    )
+    return get_value()
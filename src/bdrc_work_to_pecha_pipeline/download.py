@@ -1,8 +1,70 @@
 import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List, Optional
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
 
-from bdrc_work_to_pecha_pipeline.config import OCR_OUTPUT_BUCKET, s3_client
+from botocore.exceptions import IncompleteReadError
+
+from bdrc_work_to_pecha_pipeline.config import (
+    OCR_OUTPUT_BUCKET,
+    get_s3_client,
+    get_s3_options,
+    get_transfer_config,
+)
+from bdrc_work_to_pecha_pipeline.logger import get_logger
+from bdrc_work_to_pecha_pipeline.manifest import SyncManifest, get_manifest_path
+from bdrc_work_to_pecha_pipeline.metrics import count, submit_in_context, timed
+from bdrc_work_to_pecha_pipeline.retry import (
+    DEFAULT_RETRY_POLICY,
+    AdaptiveLimiter,
+    get_limiter,
+)
+
+logger = get_logger(__name__)
+
+# Number of objects fetched concurrently per batch. Kept below
+# config.S3_MAX_POOL_CONNECTIONS so every worker gets its own connection.
+DEFAULT_DOWNLOAD_WORKERS = 32
+
+# Downloads submitted per worker before waiting for one to finish
+DOWNLOAD_WINDOW_FACTOR = 2
+
+MB = 1024 * 1024
+
+# Bytes read from a response or a file at a time
+READ_CHUNK_SIZE = MB
+
+# ETags S3 derives from the MD5 of the content: the MD5 itself, or for a
+# multipart upload the MD5 of the part MD5s followed by the number of parts
+MD5_ETAG_PATTERN = re.compile(r"^[0-9a-f]{32}(-[0-9]+)?$")
+
+
+class S3Object(NamedTuple):
+    key: str
+    size: int
+    etag: str
 
 
 def get_hash(work_id):
@@ -17,56 +79,84 @@ def get_s3_prefix(work_id):
     return s3_prefix
 
 
-def get_s3_keys(prefix):
-    obj_keys = []
-    continuation_token = None
+def iter_s3_objects(prefix: str) -> Iterator[Dict[str, Any]]:
+    """
+    Stream the listing entries (Key, Size, ETag, LastModified, ...) of every
+    object under a prefix in the OCR output bucket.
+    """
+    paginator = get_s3_client().get_paginator("list_objects_v2")
+    pages = iter(paginator.paginate(Bucket=OCR_OUTPUT_BUCKET, Prefix=prefix))
     while True:
-        if continuation_token:
-            response = s3_client.list_objects_v2(
-                Bucket=OCR_OUTPUT_BUCKET,
-                Prefix=prefix,
-                ContinuationToken=continuation_token,
-            )
-        else:
-            response = s3_client.list_objects_v2(
-                Bucket=OCR_OUTPUT_BUCKET, Prefix=prefix
-            )
-        if response["Contents"]:
-            for obj in response["Contents"]:
-                obj_key = obj["Key"]
-                obj_keys.append(obj_key)
-        continuation_token = response.get("NextContinuationToken")
-        if not continuation_token:
+        # Only the wait for each page is timed, not the caller's work between pages
+        with timed("s3_list"):
+            page = next(pages, None)
+        if page is None:
             break
-    return obj_keys
+        contents = page.get("Contents", [])
+        count("list_pages")
+        count("objects_listed", len(contents))
+        yield from contents
 
 
-def download_gb_ocr_files(work_id: str, image_group_id: Optional[str], key: str):
+def get_s3_object(entry: Dict[str, Any]) -> S3Object:
+    """
+    Build an S3Object from a listing entry. The ETag is stored without its
+    quotes, as manifests and MD5 comparisons expect.
+    """
+    return S3Object(
+        entry["Key"], entry.get("Size", 0), entry.get("ETag", "").strip('"')
+    )
+
+
+def get_s3_keys(prefix):
+    return [obj["Key"] for obj in iter_s3_objects(prefix)]
+
+
+def iter_s3_keys(
+    prefix: str, key_filter: Optional[Callable[[str], bool]] = None
+) -> Iterator[S3Object]:
+    """
+    Stream (key, size, etag) for every object under a prefix, page by page.
+
+    Unlike get_s3_keys nothing is accumulated: each listing page is filtered
+    and yielded before the next one is requested, so consumers can start
+    downloading while the rest of the prefix is still being listed.
+
+    Args:
+        prefix: The key prefix to list.
+        key_filter: Optional predicate; keys for which it is false are dropped.
+
+    Yields:
+        S3Object tuples.
+    """
+    for entry in iter_s3_objects(prefix):
+        if key_filter is None or key_filter(entry["Key"]):
+            yield get_s3_object(entry)
+
+
+def get_gb_local_path(
+    work_id: str, image_group_id: Optional[str], key: str, base_data_dir: str = "./data"
+) -> Path:
+    """
+    Map a Google Books S3 key to its local path under base_data_dir.
+    """
     file_name = key.split("/")[-1]
 
     if file_name == "html.zip":
-        download_path = Path(f"./data/{work_id}/output/{image_group_id}/")
-        download_path.mkdir(parents=True, exist_ok=True)
-        local_file_path = f"{download_path}/html.zip"
+        download_path = Path(f"{base_data_dir}/{work_id}/output/{image_group_id}/")
     elif file_name == f"TBRC_{image_group_id}.xml" or file_name == "gb-bdrc-map.json":
-        download_path = Path(f"./data/{work_id}/info/{image_group_id}/")
-        download_path.mkdir(parents=True, exist_ok=True)
-        local_file_path = f"{download_path}/{file_name}"
+        download_path = Path(f"{base_data_dir}/{work_id}/info/{image_group_id}/")
     else:
-        download_path = Path(f"./data/{work_id}/")
-        download_path.mkdir(parents=True, exist_ok=True)
-        local_file_path = f"{download_path}/{file_name}"
-
-    if Path(local_file_path).exists():
-        return
-    try:
-        s3_client.download_file(OCR_OUTPUT_BUCKET, key, local_file_path)
-        print(f"Downloaded {file_name} successfully.")
-    except Exception as e:
-        print(f"Error due to {e}")
+        download_path = Path(f"{base_data_dir}/{work_id}/")
+    return download_path / file_name
 
 
-def download_gv_ocr_files(work_id: str, image_group_id: Optional[str], key: str):
+def get_gv_local_path(
+    work_id: str, image_group_id: Optional[str], key: str, base_data_dir: str = "./data"
+) -> Path:
+    """
+    Map a Google Vision S3 key to its local path under base_data_dir.
+    """
     file_name = key.split("/")[-1]
     ocr_engine = key.split("/")[3]
 
@@ -74,29 +164,448 @@ def download_gv_ocr_files(work_id: str, image_group_id: Optional[str], key: str)
         if image_group_id and "-" in image_group_id:
             image_group_id = "-".join(image_group_id.split("-")[1:])
         else:
-            print(
-                f"Warning: image_group_id '{image_group_id}' does not contain '-' character."
-            )
+            if image_group_id is not None:
+                logger.warning(
+                    f"image_group_id '{image_group_id}' does not contain '-' character."
+                )
             image_group_id = None
-    else:
-        image_group_id = image_group_id
 
     if file_name.endswith(".json.gz"):
-        download_path = Path(f"./data/{work_id}/{image_group_id}/")
-        download_path.mkdir(parents=True, exist_ok=True)
-        local_file_path = f"{download_path}/{file_name}"
+        download_path = Path(f"{base_data_dir}/{work_id}/{image_group_id}/")
     else:
-        download_path = Path(f"./data/{work_id}/")
-        download_path.mkdir(parents=True, exist_ok=True)
-        local_file_path = f"{download_path}/{file_name}"
+        download_path = Path(f"{base_data_dir}/{work_id}/")
+    return download_path / file_name
+
+
+class ChecksumError(Exception):
+    """
+    Raised when a downloaded file does not match the ETag of its object.
+    """
+
+
+class UnverifiableETag(Exception):
+    """
+    Raised for ETags that are not an MD5 of the object's content.
+    """
+
+
+def compute_etag(path: Path, part_size: Optional[int] = None) -> str:
+    """
+    Compute the S3 ETag of a local file: the MD5 of its content or, for an
+    object uploaded in parts of part_size bytes, the MD5 of the concatenated
+    part MD5s followed by "-<number of parts>".
+    """
+    with open(path, "rb") as f:
+        if part_size is None:
+            md5 = hashlib.md5()
+            for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b""):
+                md5.update(chunk)
+            return md5.hexdigest()
+        part_md5s = []
+        while True:
+            md5 = hashlib.md5()
+            read = 0
+            while read < part_size:
+                chunk = f.read(min(READ_CHUNK_SIZE, part_size - read))
+                if not chunk:
+                    break
+                md5.update(chunk)
+                read += len(chunk)
+            if not read:
+                break
+            part_md5s.append(md5.digest())
+    return f"{hashlib.md5(b''.join(part_md5s)).hexdigest()}-{len(part_md5s)}"
 
-    if Path(local_file_path).exists():
-        return
+
+def get_s3_limiter() -> AdaptiveLimiter:
+    """
+    Return the process's "s3" limiter. It starts at, and never grows past,
+    DEFAULT_DOWNLOAD_WORKERS calls, the number of threads fetching objects,
+    so that halving it on throttling lowers the concurrency actually reached.
+    """
+    return get_limiter("s3", DEFAULT_DOWNLOAD_WORKERS)
+
+
+def get_etag_part_size(key: str, etag: str) -> Optional[int]:
+    """
+    Return the part size to recompute an object's ETag with: None for a
+    single-part object, otherwise the size of its first part as reported by
+    S3 (HeadObject with PartNumber=1), which is the size every part but the
+    last was uploaded in.
+
+    Raises:
+        UnverifiableETag: If the ETag is not derived from the MD5 of the
+            content, as for objects encrypted with SSE-KMS or SSE-C.
+    """
+    if not MD5_ETAG_PATTERN.match(etag):
+        raise UnverifiableETag(etag)
+    multipart = "-" in etag
+    kwargs: Dict[str, Any] = {"PartNumber": 1} if multipart else {}
+    head = DEFAULT_RETRY_POLICY.call(
+        get_s3_client(single_attempt=True).head_object,
+        Bucket=OCR_OUTPUT_BUCKET,
+        Key=key,
+        IfMatch=f'"{etag}"',
+        **kwargs,
+    )
+    encryption = head.get("ServerSideEncryption", "")
+    if encryption.startswith("aws:kms") or head.get("SSECustomerAlgorithm"):
+        raise UnverifiableETag(etag)
+    return head["ContentLength"] if multipart else None
+
+
+def verify_etag(key: str, path: Path, etag: str) -> bool:
+    """
+    Check a downloaded file against the ETag of its object.
+
+    Returns:
+        True if the file matches the ETag, False if the ETag is not an MD5
+        of the content and the file could not be checked.
+
+    Raises:
+        ChecksumError: If the file does not match the ETag.
+    """
     try:
-        s3_client.download_file(OCR_OUTPUT_BUCKET, key, local_file_path)
-        print(f"Downloaded {file_name} successfully.")
-    except Exception as e:
-        print(f"Error due to {e}")
+        part_size = get_etag_part_size(key, etag)
+    except UnverifiableETag:
+        logger.debug(f"Skipping checksum of {key}: ETag {etag} is not an MD5")
+        count("checksums_skipped")
+        return False
+    if compute_etag(path, part_size) != etag:
+        raise ChecksumError(f"{path} does not match ETag {etag}")
+    return True
+
+
+def download_range(key: str, path: Path, first: int, last: int, etag: str) -> None:
+    """
+    Fetch bytes first to last (inclusive) of an object into the same bytes
+    of path, which must already be that large. The request fails if the
+    object no longer has the given ETag.
+    """
+    kwargs = {"IfMatch": f'"{etag}"'} if etag else {}
+    response = get_s3_client(single_attempt=True).get_object(
+        Bucket=OCR_OUTPUT_BUCKET, Key=key, Range=f"bytes={first}-{last}", **kwargs
+    )
+    with open(path, "r+b") as f:
+        f.seek(first)
+        for chunk in response["Body"].iter_chunks(READ_CHUNK_SIZE):
+            f.write(chunk)
+        if f.tell() != last + 1:
+            raise IncompleteReadError(
+                actual_bytes=f.tell() - first, expected_bytes=last + 1 - first
+            )
+
+
+def download_ranged(key: str, tmp_file_path: Path, obj: S3Object) -> None:
+    """
+    Download a large object into tmp_file_path as concurrent ranged GETs of
+    S3Options.multipart_chunksize bytes and verify it against the ETag.
+
+    The ranges already written are listed in <tmp_file_path>.json, so a
+    download interrupted by an error or a crash resumes where it stopped as
+    long as the object's size and ETag have not changed. Both files are kept
+    on failure and removed once the file is verified; a file that fails
+    verification is discarded so the next attempt starts over.
+
+    Raises:
+        ChecksumError: If the assembled file does not match the ETag.
+    """
+    options = get_s3_options()
+    part_size = options.multipart_chunksize
+    state_path = tmp_file_path.with_name(f"{tmp_file_path.name}.json")
+    state: Dict[str, Any] = {
+        "etag": obj.etag,
+        "size": obj.size,
+        "part_size": part_size,
+        "done": [],
+    }
+    if tmp_file_path.exists() and state_path.exists():
+        try:
+            saved = json.loads(state_path.read_text())
+        except ValueError:
+            saved = {}
+        if all(
+            saved.get(name) == state[name] for name in ("etag", "size", "part_size")
+        ):
+            state["done"] = saved["done"]
+    done = set(state["done"])
+    if done:
+        logger.info(f"Resuming {key}: {len(done)} part(s) already downloaded")
+        count("ranges_resumed", len(done))
+    else:
+        with open(tmp_file_path, "wb") as f:
+            f.truncate(obj.size)
+
+    ranges = [
+        (index, first, min(first + part_size, obj.size) - 1)
+        for index, first in enumerate(range(0, obj.size, part_size))
+        if index not in done
+    ]
+    lock = threading.Lock()
+    limiter = get_s3_limiter()
+
+    def fetch(index: int, first: int, last: int) -> None:
+        DEFAULT_RETRY_POLICY.call(
+            download_range, key, tmp_file_path, first, last, obj.etag, limiter=limiter
+        )
+        count("ranges_downloaded")
+        with lock:
+            done.add(index)
+            state["done"] = sorted(done)
+            # Replaced atomically so a crash never leaves a truncated state
+            tmp_state_path = state_path.with_name(f"{state_path.name}.tmp")
+            tmp_state_path.write_text(json.dumps(state))
+            os.replace(tmp_state_path, state_path)
+
+    with timed("s3_get"), ThreadPoolExecutor(
+        max_workers=options.max_concurrency
+    ) as executor:
+        futures = [submit_in_context(executor, fetch, *r) for r in ranges]
+        try:
+            for future in as_completed(futures):
+                future.result()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    if obj.etag:
+        with timed("checksum"):
+            try:
+                verify_etag(key, tmp_file_path, obj.etag)
+            except ChecksumError:
+                tmp_file_path.unlink(missing_ok=True)
+                state_path.unlink(missing_ok=True)
+                raise
+    state_path.unlink(missing_ok=True)
+
+
+def download_s3_file(
+    key: str,
+    local_file_path: Path,
+    obj: Optional[S3Object] = None,
+    manifest: Optional[SyncManifest] = None,
+) -> str:
+    """
+    Download a single S3 object unless an up-to-date local copy exists.
+
+    Without a manifest a file is considered up to date as soon as it exists.
+    With a manifest (and the listed object's size and ETag) it must match the
+    recorded size and ETag, so changed or truncated files are fetched again.
+    The object is written to a temporary file and renamed into place, so an
+    interrupted download never leaves a partial file at local_file_path.
+    Transient errors are retried with backoff (see retry.DEFAULT_RETRY_POLICY)
+    and the process's concurrent S3 downloads are bounded by the adaptive
+    "s3" limiter, which backs off when S3 answers SlowDown. Listed objects of
+    at least S3Options.large_object_threshold bytes go through
+    download_ranged, whose partial file is kept for the next attempt.
+
+    Returns:
+        "skipped" if the local copy was up to date, "downloaded" otherwise.
+        Errors that persist after the retries are raised to the caller.
+    """
+    if manifest is not None and obj is not None:
+        if manifest.is_current(key, obj.size, obj.etag, local_file_path):
+            count("objects_skipped")
+            return "skipped"
+    elif local_file_path.exists():
+        count("objects_skipped")
+        return "skipped"
+
+    local_file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file_path = local_file_path.with_name(f"{local_file_path.name}.part")
+    if obj is not None and obj.size >= get_s3_options().large_object_threshold:
+        download_ranged(key, tmp_file_path, obj)
+        os.replace(tmp_file_path, local_file_path)
+    else:
+        try:
+            with timed("s3_get"):
+                DEFAULT_RETRY_POLICY.call(
+                    get_s3_client(single_attempt=True).download_file,
+                    OCR_OUTPUT_BUCKET,
+                    key,
+                    str(tmp_file_path),
+                    Config=get_transfer_config(),
+                    limiter=get_s3_limiter(),
+                )
+            os.replace(tmp_file_path, local_file_path)
+        finally:
+            tmp_file_path.unlink(missing_ok=True)
+    count("objects_downloaded")
+    count("bytes_downloaded", local_file_path.stat().st_size)
+    if manifest is not None and obj is not None:
+        manifest.record(key, obj.size, obj.etag)
+    logger.debug(f"Downloaded {key}")
+    return "downloaded"
+
+
+def download_gb_ocr_files(
+    work_id: str,
+    image_group_id: Optional[str],
+    key: str,
+    base_data_dir: str = "./data",
+    obj: Optional[S3Object] = None,
+    manifest: Optional[SyncManifest] = None,
+) -> str:
+    local_file_path = get_gb_local_path(work_id, image_group_id, key, base_data_dir)
+    return download_s3_file(key, local_file_path, obj, manifest)
+
+
+def download_gv_ocr_files(
+    work_id: str,
+    image_group_id: Optional[str],
+    key: str,
+    base_data_dir: str = "./data",
+    obj: Optional[S3Object] = None,
+    manifest: Optional[SyncManifest] = None,
+) -> str:
+    local_file_path = get_gv_local_path(work_id, image_group_id, key, base_data_dir)
+    return download_s3_file(key, local_file_path, obj, manifest)
+
+
+@dataclass
+class DownloadResult:
+    """
+    Outcome of a concurrent download: which keys were fetched, which were
+    already present locally, and which failed together with the error message.
+    """
+
+    downloaded: List[str] = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)
+    failed: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+
+def parse_ocr_key(key: str) -> Tuple[str, Optional[str]]:
+    """
+    Extract the work ID and image group ID (None for info.json) from an OCR key.
+    """
+    work_id = key.split("/")[2]
+    if key.endswith("info.json"):
+        return work_id, None
+    return work_id, key.split("/")[6]
+
+
+def download_ocr_key(
+    downloader: Callable[..., str],
+    key: str,
+    base_data_dir: str = "./data",
+    obj: Optional[S3Object] = None,
+    manifest: Optional[SyncManifest] = None,
+) -> str:
+    """
+    Download one OCR key, deriving the work and image group IDs from the key.
+    """
+    work_id_from_key, image_group_id = parse_ocr_key(key)
+    return downloader(
+        work_id_from_key, image_group_id, key, base_data_dir, obj=obj, manifest=manifest
+    )
+
+
+def download_ocr_keys(
+    keys: Iterable[Union[str, S3Object]],
+    downloader: Callable[..., str],
+    max_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+    base_data_dir: str = "./data",
+    sync: bool = False,
+) -> DownloadResult:
+    """
+    Download OCR keys concurrently over a bounded thread pool.
+
+    Threads get their S3 client from config.get_s3_client, whose connection
+    pool is sized by config.S3Options.max_pool_connections. Keys are pulled
+    from the iterable only as downloads finish, at most
+    DOWNLOAD_WINDOW_FACTOR * max_workers ahead, so a streamed listing is
+    never held in memory as a whole. Failures do not
+    stop the other downloads; they are collected in the returned
+    DownloadResult.
+
+    Args:
+        keys: S3 keys, or S3Object tuples from iter_s3_keys, to download.
+        downloader: download_gb_ocr_files or download_gv_ocr_files.
+        max_workers: Maximum number of concurrent downloads.
+        base_data_dir: Root of the local data directory.
+        sync: Compare S3Object sizes and ETags against each work's manifest
+            (see manifest.SyncManifest) instead of only checking that local
+            files exist, re-fetching changed or incomplete files.
+
+    Returns:
+        A DownloadResult describing every key.
+    """
+    result = DownloadResult()
+    manifests: Dict[str, SyncManifest] = {}
+
+    def get_manifest(key: str) -> SyncManifest:
+        work_id = key.split("/")[2]
+        if work_id not in manifests:
+            manifests[work_id] = SyncManifest.load(
+                get_manifest_path(work_id, base_data_dir)
+            )
+        return manifests[work_id]
+
+    def collect(futures: Iterable[Future]) -> None:
+        for future in futures:
+            key = in_flight.pop(future)
+            try:
+                status = future.result()
+            except Exception as e:
+                result.failed[key] = str(e)
+                continue
+            if status == "skipped":
+                result.skipped.append(key)
+            else:
+                result.downloaded.append(key)
+
+    in_flight: Dict[Future, str] = {}
+    window = max_workers * DOWNLOAD_WINDOW_FACTOR
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for item in keys:
+            # Stop pulling keys from the listing while the window is full
+            if len(in_flight) >= window:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            if isinstance(item, S3Object):
+                key, obj = item.key, item
+            else:
+                key, obj = item, None
+            manifest = get_manifest(key) if sync and obj else None
+            # Run in the caller's context so downloads report to its metrics
+            future = submit_in_context(
+                executor,
+                download_ocr_key,
+                downloader,
+                key,
+                base_data_dir,
+                obj,
+                manifest,
+            )
+            in_flight[future] = key
+        collect(list(as_completed(in_flight)))
+
+    for manifest in manifests.values():
+        manifest.save()
+    return result
+
+
+def is_gb_ocr_key(key: str) -> bool:
+    """
+    Whether a Google Books key should be downloaded ('images.zip' and
+    'txt.zip' are skipped).
+    """
+    filename = key.split("/")[-1]
+    return filename not in ("images.zip", "txt.zip")
+
+
+def is_gv_ocr_key(key: str) -> bool:
+    """
+    Whether a Google Vision key should be downloaded (only '.json.gz' pages
+    and 'info.json').
+    """
+    filename = key.split("/")[-1]
+    return filename.endswith(".json.gz") or filename == "info.json"
 
 
 def filter_gb_ocr_keys(s3_keys: List[str]) -> List[str]:
@@ -110,13 +619,7 @@ def filter_gb_ocr_keys(s3_keys: List[str]) -> List[str]:
     Returns:
         A new list containing the filtered S3 key strings.
     """
-    filtered_keys = []
-    for key in s3_keys:
-        parts = key.split("/")
-        filename = parts[-1]
-        if filename not in ("images.zip", "txt.zip"):
-            filtered_keys.append(key)
-    return filtered_keys
+    return [key for key in s3_keys if is_gb_ocr_key(key)]
 
 
 def filter_gv_ocr_keys(s3_keys: List[str]) -> List[str]:
@@ -130,14 +633,4 @@ def filter_gv_ocr_keys(s3_keys: List[str]) -> List[str]:
     Returns:
         A new list containing the filtered S3 key strings.
     """
-    filtered_keys = []
-    for key in s3_keys:
-        parts = key.split("/")
-        filename = parts[-1]
-        if filename.endswith(".json.gz"):
-            filtered_keys.append(key)
-        elif filename == "info.json":
-            filtered_keys.append(key)
-        else:
-            continue
-    return filtered_keys
+    return [key for key in s3_keys if is_gv_ocr_key(key)]
@@ -0,0 +1,134 @@
+"""
+Durable record of which pipeline stages each (work, engine, batch) job has
+finished, so an interrupted run can be resumed without downloading, zipping
+or uploading again.
+
+The state is a SQLite database that several worker processes can share. Each
+completed stage is stored with its result: the metadata after the metadata
+stage, the archive path after the zip stage and the pecha ID after the upload.
+
+# Show the state of every job
+python -m bdrc_work_to_pecha_pipeline.job_state --db job_state.db
+
+# Forget a job so that it runs from scratch next time
+python -m bdrc_work_to_pecha_pipeline.job_state --db job_state.db --reset W1234 vision batch001
+"""
+import argparse
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from bdrc_work_to_pecha_pipeline.logger import get_logger
+from bdrc_work_to_pecha_pipeline.sqlite_store import SQLiteStore
+
+logger = get_logger(__name__)
+
+DEFAULT_JOB_STATE_FILE = "job_state.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_stages (
+    work_id TEXT NOT NULL,
+    ocr_engine TEXT NOT NULL,
+    batch_number TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    completed_at REAL NOT NULL,
+    result TEXT,
+    PRIMARY KEY (work_id, ocr_engine, batch_number, stage)
+);
+"""
+
+JobKey = Tuple[str, str, str]
+
+
+class JobStateStore(SQLiteStore):
+    """
+    SQLite-backed store of completed job stages. Open one JobStateStore per
+    process (see sqlite_store.SQLiteStore).
+    """
+
+    def __init__(self, path: str = DEFAULT_JOB_STATE_FILE):
+        super().__init__(path, SCHEMA)
+
+    def mark_done(self, job: JobKey, stage: str, result: Any = None) -> None:
+        """
+        Record that a job finished a stage, with its JSON-serializable result.
+        The write is committed before returning.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO job_stages VALUES (?, ?, ?, ?, ?, ?)",
+                (*job, stage, time.time(), json.dumps(result)),
+            )
+
+    def get_completed(self, job: JobKey) -> Dict[str, Any]:
+        """
+        Return the completed stages of a job, mapped to their results.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT stage, result FROM job_stages "
+                "WHERE work_id = ? AND ocr_engine = ? AND batch_number = ?",
+                job,
+            ).fetchall()
+        return {stage: json.loads(result) for stage, result in rows}
+
+    def reset(self, job: JobKey, stages: Optional[List[str]] = None) -> None:
+        """
+        Forget some (by default all) completed stages of a job.
+        """
+        sql = (
+            "DELETE FROM job_stages "
+            "WHERE work_id = ? AND ocr_engine = ? AND batch_number = ?"
+        )
+        params: Tuple = job
+        if stages:
+            sql += f" AND stage IN ({', '.join('?' * len(stages))})"
+            params = (*job, *stages)
+        with self._lock, self._conn:
+            self._conn.execute(sql, params)
+
+    def list_jobs(self) -> Dict[JobKey, Dict[str, Any]]:
+        """
+        Return every job with its completed stages and results.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT work_id, ocr_engine, batch_number, stage, result "
+                "FROM job_stages ORDER BY work_id, ocr_engine, batch_number"
+            ).fetchall()
+        jobs: Dict[JobKey, Dict[str, Any]] = {}
+        for work_id, ocr_engine, batch_number, stage, result in rows:
+            jobs.setdefault((work_id, ocr_engine, batch_number), {})[
+                stage
+            ] = json.loads(result)
+        return jobs
+
+
+def main():
+    """
+    Main function to run the script.
+    """
+    parser = argparse.ArgumentParser(description="Inspect or edit the job state")
+    parser.add_argument(
+        "--db", type=str, default=DEFAULT_JOB_STATE_FILE, help="Job state database"
+    )
+    parser.add_argument(
+        "--reset",
+        nargs=3,
+        metavar=("WORK_ID", "OCR_ENGINE", "BATCH"),
+        help="Forget every completed stage of a job",
+    )
+    args = parser.parse_args()
+
+    with JobStateStore(args.db) as store:
+        if args.reset:
+            store.reset(tuple(args.reset))
+            logger.info(f"Reset job {'/'.join(args.reset)}")
+            return
+        for job, stages in store.list_jobs().items():
+            pecha_id = stages.get("upload")
+            print(f"{'/'.join(job)}\t{','.join(sorted(stages))}\t{pecha_id or ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,18 +9,36 @@ python -m bdrc_work_to_pecha_pipeline.list_works --details
 # To save the results to a file
 python -m bdrc_work_to_pecha_pipeline.list_works --output work_ids.txt
 
+# To list 32 hash directories at a time
+python -m bdrc_work_to_pecha_pipeline.list_works --workers 32
+
 # To save detailed information to a JSON file
 python -m bdrc_work_to_pecha_pipeline.list_works --details --output work_details.json
+
+# To build the details from one pass over the bucket instead of per-work listings
+python -m bdrc_work_to_pecha_pipeline.list_works --details --scan
+
+# To build the details from a downloaded S3 Inventory report
+python -m bdrc_work_to_pecha_pipeline.list_works --details --inventory inventory/manifest.json
 """
 import argparse
-from typing import Dict, List
-
-from bdrc_work_to_pecha_pipeline.config import OCR_OUTPUT_BUCKET, s3_client
+import csv
+import gzip
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import unquote
+
+from bdrc_work_to_pecha_pipeline.config import OCR_OUTPUT_BUCKET, get_s3_client
 from bdrc_work_to_pecha_pipeline.download import get_s3_prefix
 from bdrc_work_to_pecha_pipeline.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Number of hash directories listed concurrently
+DEFAULT_LISTING_WORKERS = 16
+
 
 def list_all_hash_directories() -> List[str]:
     """
@@ -33,7 +51,7 @@ def list_all_hash_directories() -> List[str]:
 
     try:
         # List objects with delimiter to get "directories"
-        response = s3_client.list_objects_v2(
+        response = get_s3_client().list_objects_v2(
             Bucket=OCR_OUTPUT_BUCKET, Prefix="Works/", Delimiter="/"
         )
 
@@ -69,7 +87,7 @@ def list_work_ids_in_hash_dir(hash_dir: str) -> List[str]:
             if continuation_token:
                 params["ContinuationToken"] = continuation_token
 
-            response = s3_client.list_objects_v2(**params)
+            response = get_s3_client().list_objects_v2(**params)
 
             # Extract work IDs from common prefixes
             if "CommonPrefixes" in response:
@@ -92,31 +110,63 @@ def list_work_ids_in_hash_dir(hash_dir: str) -> List[str]:
         return []
 
 
-def list_all_work_ids() -> List[str]:
+def iter_all_work_ids(max_workers: int = DEFAULT_LISTING_WORKERS) -> Iterator[str]:
     """
-    List all work IDs across all hash directories.
+    Stream work IDs across all hash directories, listing directories in parallel.
 
-    Returns:
-        List of all work IDs
+    Work IDs are yielded as soon as their hash directory has been listed, so the
+    order follows completion rather than the hash order.
+
+    Args:
+        max_workers: Maximum number of hash directories listed concurrently
+
+    Yields:
+        Work IDs
     """
-    all_work_ids = []
+    for _, work_ids in _iter_hash_dir_listings(max_workers):
+        yield from work_ids
+
 
-    # Get all hash directories
+def _iter_hash_dir_listings(max_workers: int) -> Iterator[Tuple[str, List[str]]]:
     hash_dirs = list_all_hash_directories()
     logger.info(f"Found {len(hash_dirs)} hash directories")
 
-    # For each hash directory, get all work IDs
-    for hash_dir in hash_dirs:
-        logger.info(f"Processing hash directory: {hash_dir}")
-        work_ids = list_work_ids_in_hash_dir(hash_dir)
-        all_work_ids.extend(work_ids)
-        logger.info(f"Found {len(work_ids)} work IDs in {hash_dir}")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(list_work_ids_in_hash_dir, hash_dir): hash_dir
+            for hash_dir in hash_dirs
+        }
+        for future in as_completed(futures):
+            hash_dir = futures[future]
+            work_ids = future.result()
+            logger.info(f"Found {len(work_ids)} work IDs in {hash_dir}")
+            yield hash_dir, work_ids
+
+
+def list_all_work_ids(max_workers: int = DEFAULT_LISTING_WORKERS) -> List[str]:
+    """
+    List all work IDs across all hash directories.
+
+    Hash directories are listed in parallel; the result is ordered by hash
+    directory and then by work ID, as with a sequential walk.
+
+    Args:
+        max_workers: Maximum number of hash directories listed concurrently
+
+    Returns:
+        List of all work IDs
+    """
+    work_ids_by_hash_dir = dict(_iter_hash_dir_listings(max_workers))
+
+    all_work_ids = []
+    for hash_dir in sorted(work_ids_by_hash_dir):
+        all_work_ids.extend(work_ids_by_hash_dir[hash_dir])
 
     logger.info(f"Total work IDs found: {len(all_work_ids)}")
     return all_work_ids
 
 
-def get_work_details() -> Dict[str, Dict]:
+def get_work_details(max_workers: int = DEFAULT_LISTING_WORKERS) -> Dict[str, Dict]:
     """
     Get detailed information about each work ID, including available OCR engines and batches.
 
@@ -124,7 +174,7 @@ def get_work_details() -> Dict[str, Dict]:
         Dictionary mapping work IDs to their details
     """
     work_details = {}
-    all_work_ids = list_all_work_ids()
+    all_work_ids = list_all_work_ids(max_workers)
 
     for work_id in all_work_ids:
         try:
@@ -133,7 +183,7 @@ def get_work_details() -> Dict[str, Dict]:
 
             # List all OCR engines for this work
             ocr_engines = set()
-            response = s3_client.list_objects_v2(
+            response = get_s3_client().list_objects_v2(
                 Bucket=OCR_OUTPUT_BUCKET, Prefix=work_prefix, Delimiter="/"
             )
 
@@ -151,7 +201,7 @@ def get_work_details() -> Dict[str, Dict]:
                 engine_prefix = f"{work_prefix}{engine}/"
                 batches = set()
 
-                batch_response = s3_client.list_objects_v2(
+                batch_response = get_s3_client().list_objects_v2(
                     Bucket=OCR_OUTPUT_BUCKET, Prefix=engine_prefix, Delimiter="/"
                 )
 
@@ -178,6 +228,126 @@ def get_work_details() -> Dict[str, Dict]:
     return work_details
 
 
+def iter_bucket_keys(prefix: str = "Works/") -> Iterator[str]:
+    """
+    Stream every object key under a prefix with a single, non-delimited
+    paginated listing (one request per 1000 keys).
+
+    Args:
+        prefix: The key prefix to scan
+
+    Yields:
+        Object keys in lexicographic order
+    """
+    paginator = get_s3_client().get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=OCR_OUTPUT_BUCKET, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            yield obj["Key"]
+
+
+def iter_inventory_keys(inventory_path: str) -> Iterator[str]:
+    """
+    Stream object keys from a local copy of an S3 Inventory report.
+
+    Accepts a manifest.json (whose data files are looked up next to it, or in a
+    'data' directory beside it), or a single CSV (optionally gzipped) or
+    Parquet data file. Parquet requires the optional pyarrow package.
+
+    Args:
+        inventory_path: Path to the manifest or data file
+
+    Yields:
+        Object keys
+    """
+    path = Path(inventory_path)
+    if path.suffix == ".json":
+        with open(path) as f:
+            manifest = json.load(f)
+        for data_file in manifest.get("files", []):
+            name = Path(data_file["key"]).name
+            data_path = path.parent / "data" / name
+            if not data_path.exists():
+                data_path = path.parent / name
+            yield from iter_inventory_keys(str(data_path))
+    elif path.suffix == ".parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError(
+                "Reading Parquet inventory files requires the 'pyarrow' package"
+            ) from e
+        table = pq.read_table(path, columns=["key"])
+        yield from table.column("key").to_pylist()
+    else:
+        opener = gzip.open if path.suffix == ".gz" else open
+        with opener(path, "rt", newline="") as f:
+            for row in csv.reader(f):
+                # Inventory CSV rows are: bucket, key (URL-encoded), ...
+                if len(row) >= 2:
+                    yield unquote(row[1])
+
+
+def build_work_details(keys: Iterable[str]) -> Dict[str, Dict]:
+    """
+    Build the work -> OCR engine -> batch tree from a flat list of object keys.
+
+    Produces the same structure as get_work_details: an engine is any directory
+    under a work, a batch any directory under an engine, and works without
+    batches are left out.
+
+    Args:
+        keys: Object keys such as 'Works/a1/W1234/vision/batch001/...'
+
+    Returns:
+        Dictionary mapping work IDs to their details
+    """
+    work_hashes: Dict[str, str] = {}
+    work_engines: Dict[str, Set[str]] = {}
+    work_batches: Dict[str, Dict[str, Set[str]]] = {}
+
+    for key in keys:
+        parts = key.split("/")
+        if len(parts) < 5 or parts[0] != "Works":
+            continue
+        _, hash_dir, work_id, engine = parts[:4]
+        work_hashes[work_id] = hash_dir
+        work_engines.setdefault(work_id, set()).add(engine)
+        if len(parts) >= 6:
+            batches = work_batches.setdefault(work_id, {})
+            batches.setdefault(engine, set()).add(parts[4])
+
+    work_details = {}
+    for work_id in sorted(work_batches, key=lambda w: (work_hashes[w], w)):
+        work_details[work_id] = {
+            "ocr_engines": sorted(work_engines[work_id]),
+            "engine_batches": {
+                engine: sorted(batches)
+                for engine, batches in sorted(work_batches[work_id].items())
+            },
+        }
+    return work_details
+
+
+def get_work_details_from_scan(inventory_path: Optional[str] = None) -> Dict[str, Dict]:
+    """
+    Get the same details as get_work_details from one linear pass over the
+    bucket, or over a local S3 Inventory report when inventory_path is given,
+    instead of several delimiter listings per work.
+
+    Returns:
+        Dictionary mapping work IDs to their details
+    """
+    if inventory_path:
+        logger.info(f"Reading inventory from {inventory_path}")
+        keys = iter_inventory_keys(inventory_path)
+    else:
+        logger.info(f"Scanning s3://{OCR_OUTPUT_BUCKET}/Works/")
+        keys = iter_bucket_keys("Works/")
+    work_details = build_work_details(keys)
+    logger.info(f"Total works with batches found: {len(work_details)}")
+    return work_details
+
+
 def main():
     """
     Main function to run the script.
@@ -191,11 +361,30 @@ def main():
     parser.add_argument(
         "--output", type=str, help="Output file to save the list of work IDs"
     )
+    parser.add_argument(
+        "--scan",
+        action="store_true",
+        help="Build --details from a single pass over the bucket",
+    )
+    parser.add_argument(
+        "--inventory",
+        type=str,
+        help="Build --details from a local S3 Inventory manifest or data file",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_LISTING_WORKERS,
+        help="Number of hash directories to list concurrently",
+    )
     args = parser.parse_args()
 
     if args.details:
         # Get detailed information about each work
-        work_details = get_work_details()
+        if args.scan or args.inventory:
+            work_details = get_work_details_from_scan(args.inventory)
+        else:
+            work_details = get_work_details(args.workers)
 
         # Print the details
         for work_id, details in work_details.items():
@@ -208,14 +397,12 @@ def main():
 
         # Save to file if requested
         if args.output:
-            import json
-
             with open(args.output, "w") as f:
                 json.dump(work_details, f, indent=2)
             print(f"Saved detailed work information to {args.output}")
     else:
         # Just list all work IDs
-        all_work_ids = list_all_work_ids()
+        all_work_ids = list_all_work_ids(args.workers)
 
         # Print the list
         for work_id in all_work_ids:
@@ -1,27 +1,42 @@
 """
 Logging configuration module for the bdrc_work_to_pecha_pipeline package.
 Provides a centralized logging setup that can be imported and used across the project.
+
+Records go to stdout and to logs/pipeline.log under the project root. Set
+BDRC_PIPELINE_LOG_FILE to write the file elsewhere, or to an empty string to
+log to stdout only (the test suite does).
 """
 import logging
 import os
 import sys
 from pathlib import Path
 
+LOG_FILE_ENV = "BDRC_PIPELINE_LOG_FILE"
+
+
+class LazyFileHandler(logging.FileHandler):
+    """
+    File handler that creates its directory and opens the file only when the
+    first record is written, so importing the package does no file I/O.
+    """
+
+    def __init__(self, filename: str):
+        super().__init__(filename, delay=True)
+
+    def _open(self):
+        Path(self.baseFilename).parent.mkdir(parents=True, exist_ok=True)
+        return super()._open()
+
 
 def setup_logger():
     """
     Set up and configure the logger with both file and console handlers.
     Returns the configured root logger.
     """
-    # Ensure log directory exists
-    # Use absolute path for the project root
+    # Use absolute path for the project root; the dedicated logs directory is
+    # created when the first record is written
     base_dir = Path(os.path.dirname(os.path.abspath(__file__))).parent.parent
-    log_dir = base_dir / "logs"  # Create a dedicated logs directory
-    log_dir.mkdir(parents=True, exist_ok=True)
-
-    # Set up the logger with absolute path
-    log_file = log_dir / "pipeline.log"
-    print(f"Log file will be created at: {log_file}")  # Print the log file location
+    log_file = os.environ.get(LOG_FILE_ENV, str(base_dir / "logs" / "pipeline.log"))
 
     # Reset the root logger
     for handler in logging.root.handlers[:]:
@@ -31,10 +46,6 @@ def setup_logger():
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
 
-    # Create file handler
-    file_handler = logging.FileHandler(str(log_file))
-    file_handler.setLevel(logging.INFO)
-
     # Create console handler
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(logging.INFO)
@@ -43,13 +54,15 @@ def setup_logger():
     formatter = logging.Formatter(
         "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     )
-    file_handler.setFormatter(formatter)
     console_handler.setFormatter(formatter)
-
-    # Add the handlers to the logger
-    logger.addHandler(file_handler)
     logger.addHandler(console_handler)
 
+    if log_file:
+        file_handler = LazyFileHandler(log_file)
+        file_handler.setLevel(logging.INFO)
+        file_handler.setFormatter(formatter)
+        logger.addHandler(file_handler)
+
     return logger
 
 
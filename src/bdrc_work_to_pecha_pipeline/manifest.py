@@ -0,0 +1,107 @@
+"""
+Per-work download manifests recording the size and ETag of every object
+fetched from S3, so re-runs can skip unchanged files and repair the rest.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+MANIFEST_DIR_NAME = ".manifests"
+
+
+def get_manifest_path(work_id: str, base_data_dir: str = "./data") -> Path:
+    """
+    Manifests live beside, not inside, the work directory so they are never
+    packaged into the pecha archive.
+    """
+    return Path(base_data_dir) / MANIFEST_DIR_NAME / f"{work_id}.json"
+
+
+def file_md5(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def write_json_atomic(path: Path, data) -> None:
+    """
+    Write JSON to a temporary file and rename it over path, so readers never
+    see a half-written file. The temporary file has a unique name, so several
+    processes can write the same path at once: the last rename wins.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(
+        dir=path.parent, prefix=f"{path.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+class SyncManifest:
+    """
+    Mapping of S3 key to the size and ETag of the local copy last downloaded.
+
+    Safe to update from several download threads; call save() when done.
+    """
+
+    def __init__(self, path: Path, entries: Optional[Dict[str, Dict]] = None):
+        self.path = path
+        self.entries: Dict[str, Dict] = entries or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: Path) -> "SyncManifest":
+        try:
+            with open(path) as f:
+                entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            entries = {}
+        return cls(path, entries)
+
+    def is_current(self, key: str, size: int, etag: str, local_path: Path) -> bool:
+        """
+        Whether local_path is a complete copy of the object with this size and ETag.
+
+        Files downloaded before manifests existed have no entry; they are
+        accepted if their size matches and, for single-part uploads whose ETag
+        is the content MD5, their checksum matches too.
+        """
+        if not etag:
+            # Catalog rows may lack an ETag; without one nothing can be compared
+            return False
+        try:
+            local_size = local_path.stat().st_size
+        except FileNotFoundError:
+            return False
+        if local_size != size:
+            return False
+
+        with self._lock:
+            entry = self.entries.get(key)
+        if entry is not None:
+            return entry.get("size") == size and entry.get("etag") == etag
+
+        if "-" not in etag and file_md5(local_path) != etag:
+            return False
+        self.record(key, size, etag)
+        return True
+
+    def record(self, key: str, size: int, etag: str) -> None:
+        with self._lock:
+            self.entries[key] = {"size": size, "etag": etag}
+
+    def save(self) -> None:
+        with self._lock:
+            entries = dict(self.entries)
+        write_json_atomic(self.path, entries)
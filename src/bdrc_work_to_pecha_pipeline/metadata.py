@@ -1,12 +1,21 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, Optional
 
 from openpecha.buda.api import get_buda_scan_info
 from openpecha.utils import read_json
 
+from bdrc_work_to_pecha_pipeline.buda_cache import get_buda_cache
+from bdrc_work_to_pecha_pipeline.logger import get_logger
+from bdrc_work_to_pecha_pipeline.metrics import timed
 from bdrc_work_to_pecha_pipeline.pecha_registry import get_first_pecha_for_work
 
+logger = get_logger(__name__)
+
+# Number of works whose BUDA scan info is fetched concurrently by prefetch
+DEFAULT_BUDA_PREFETCH_WORKERS = 8
+
 
 def extract_metadata_for_work(work_path: Path) -> Dict[str, Any]:
     metadata = {}
@@ -18,6 +27,13 @@ def extract_metadata_for_work(work_path: Path) -> Dict[str, Any]:
     return metadata
 
 
+def get_document_id(work_id: str, ocr_engine: str, batch_number: str) -> str:
+    """
+    ID under which a batch is published to the OpenPecha API.
+    """
+    return f"{work_id}_{ocr_engine}_{batch_number}"
+
+
 def format_metadata_for_op_api(metadata: Dict[str, Any]) -> Dict[str, Any]:
     """
     Formats BDRC metadata into a structure suitable for the OpenPecha API.
@@ -34,7 +50,7 @@ def format_metadata_for_op_api(metadata: Dict[str, Any]) -> Dict[str, Any]:
     ocr_engine = ocr_info.get("software", "")
     batch_number = ocr_info.get("batch", "")
     work_id = ocr_info.get("bdrc_scan_id", "")
-    document_id = f"{work_id}_{ocr_engine}_{batch_number}"
+    document_id = get_document_id(work_id, ocr_engine, batch_number)
 
     formatted_data: Dict[str, Any] = {
         "source_type": "bdrc",
@@ -66,6 +82,19 @@ def format_metadata_for_op_api(metadata: Dict[str, Any]) -> Dict[str, Any]:
     return formatted_data
 
 
+def build_ocr_import_info(
+    work_id: str, ocr_engine: str, batch_number: str, ocr_info: Dict[str, Any]
+) -> Dict[str, Any]:
+    return {
+        "source": "bdrc",
+        "software": ocr_engine,
+        "batch": batch_number,
+        "expected_default_language": "bo",
+        "bdrc_scan_id": work_id,
+        "ocr_info": ocr_info,
+    }
+
+
 def get_ocr_import_info(work_id_path, ocr_engine, batch_number):
     work_id = work_id_path.name
     ocr_info_path = f"{work_id_path}/info.json"
@@ -75,23 +104,51 @@ def get_ocr_import_info(work_id_path, ocr_engine, batch_number):
     else:
         ocr_info = {}
 
-    ocr_import_info = {
-        "source": "bdrc",
-        "software": ocr_engine,
-        "batch": batch_number,
-        "expected_default_language": "bo",
-        "bdrc_scan_id": work_id,
-        "ocr_info": ocr_info,
-    }
+    ocr_import_info = build_ocr_import_info(work_id, ocr_engine, batch_number, ocr_info)
     with open(f"{work_id_path}/ocr_import_info.json", "w") as f:
         json.dump(ocr_import_info, f, indent=4)
 
     return ocr_import_info
 
 
+def fetch_buda_data(work_id: str) -> Dict[str, Any]:
+    """
+    Get the BUDA scan info of a work, through the on-disk cache (see
+    buda_cache.BudaCache).
+    """
+    with timed("buda"):
+        return get_buda_cache().get_or_fetch(work_id, get_buda_scan_info)
+
+
+def prefetch_buda_data(
+    work_ids: Iterable[str], max_workers: int = DEFAULT_BUDA_PREFETCH_WORKERS
+) -> Dict[str, str]:
+    """
+    Warm the BUDA cache for many works concurrently.
+
+    Returns:
+        Work ID to error message for the works whose fetch failed.
+    """
+    work_ids = list(dict.fromkeys(work_ids))
+    failed: Dict[str, str] = {}
+
+    def prefetch(work_id: str) -> None:
+        try:
+            fetch_buda_data(work_id)
+        except Exception as e:
+            failed[work_id] = str(e)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(prefetch, work_ids))
+    for work_id, error in failed.items():
+        logger.warning(f"Failed to prefetch BUDA data for {work_id}: {error}")
+    logger.info(f"Prefetched BUDA data for {len(work_ids) - len(failed)} work(s)")
+    return failed
+
+
 def get_buda_data(work_path: Path) -> Dict[str, Any]:
     work_id = work_path.name
-    buda_data = get_buda_scan_info(work_id)
+    buda_data = fetch_buda_data(work_id)
     with open(f"{work_path}/buda_data.json", "w") as f:
         json.dump(buda_data, f, indent=4)
     return buda_data
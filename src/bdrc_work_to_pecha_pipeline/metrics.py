@@ -0,0 +1,194 @@
+"""
+Per-batch timing and throughput metrics.
+
+run_pipeline collects a BatchMetrics for each batch: the wall time of every
+stage plus counters such as objects and bytes downloaded. Code deeper in the
+call stack (download.py, metadata.py) reports into the batch being processed
+through timed() and count(), which find it via a context variable, so the
+metrics do not have to be passed down explicitly. Thread pools that should
+report into the same batch must run their tasks in a copy of the submitting
+context (see submit_in_context).
+
+Finished records are written by a MetricsSink as JSON lines and, optionally, as
+a Prometheus textfile (for node_exporter's textfile collector).
+"""
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar, copy_context
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TypeVar,
+    Union,
+)
+
+PROMETHEUS_PREFIX = "bdrc_pipeline"
+
+T = TypeVar("T")
+
+
+@dataclass
+class BatchMetrics:
+    """
+    Seconds spent per stage and counters for one batch. Thread-safe.
+    """
+
+    stages: Dict[str, float] = field(default_factory=dict)
+    counters: Dict[str, int] = field(default_factory=dict)
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    def add_time(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add(self, counter: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time a block, adding its duration to the stage (even on error)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "stages": {name: round(s, 3) for name, s in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+
+_current_metrics: ContextVar[Optional[BatchMetrics]] = ContextVar(
+    "current_metrics", default=None
+)
+
+
+def current_metrics() -> Optional[BatchMetrics]:
+    return _current_metrics.get()
+
+
+@contextmanager
+def collecting(metrics: BatchMetrics) -> Iterator[BatchMetrics]:
+    """Make metrics the target of timed() and count() within the block."""
+    token = _current_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current_metrics.reset(token)
+
+
+def timed(stage: str):
+    """Time a block into the current batch's metrics, if any."""
+    metrics = _current_metrics.get()
+    return metrics.stage(stage) if metrics is not None else nullcontext()
+
+
+def count(counter: str, value: int = 1) -> None:
+    """Add to a counter of the current batch's metrics, if any."""
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics.add(counter, value)
+
+
+def submit_in_context(
+    executor: Executor, fn: Callable[..., T], *args: Any
+) -> "Future[T]":
+    """
+    Submit fn(*args) to run in a copy of the caller's context, so that it
+    reports to the caller's metrics.
+    """
+    context = copy_context()
+    return executor.submit(lambda: context.run(fn, *args))
+
+
+def aggregate(records: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Sum the metrics of job records (as produced by batch_runner.run_job).
+    """
+    stages: Dict[str, float] = defaultdict(float)
+    counters: Dict[str, int] = defaultdict(int)
+    statuses: Dict[str, int] = defaultdict(int)
+    for record in records:
+        statuses[record.get("status", "unknown")] += 1
+        metrics = record.get("metrics") or {}
+        for name, seconds in metrics.get("stages", {}).items():
+            stages[name] += seconds
+        for name, value in metrics.get("counters", {}).items():
+            counters[name] += value
+    return {"stages": stages, "counters": counters, "statuses": statuses}
+
+
+def format_prometheus(records: Iterable[Dict[str, Any]]) -> str:
+    """
+    Render aggregated job metrics in the Prometheus text exposition format.
+    """
+    totals = aggregate(records)
+    lines: List[str] = [
+        f"# HELP {PROMETHEUS_PREFIX}_batches_total Batches processed, by status.",
+        f"# TYPE {PROMETHEUS_PREFIX}_batches_total counter",
+    ]
+    for status, value in sorted(totals["statuses"].items()):
+        lines.append(f'{PROMETHEUS_PREFIX}_batches_total{{status="{status}"}} {value}')
+    lines += [
+        f"# HELP {PROMETHEUS_PREFIX}_stage_seconds_total Time spent in each stage.",
+        f"# TYPE {PROMETHEUS_PREFIX}_stage_seconds_total counter",
+    ]
+    for stage, seconds in sorted(totals["stages"].items()):
+        lines.append(
+            f'{PROMETHEUS_PREFIX}_stage_seconds_total{{stage="{stage}"}} {seconds:.3f}'
+        )
+    for name, value in sorted(totals["counters"].items()):
+        lines += [
+            f"# TYPE {PROMETHEUS_PREFIX}_{name}_total counter",
+            f"{PROMETHEUS_PREFIX}_{name}_total {value}",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+class MetricsSink:
+    """
+    Writes finished job records: appends each to a JSON lines file and
+    rewrites the Prometheus textfile with the running totals.
+
+    Meant to be used from a single (parent) process.
+    """
+
+    def __init__(
+        self,
+        jsonl_path: Optional[Union[str, Path]] = None,
+        prometheus_path: Optional[Union[str, Path]] = None,
+    ):
+        self.jsonl_path = Path(jsonl_path) if jsonl_path else None
+        self.prometheus_path = Path(prometheus_path) if prometheus_path else None
+        self.records: List[Dict[str, Any]] = []
+
+    def add(self, record: Dict[str, Any]) -> None:
+        self.records.append(record)
+        if self.jsonl_path:
+            with open(self.jsonl_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        if self.prometheus_path:
+            # Written atomically so the collector never reads a partial file
+            tmp_path = self.prometheus_path.with_name(
+                f"{self.prometheus_path.name}.tmp"
+            )
+            tmp_path.write_text(format_prometheus(self.records))
+            os.replace(tmp_path, self.prometheus_path)
@@ -0,0 +1,116 @@
+"""
+Build pecha zip archives directly from S3 object streams, without writing the
+OCR files to the local data directory first.
+"""
+from contextlib import closing
+from tempfile import SpooledTemporaryFile
+from typing import IO, Dict, Iterable, Tuple
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from bdrc_work_to_pecha_pipeline.archive import (
+    PreparedMember,
+    new_zinfo,
+    prepare_member,
+    write_members,
+)
+from bdrc_work_to_pecha_pipeline.config import OCR_OUTPUT_BUCKET, get_s3_client
+from bdrc_work_to_pecha_pipeline.download import (
+    DEFAULT_DOWNLOAD_WORKERS,
+    S3Object,
+    get_s3_limiter,
+)
+from bdrc_work_to_pecha_pipeline.logger import get_logger
+from bdrc_work_to_pecha_pipeline.retry import DEFAULT_RETRY_POLICY
+
+logger = get_logger(__name__)
+
+# Archives stay in memory up to this size, then spill to disk
+ARCHIVE_SPOOL_MAX_SIZE = 256 * 1024 * 1024
+
+
+def read_s3_object(key: str) -> bytes:
+    """
+    Read a small S3 object fully into memory. Transient errors are retried
+    like downloads are, under the "s3" limiter.
+    """
+
+    def read() -> bytes:
+        response = get_s3_client(single_attempt=True).get_object(
+            Bucket=OCR_OUTPUT_BUCKET, Key=key
+        )
+        with closing(response["Body"]) as body:
+            return body.read()
+
+    return DEFAULT_RETRY_POLICY.call(read, limiter=get_s3_limiter())
+
+
+def prepare_s3_member(member: Tuple[str, S3Object]) -> PreparedMember:
+    """
+    Fetch an S3 object and prepare it as a zip member (CRC and compression
+    are computed while the body streams in). A transient error, also while
+    the body is streaming, fetches the object again from the start.
+    """
+    arcname, obj = member
+
+    def prepare() -> PreparedMember:
+        response = get_s3_client(single_attempt=True).get_object(
+            Bucket=OCR_OUTPUT_BUCKET, Key=obj.key
+        )
+        with closing(response["Body"]) as body:
+            return prepare_member(new_zinfo(arcname), body)
+
+    return DEFAULT_RETRY_POLICY.call(prepare, limiter=get_s3_limiter())
+
+
+def write_s3_members(
+    zip_file: ZipFile,
+    members: Iterable[Tuple[str, S3Object]],
+    max_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+) -> int:
+    """
+    Stream S3 objects into an open zip file.
+
+    Objects are fetched and compressed concurrently (at most 2 * max_workers
+    ahead of the writer) and written in order. Already-compressed members are
+    stored.
+
+    Args:
+        zip_file: A ZipFile opened for writing.
+        members: (archive name, S3 object) pairs.
+        max_workers: Maximum number of concurrent S3 fetches.
+
+    Returns:
+        Number of members written.
+    """
+    return write_members(zip_file, members, prepare_s3_member, max_workers)
+
+
+def build_archive_from_s3(
+    members: Iterable[Tuple[str, S3Object]],
+    extra_files: Dict[str, bytes],
+    max_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+) -> IO[bytes]:
+    """
+    Build a zip archive from S3 objects plus some in-memory files.
+
+    Args:
+        members: (archive name, S3 object) pairs to stream from S3.
+        extra_files: Archive name to content of generated files, such as metadata.
+        max_workers: Maximum number of concurrent S3 fetches.
+
+    Returns:
+        A spooled temporary file holding the archive, rewound for reading.
+        It is kept in memory up to ARCHIVE_SPOOL_MAX_SIZE bytes.
+    """
+    archive = SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_MAX_SIZE)
+    try:
+        with ZipFile(archive, "w") as zip_file:
+            count = write_s3_members(zip_file, members, max_workers)
+            for arcname, data in extra_files.items():
+                zip_file.writestr(arcname, data, compress_type=ZIP_DEFLATED)
+    except BaseException:
+        archive.close()
+        raise
+    logger.info(f"Packaged {count} object(s) from S3 into the archive")
+    archive.seek(0)
+    return archive
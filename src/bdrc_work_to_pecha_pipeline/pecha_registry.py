@@ -1,14 +1,42 @@
 """
 Module for tracking relationships between pechas created from the same work.
+
+The registry is stored in S3 as one JSON shard per work hash prefix (see
+download.get_hash), under work_to_pecha/shards/. Shards are updated with
+conditional writes (If-Match / If-None-Match), so concurrent workers never
+overwrite each other's registrations: on a conflict the shard is re-read, the
+pending entries are merged into it and the write is retried.
+
+The single-file layout (work_to_pecha/pecha_registry.json) is still supported
+with SHARDED_REGISTRY = False. Until it has been migrated, the sharded layout
+falls back to it (LEGACY_REGISTRY_FALLBACK): works missing from their shard
+are looked up there, and a work found there is written to its shard with its
+pecha from the single file rather than the one being registered.
+
+Inside a RegistryBatch, registrations are only journaled locally and are
+written to S3 together by a background thread, once per flush interval, and
+when the batch ends. Lookups also see the registrations still pending in the
+journals of other processes sharing the journal directory.
+
+To copy the single-file registry into shards:
+
+python -m bdrc_work_to_pecha_pipeline.pecha_registry --migrate
 """
+import argparse
 import json
+import os
+import random
+import threading
+import time
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Optional, Union
 
 from botocore.exceptions import ClientError
 
-from bdrc_work_to_pecha_pipeline.config import OCR_OUTPUT_BUCKET, s3_client
+from bdrc_work_to_pecha_pipeline.config import OCR_OUTPUT_BUCKET, get_s3_client
+from bdrc_work_to_pecha_pipeline.download import get_hash
 from bdrc_work_to_pecha_pipeline.logger import get_logger
+from bdrc_work_to_pecha_pipeline.manifest import write_json_atomic
 
 logger = get_logger(__name__)
 
@@ -20,56 +48,474 @@ REGISTRY_FILE = Path("pecha_registry.json")
 S3_BUCKET = OCR_OUTPUT_BUCKET
 S3_KEY = "work_to_pecha/pecha_registry.json"
 
+# Seconds a fetched registry is served from memory before S3 is checked again.
+# Writes always revalidate first, whatever the TTL.
+REGISTRY_CACHE_TTL = 300.0
+
+# Store the registry as per-hash-prefix shards written with conditional requests
+SHARDED_REGISTRY = True
+SHARD_PREFIX = "work_to_pecha/shards/"
+
+# Consult the single-file registry for works not in a shard yet. Can be
+# turned off once migrate_registry_to_shards has run.
+LEGACY_REGISTRY_FALLBACK = True
+
+# Attempts at a conditional shard write before giving up on repeated conflicts
+MAX_SHARD_WRITE_ATTEMPTS = 8
+
+# Seconds between flushes of batched registrations to S3
+DEFAULT_FLUSH_INTERVAL = 60.0
+
+NOT_MODIFIED_CODES = ("304", "NotModified")
+NOT_FOUND_CODES = ("404", "NoSuchKey")
+# 412 when the ETag no longer matches, 409 when a concurrent write is in flight
+WRITE_CONFLICT_CODES = (
+    "412",
+    "PreconditionFailed",
+    "409",
+    "ConditionalRequestConflict",
+)
+
+
+class RegistryCache:
+    """
+    In-process copy of the registry together with the ETag of the S3 object it
+    was read from, so revalidation is a conditional GET that only transfers the
+    registry when it has changed.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self) -> None:
+        self.registry: Optional[Dict[str, str]] = None
+        self.etag: Optional[str] = None
+        self.fetched_at = 0.0
+
+    def is_fresh(self, max_age: float) -> bool:
+        return (
+            self.registry is not None and time.monotonic() - self.fetched_at < max_age
+        )
+
+
+_cache = RegistryCache()
+_shard_caches: Dict[str, RegistryCache] = {}
+_shard_caches_lock = threading.Lock()
+
+
+def clear_registry_cache() -> None:
+    """Drop the in-memory registry so the next lookup fetches it from S3."""
+    with _cache.lock:
+        _cache.clear()
+    with _shard_caches_lock:
+        _shard_caches.clear()
+
 
 def ensure_registry_exists() -> None:
     """Ensure the registry file and directory exist."""
-    if not REGISTRY_FILE.parent.exists():
-        REGISTRY_FILE.parent.mkdir(parents=True, exist_ok=True)
-
     if not REGISTRY_FILE.exists():
-        with open(REGISTRY_FILE, "w") as f:
-            json.dump({}, f, indent=2)
+        write_json_atomic(REGISTRY_FILE, {})
+
 
+def download_registry_from_s3() -> bool:
+    """
+    Download the registry file from S3 if it exists and has changed.
+
+    The request is conditional on the ETag of the last downloaded copy, so an
+    unchanged registry costs a 304 response rather than a full transfer.
+
+    The registry is parsed before REGISTRY_FILE is replaced, and the file is
+    replaced atomically, since the worker processes of a run share it.
+
+    Returns:
+        False if the copy in REGISTRY_FILE is known to be current, True otherwise.
 
-def download_registry_from_s3() -> None:
-    """Download the registry file from S3 if it exists."""
+    Raises:
+        ValueError: If the registry in S3 is not valid JSON.
+    """
+    ensure_registry_exists()  # Ensure directory exists
+    params = {"Bucket": S3_BUCKET, "Key": S3_KEY}
+    if _cache.etag and _cache.registry is not None:
+        params["IfNoneMatch"] = _cache.etag
     try:
-        ensure_registry_exists()  # Ensure directory exists
-        s3_client.download_file(S3_BUCKET, S3_KEY, str(REGISTRY_FILE))
+        response = get_s3_client().get_object(**params)
+        try:
+            registry = json.loads(response["Body"].read() or b"{}")
+        except json.JSONDecodeError as e:
+            _cache.etag = None
+            raise ValueError(f"s3://{S3_BUCKET}/{S3_KEY} is not valid JSON: {e}")
+        write_json_atomic(REGISTRY_FILE, registry)
+        _cache.etag = response.get("ETag")
         logger.info(f"Downloaded registry from s3://{S3_BUCKET}/{S3_KEY}")
 
     except ClientError as e:
-        if e.response["Error"]["Code"] == "404":  # noqa: E231
+        code = e.response["Error"]["Code"]
+        if code in NOT_MODIFIED_CODES:
+            logger.debug("Registry in S3 is unchanged; using the cached copy.")
+            return False
+        if code in NOT_FOUND_CODES:
             logger.info("No registry file found in S3; starting fresh.")
         else:
             logger.error(f"Failed to download registry from S3: {e}")
+    return True
 
 
 def upload_registry_to_s3() -> None:
     """Upload the registry file to S3."""
     try:
-        s3_client.upload_file(str(REGISTRY_FILE), S3_BUCKET, S3_KEY)
+        with open(REGISTRY_FILE, "rb") as f:
+            response = get_s3_client().put_object(Bucket=S3_BUCKET, Key=S3_KEY, Body=f)
+        _cache.etag = response.get("ETag")
         logger.info(f"Uploaded registry to s3://{S3_BUCKET}/{S3_KEY}")
     except ClientError as e:
+        _cache.etag = None  # Force a full download on the next revalidation
         logger.error(f"Failed to upload registry to S3: {e}")  # noqa: E231
 
 
-def get_registry() -> Dict[str, str]:
+def read_registry_file() -> Dict[str, str]:
+    """
+    Raises:
+        ValueError: If REGISTRY_FILE is not valid JSON.
+    """
+    ensure_registry_exists()
+    with open(REGISTRY_FILE) as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{REGISTRY_FILE} is not valid JSON: {e}")
+
+
+def get_registry(max_age: Optional[float] = None) -> Dict[str, str]:
     """
     Get the current registry mapping work_ids to their first pecha_id.
 
+    Args:
+        max_age: Serve the in-memory copy if it was validated against S3 less
+            than this many seconds ago (defaults to REGISTRY_CACHE_TTL).
+            Pass 0 to always revalidate.
+
     Returns:
         Dict mapping work_ids to pecha_ids
+
+    Raises:
+        ValueError: If the registry could not be read. Nothing is cached then,
+            so the next call downloads the registry in full: treating it as
+            empty would register works a second time.
     """
-    download_registry_from_s3()  # Always fetch latest before reading
-    ensure_registry_exists()
+    if max_age is None:
+        max_age = REGISTRY_CACHE_TTL
+    with _cache.lock:
+        if not _cache.is_fresh(max_age):
+            try:
+                if download_registry_from_s3() or _cache.registry is None:
+                    _cache.registry = read_registry_file()
+            except ValueError:
+                _cache.clear()
+                raise
+            _cache.fetched_at = time.monotonic()
+        return dict(_cache.registry or {})
+
+
+def merge_registries(*registries: Dict[str, str]) -> Dict[str, str]:
+    """
+    Merge registries. A work keeps the first pecha it is mapped to, so earlier
+    registries win over later ones.
+    """
+    merged: Dict[str, str] = {}
+    for registry in registries:
+        for work_id, pecha_id in registry.items():
+            merged.setdefault(work_id, pecha_id)
+    return merged
+
+
+def get_shard_key(work_id: str) -> str:
+    return f"{SHARD_PREFIX}{get_hash(work_id)}.json"
+
+
+def get_shard_cache(shard_key: str) -> RegistryCache:
+    with _shard_caches_lock:
+        return _shard_caches.setdefault(shard_key, RegistryCache())
 
+
+def fetch_shard(shard_key: str, max_age: Optional[float] = None) -> Dict[str, str]:
+    """
+    Get a registry shard, revalidating the cached copy with a conditional GET
+    once it is older than max_age seconds (defaults to REGISTRY_CACHE_TTL).
+
+    A shard that does not exist yet is empty.
+    """
+    if max_age is None:
+        max_age = REGISTRY_CACHE_TTL
+    cache = get_shard_cache(shard_key)
+    with cache.lock:
+        if cache.is_fresh(max_age):
+            return dict(cache.registry or {})
+        params = {"Bucket": S3_BUCKET, "Key": shard_key}
+        if cache.etag and cache.registry is not None:
+            params["IfNoneMatch"] = cache.etag
+        try:
+            response = get_s3_client().get_object(**params)
+            cache.registry = json.loads(response["Body"].read() or b"{}")
+            cache.etag = response.get("ETag")
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code in NOT_FOUND_CODES:
+                cache.registry, cache.etag = {}, None
+            elif code not in NOT_MODIFIED_CODES:
+                raise
+        cache.fetched_at = time.monotonic()
+        return dict(cache.registry or {})
+
+
+def put_shard(shard_key: str, shard: Dict[str, str], etag: Optional[str]) -> str:
+    """
+    Write a shard only if it is still at the given ETag (or, with no ETag,
+    only if it does not exist yet).
+
+    Returns:
+        The ETag of the written shard.
+
+    Raises:
+        ClientError: With a WRITE_CONFLICT_CODES code if the shard was changed
+            by someone else.
+    """
+    params = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+    response = get_s3_client().put_object(
+        Bucket=S3_BUCKET,
+        Key=shard_key,
+        Body=json.dumps(shard, indent=2, sort_keys=True).encode("utf-8"),
+        ContentType="application/json",
+        **params,
+    )
+    return response["ETag"]
+
+
+def update_shard(
+    shard_key: str, entries: Dict[str, str], overwrite: bool = False
+) -> Dict[str, str]:
+    """
+    Merge entries into a shard with a compare-and-swap write, retrying on
+    conflicts. Works already in the shard keep their pecha unless overwrite
+    is set.
+
+    Args:
+        shard_key: S3 key of the shard.
+        entries: work_id -> pecha_id mappings to add.
+        overwrite: Let the entries replace the shard's pecha for their works.
+
+    Returns:
+        The shard as written (or as found, if there was nothing to add).
+    """
+    cache = get_shard_cache(shard_key)
+    with cache.lock:
+        for attempt in range(MAX_SHARD_WRITE_ATTEMPTS):
+            shard = fetch_shard(shard_key, max_age=0)
+            if overwrite:
+                merged = merge_registries(entries, shard)
+            else:
+                merged = merge_registries(shard, entries)
+            if merged == shard:
+                return shard
+            try:
+                etag = put_shard(shard_key, merged, cache.etag)
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in WRITE_CONFLICT_CODES:
+                    raise
+                logger.info(f"Concurrent update of {shard_key}; retrying")
+                time.sleep(random.uniform(0, 0.05 * 2**attempt))
+                continue
+            cache.registry, cache.etag = merged, etag
+            cache.fetched_at = time.monotonic()
+            return merged
+    raise RuntimeError(
+        f"Could not update {shard_key} after {MAX_SHARD_WRITE_ATTEMPTS} attempts"
+    )
+
+
+def get_legacy_first_pecha(work_id: str) -> Optional[str]:
+    """
+    Look a work up in the single-file registry, if LEGACY_REGISTRY_FALLBACK
+    is on.
+    """
+    if not LEGACY_REGISTRY_FALLBACK:
+        return None
+    return get_registry().get(work_id)
+
+
+def prefer_legacy_entries(entries: Dict[str, str]) -> Dict[str, str]:
+    """
+    Replace the pecha of works already in the single-file registry by the
+    one registered there, so registering to a shard never hides it.
+    """
+    return {
+        work_id: get_legacy_first_pecha(work_id) or pecha_id
+        for work_id, pecha_id in entries.items()
+    }
+
+
+def flush_registrations(entries: Dict[str, str]) -> None:
+    """
+    Write many registrations to S3 at once: one conditional write per touched
+    shard, or a single merged upload with the single-file layout.
+    """
+    if not entries:
+        return
+    if SHARDED_REGISTRY:
+        by_shard: Dict[str, Dict[str, str]] = {}
+        for work_id, pecha_id in prefer_legacy_entries(entries).items():
+            by_shard.setdefault(get_shard_key(work_id), {})[work_id] = pecha_id
+        for shard_key, shard_entries in sorted(by_shard.items()):
+            update_shard(shard_key, shard_entries)
+    else:
+        with _cache.lock:
+            registry = get_registry(max_age=0)
+            merged = merge_registries(registry, entries)
+            if merged != registry:
+                write_json_atomic(REGISTRY_FILE, merged)
+                _cache.registry = merged
+                upload_registry_to_s3()
+    logger.info(f"Flushed {len(entries)} registration(s) to the registry")
+
+
+def read_journal(journal_path: Path) -> Dict[str, str]:
+    """
+    Read the registrations recorded in a journal. A torn last line (from a
+    crash during a write) is ignored.
+    """
+    entries: Dict[str, str] = {}
     try:
-        with open(REGISTRY_FILE) as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        # If the file is empty or corrupted, return an empty dict
-        return {}
+        with open(journal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                entries.setdefault(entry["work_id"], entry["pecha_id"])
+    except FileNotFoundError:
+        # Not written yet, or flushed and deleted by its process meanwhile
+        pass
+    return entries
+
+
+def flush_journals(journal_dir: Union[str, Path]) -> int:
+    """
+    Flush the registrations left in the journals (*.jsonl) of a directory, e.g.
+    by worker processes that have exited or crashed, then delete the journals.
+
+    Returns:
+        Number of registrations flushed.
+    """
+    journal_paths = sorted(Path(journal_dir).glob("*.jsonl"))
+    entries = merge_registries(*(read_journal(path) for path in journal_paths))
+    flush_registrations(entries)
+    for path in journal_paths:
+        path.unlink()
+    return len(entries)
+
+
+class RegistryBatch:
+    """
+    Batches registrations: register_pecha() only appends to a local
+    write-ahead journal, and a background thread flushes the pending
+    registrations to S3 together every flush_interval seconds. The rest are
+    flushed when the batch is closed.
+
+    After a crash, the journal is replayed by the next RegistryBatch on the same
+    path, or by flush_journals(). Lookups through get_first_pecha_for_work()
+    see the pending registrations of this batch and of every other journal in
+    the same directory, e.g. those of the other worker processes of a run.
+
+    Usage:
+        with RegistryBatch("registry.journal.jsonl"):
+            ...  # register_pecha() calls are batched
+    """
+
+    def __init__(
+        self,
+        journal_path: Union[str, Path],
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+    ):
+        self.journal_path = Path(journal_path)
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+        self.lock = threading.RLock()
+        self.pending = read_journal(self.journal_path)
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(
+            target=self._flush_periodically, name="registry-flush", daemon=True
+        )
+        self._flusher.start()
+
+    def _flush_periodically(self) -> None:
+        while not self._closed.wait(self.flush_interval):
+            try:
+                if self.pending:
+                    self.flush()
+            except Exception as e:
+                # The registrations stay journaled and are retried next time
+                logger.error(f"Failed to flush registry batch: {e}")
+
+    def add(self, work_id: str, pecha_id: str) -> bool:
+        """
+        Journal a registration. Returns False if the work already has a
+        pending registration.
+        """
+        with self.lock:
+            if work_id in self.pending:
+                return False
+            with open(self.journal_path, "a") as f:
+                f.write(json.dumps({"work_id": work_id, "pecha_id": pecha_id}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.pending[work_id] = pecha_id
+            return True
+
+    def get(self, work_id: str) -> Optional[str]:
+        """
+        Return the pending registration of a work in this batch or in another
+        journal of the same directory.
+        """
+        with self.lock:
+            pecha_id = self.pending.get(work_id)
+        if pecha_id is not None:
+            return pecha_id
+        for path in sorted(self.journal_path.parent.glob("*.jsonl")):
+            if path != self.journal_path:
+                pecha_id = read_journal(path).get(work_id)
+                if pecha_id is not None:
+                    return pecha_id
+        return None
+
+    def flush(self) -> None:
+        """Write the pending registrations to S3 and clear the journal."""
+        with self.lock:
+            flush_registrations(self.pending)
+            self.pending = {}
+            self.journal_path.unlink(missing_ok=True)
+
+    def activate(self) -> None:
+        """Route this process's register_pecha() calls through the batch."""
+        global _active_batch
+        _active_batch = self
+
+    def close(self) -> None:
+        global _active_batch
+        if _active_batch is self:
+            _active_batch = None
+        self._closed.set()
+        self._flusher.join()
+        self.flush()
+
+    def __enter__(self) -> "RegistryBatch":
+        self.activate()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+_active_batch: Optional[RegistryBatch] = None
 
 
 def register_pecha(work_id: str, pecha_id: str) -> None:
@@ -80,15 +526,35 @@ def register_pecha(work_id: str, pecha_id: str) -> None:
         work_id: The BDRC work ID
         pecha_id: The OpenPecha ID
     """
-    registry = get_registry()
+    if _active_batch is not None:
+        if _active_batch.add(work_id, pecha_id):
+            logger.info(f"Queued registration of pecha {pecha_id} for work {work_id}")
+        return
+
+    if not SHARDED_REGISTRY:
+        with _cache.lock:
+            _register_pecha_in_file(work_id, pecha_id)
+        return
+
+    shard = update_shard(
+        get_shard_key(work_id), prefer_legacy_entries({work_id: pecha_id})
+    )
+    if shard[work_id] == pecha_id:
+        logger.info(
+            f"Registered pecha {pecha_id} as the first version for work {work_id}"
+        )
+
+
+def _register_pecha_in_file(work_id: str, pecha_id: str) -> None:
+    registry = get_registry(max_age=0)  # Revalidate before read-modify-write
 
     # Only register if this work_id doesn't already have a first pecha
     if work_id not in registry:
         registry[work_id] = pecha_id
 
         # Save the updated registry
-        with open(REGISTRY_FILE, "w") as f:
-            json.dump(registry, f, indent=2)
+        write_json_atomic(REGISTRY_FILE, registry)
+        _cache.registry = registry
 
         logger.info(
             f"Registered pecha {pecha_id} as the first version for work {work_id}"
@@ -106,5 +572,61 @@ def get_first_pecha_for_work(work_id: str) -> Optional[str]:
     Returns:
         The pecha ID of the first version, or None if not found
     """
-    registry = get_registry()
-    return registry.get(work_id)
+    # Pending registrations first: a flush writes them to S3 before deleting
+    # its journal, so a registration is always found in one or the other
+    if _active_batch is not None:
+        first_pecha = _active_batch.get(work_id)
+        if first_pecha is not None:
+            return first_pecha
+    if not SHARDED_REGISTRY:
+        return get_registry().get(work_id)
+    shard_key = get_shard_key(work_id)
+    first_pecha = fetch_shard(shard_key).get(work_id)
+    if first_pecha is None:
+        # Another process may have registered the work since the shard was
+        # cached; revalidating costs a 304 when it has not
+        first_pecha = fetch_shard(shard_key, max_age=0).get(work_id)
+    if first_pecha is None:
+        first_pecha = get_legacy_first_pecha(work_id)
+    return first_pecha
+
+
+def migrate_registry_to_shards() -> int:
+    """
+    Merge the single-file registry into the sharded layout. Safe to re-run and
+    to run while workers are registering pechas. Works registered in the
+    single file get its pecha, even if a shard already has another one.
+
+    Returns:
+        Number of works in the single-file registry.
+    """
+    registry = get_registry(max_age=0)
+    by_shard: Dict[str, Dict[str, str]] = {}
+    for work_id, pecha_id in registry.items():
+        by_shard.setdefault(get_shard_key(work_id), {})[work_id] = pecha_id
+    for shard_key, entries in sorted(by_shard.items()):
+        update_shard(shard_key, entries, overwrite=True)
+    logger.info(f"Migrated {len(registry)} work(s) into {len(by_shard)} shard(s)")
+    return len(registry)
+
+
+def main():
+    """
+    Main function to run the script.
+    """
+    parser = argparse.ArgumentParser(description="Manage the work to pecha registry")
+    parser.add_argument(
+        "--migrate",
+        action="store_true",
+        help=f"Merge s3://{S3_BUCKET}/{S3_KEY} into the sharded registry",
+    )
+    args = parser.parse_args()
+
+    if args.migrate:
+        migrate_registry_to_shards()
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
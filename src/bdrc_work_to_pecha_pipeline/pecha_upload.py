@@ -1,23 +1,54 @@
 import json
+import os
+from contextlib import nullcontext
 from pathlib import Path
+from typing import (
+    IO,
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
 
-import requests
-
+from bdrc_work_to_pecha_pipeline.catalog import Catalog
 from bdrc_work_to_pecha_pipeline.download import (
+    DEFAULT_DOWNLOAD_WORKERS,
+    DownloadResult,
+    S3Object,
     download_gb_ocr_files,
     download_gv_ocr_files,
-    filter_gb_ocr_keys,
-    filter_gv_ocr_keys,
+    download_ocr_keys,
+    get_gb_local_path,
+    get_gv_local_path,
     get_s3_keys,
     get_s3_prefix,
+    is_gb_ocr_key,
+    is_gv_ocr_key,
+    iter_s3_keys,
+    parse_ocr_key,
 )
+from bdrc_work_to_pecha_pipeline.job_state import JobStateStore
 from bdrc_work_to_pecha_pipeline.logger import get_logger
+from bdrc_work_to_pecha_pipeline.manifest import get_manifest_path
 from bdrc_work_to_pecha_pipeline.metadata import (
+    build_ocr_import_info,
+    fetch_buda_data,
+    format_metadata_for_op_api,
     get_buda_data,
+    get_document_id,
     get_metadata,
     get_ocr_import_info,
 )
+from bdrc_work_to_pecha_pipeline.metrics import BatchMetrics, collecting, count
+from bdrc_work_to_pecha_pipeline.packaging import build_archive_from_s3, read_s3_object
 from bdrc_work_to_pecha_pipeline.pecha_registry import register_pecha
+from bdrc_work_to_pecha_pipeline.published import PublishedRecord
+from bdrc_work_to_pecha_pipeline.scratch import ScratchEntry, ScratchSpace
+from bdrc_work_to_pecha_pipeline.uploader import get_uploader
 from bdrc_work_to_pecha_pipeline.utils import zip_folder
 
 logger = get_logger(__name__)
@@ -29,29 +60,80 @@ class OcrEngine:
     GOOGLE_VISION = "vision"
 
 
-def download_ocr_data(work_id: str, batch_number: str, ocr_engine: str):
+def list_keys(prefix: str, catalog: Optional[Catalog] = None) -> List[str]:
     """
-    Download OCR output from S3 based on the OCR engine.
+    List keys under a prefix from the local catalog if given, otherwise from S3.
     """
-    s3_prefix = f"{get_s3_prefix(work_id)}{ocr_engine}/{batch_number}/"
-    s3_keys = get_s3_keys(s3_prefix)
+    if catalog is not None:
+        return catalog.get_keys(prefix)
+    return get_s3_keys(prefix)
+
+
+def iter_ocr_objects(
+    prefix: str,
+    key_filter: Callable[[str], bool],
+    catalog: Optional[Catalog] = None,
+) -> Iterator[S3Object]:
+    """
+    Stream the objects under a prefix that pass key_filter, from the local
+    catalog if given, otherwise page by page from S3.
+    """
+    if catalog is not None:
+        return (obj for obj in catalog.get_objects(prefix) if key_filter(obj.key))
+    return iter_s3_keys(prefix, key_filter)
+
 
+def get_ocr_engine_handlers(
+    ocr_engine: str,
+) -> Tuple[Callable[[str], bool], Callable[..., str], Callable[..., Path]]:
+    """
+    Return the key filter, downloader and local path mapping for an OCR engine.
+    """
     if ocr_engine == OcrEngine.GOOGLE_BOOKS:
-        keys = filter_gb_ocr_keys(s3_keys)
-        downloader = download_gb_ocr_files
+        return is_gb_ocr_key, download_gb_ocr_files, get_gb_local_path
     elif ocr_engine in [OcrEngine.GOOGLE_VISION_ENGINE, OcrEngine.GOOGLE_VISION]:
-        keys = filter_gv_ocr_keys(s3_keys)
-        downloader = download_gv_ocr_files
-    else:
-        raise ValueError(f"Unsupported OCR engine: {ocr_engine}")
+        return is_gv_ocr_key, download_gv_ocr_files, get_gv_local_path
+    raise ValueError(f"Unsupported OCR engine: {ocr_engine}")
+
+
+def download_ocr_data(
+    work_id: str,
+    batch_number: str,
+    ocr_engine: str,
+    max_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+    base_data_dir: str = "./data",
+    catalog: Optional[Catalog] = None,
+    sync: bool = False,
+) -> DownloadResult:
+    """
+    Download OCR output from S3 based on the OCR engine.
 
-    for key in keys:
-        work_id_from_key = key.split("/")[2]
-        if key.endswith("info.json"):
-            downloader(work_id=work_id_from_key, image_group_id=None, key=key)
-        else:
-            image_group_id = key.split("/")[6]
-            downloader(work_id_from_key, image_group_id, key)
+    Keys are streamed from the listing and fetched concurrently, so downloads
+    start with the first listing page. Per-key failures are reported in the
+    returned DownloadResult rather than raised. When a catalog is given the
+    keys are taken from it instead of listing S3. With sync, files are
+    checked against the size and ETag recorded in the work's download
+    manifest, so only new, changed or incomplete files are fetched.
+    """
+    key_filter, downloader, _ = get_ocr_engine_handlers(ocr_engine)
+
+    s3_prefix = f"{get_s3_prefix(work_id)}{ocr_engine}/{batch_number}/"
+    objects = iter_ocr_objects(s3_prefix, key_filter, catalog)
+    result = download_ocr_keys(
+        objects,
+        downloader,
+        max_workers=max_workers,
+        base_data_dir=base_data_dir,
+        sync=sync,
+    )
+    total = len(result.downloaded) + len(result.skipped) + len(result.failed)
+    logger.info(
+        f"Downloaded {len(result.downloaded)}, skipped {len(result.skipped)}, "
+        f"failed {len(result.failed)} of {total} file(s)"
+    )
+    for key, error in result.failed.items():
+        logger.error(f"Failed to download {key}: {error}")
+    return result
 
 
 def generate_metadata(work_path: Path, ocr_engine: str, batch_number: str) -> dict:
@@ -65,27 +147,108 @@ def generate_metadata(work_path: Path, ocr_engine: str, batch_number: str) -> di
     return metadata
 
 
-def create_pecha(metadata: dict, text_file: Path = None, data_file: Path = None):
+def package_ocr_data_from_s3(
+    work_id: str,
+    batch_number: str,
+    ocr_engine: str,
+    max_workers: int = DEFAULT_DOWNLOAD_WORKERS,
+    catalog: Optional[Catalog] = None,
+) -> Tuple[dict, IO[bytes]]:
+    """
+    Build the metadata and the pecha zip archive straight from S3.
+
+    The archive has the same layout as zipping the downloaded work folder,
+    including ocr_import_info.json and buda_data.json, but OCR files are
+    streamed from S3 into the zip without touching the data directory.
+
+    Returns:
+        The metadata and a spooled temporary file holding the archive.
+    """
+    key_filter, _, get_local_path = get_ocr_engine_handlers(ocr_engine)
+    s3_prefix = f"{get_s3_prefix(work_id)}{ocr_engine}/{batch_number}/"
+    objects = list(iter_ocr_objects(s3_prefix, key_filter, catalog))
+
+    info_key = f"{s3_prefix}info.json"
+    if any(obj.key == info_key for obj in objects):
+        ocr_info = json.loads(read_s3_object(info_key))
+    else:
+        ocr_info = {}
+    ocr_import_info = build_ocr_import_info(work_id, ocr_engine, batch_number, ocr_info)
+    buda_data = fetch_buda_data(work_id)
+    extra_files = {
+        f"{work_id}/ocr_import_info.json": json.dumps(ocr_import_info, indent=4),
+        f"{work_id}/buda_data.json": json.dumps(buda_data, indent=4),
+    }
+    metadata = format_metadata_for_op_api(
+        {"ocr_import_info": ocr_import_info, "buda_data": buda_data}
+    )
+
+    # Archive names mirror the local layout relative to the data directory
+    members = (
+        (get_local_path(*parse_ocr_key(obj.key), obj.key, ".").as_posix(), obj)
+        for obj in objects
+    )
+    archive = build_archive_from_s3(
+        members,
+        {name: data.encode() for name, data in extra_files.items()},
+        max_workers=max_workers,
+    )
+    return metadata, archive
+
+
+def get_scan_id(metadata: dict) -> Optional[str]:
+    """
+    Return the BDRC scan (work) ID of pecha metadata, or None if it has none.
+    """
+    try:
+        return metadata["bdrc"]["ocr_import_info"]["bdrc_scan_id"]
+    except (KeyError, TypeError):
+        return None
+
+
+def create_pecha(
+    metadata: dict,
+    text_file: Optional[Path] = None,
+    data_file: Optional[Path] = None,
+    data_fileobj: Optional[IO[bytes]] = None,
+) -> Optional[str]:
     """
     Send a multipart/form-data POST request to OpenPecha API to create a Pecha.
+
+    The zip archive is given either as a path (data_file) or as an open
+    binary file object (data_fileobj), e.g. from package_ocr_data_from_s3;
+    without either only the metadata is sent. The body is streamed over the
+    process's shared keep-alive session (see uploader.get_uploader), so the
+    archive is never held in memory.
+
+    Returns the ID of the created pecha, or None if the request failed.
     """
-    url = "https://api-l25bgmwqoa-uc.a.run.app/pecha"
-    form_data = {"metadata": json.dumps(metadata)}
-    files = {}
+    pecha_id = None
+    work_id = get_scan_id(metadata)
 
+    fileobj: ContextManager[Optional[IO[bytes]]]
     if text_file:
-        files["text"] = (
-            text_file.name,
-            open(text_file, "rb"),
-            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        field_name = "text"
+        filename = text_file.name
+        fileobj = open(text_file, "rb")
+        content_type = (
+            "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
         )
     elif data_file:
-        files["data"] = (data_file.name, open(data_file, "rb"), "application/zip")
+        field_name, filename, content_type = "data", data_file.name, "application/zip"
+        fileobj = open(data_file, "rb")
+    else:
+        field_name, filename, content_type = "data", f"{work_id}.zip", "application/zip"
+        fileobj = nullcontext(data_fileobj)
 
     try:
         logger.info("Uploading Pecha to OpenPecha API...")
 
-        response = requests.post(url, data=form_data, files=files)
+        with fileobj as f:
+            response = get_uploader().create_pecha(
+                json.dumps(metadata),
+                (field_name, filename, f, content_type) if f is not None else None,
+            )
         logger.info(f"API response code: {response.status_code}")
 
         if response.ok:
@@ -95,7 +258,6 @@ def create_pecha(metadata: dict, text_file: Path = None, data_file: Path = None)
             title = response_json.get("title")
 
             # Log the work_id and pecha_id on successful creation
-            work_id = metadata["bdrc"]["ocr_import_info"]["bdrc_scan_id"]
             logger.info(f"Work ID: {work_id}, Pecha ID: {pecha_id}, Title: {title}")
             logger.info(
                 "Pecha details: %s", response_json
@@ -103,6 +265,8 @@ def create_pecha(metadata: dict, text_file: Path = None, data_file: Path = None)
 
             # Register this pecha as the first version for this work_id if applicable
             # This will only register if it's the first pecha for this work_id
+            if not work_id:
+                logger.warning("Metadata has no BDRC scan ID; pecha not registered")
             if work_id and pecha_id:
                 register_pecha(work_id, pecha_id)
 
@@ -118,41 +282,314 @@ def create_pecha(metadata: dict, text_file: Path = None, data_file: Path = None)
         logger.error(f"❌ Error during API request: {e}")
         if "response" in locals():
             logger.error("Error response: %s", response.text)
+    return pecha_id
+
+
+def stage_limit(stage_limits: Optional[Dict[str, Any]], stage: str):
+    """
+    Return the context manager bounding concurrency of a pipeline stage, or a
+    no-op context when the stage is unbounded.
+    """
+    if stage_limits and stage in stage_limits:
+        return stage_limits[stage]
+    return nullcontext()
+
+
+def get_job_data_dir(data_dir: Path, job: Tuple[str, str, str]) -> Path:
+    """
+    Each (work_id, ocr_engine, batch_number) job gets its own data directory
+    so that batches of the same work never mix their files or archives, also
+    when they run at the same time.
+    """
+    _, ocr_engine, batch_number = job
+    return data_dir / ocr_engine / batch_number
+
+
+class PipelineJob:
+    """
+    One batch moving through the pipeline's stages: download, package
+    (metadata and zip archive) and upload.
+
+    The stages are methods so that they can run back to back (run_pipeline)
+    or in separate threads connected by queues (staged_pipeline). Use the
+    job as a context manager around its stages: it holds the batch's place
+    in the scratch space, if any, while they run.
+
+    See run_pipeline for the arguments.
+    """
+
+    def __init__(
+        self,
+        work_id: str,
+        batch_number: str,
+        ocr_engine: str,
+        base_data_dir: str = "./data",
+        stage_limits: Optional[Dict[str, Any]] = None,
+        catalog: Optional[Catalog] = None,
+        sync: bool = False,
+        streaming: bool = False,
+        metrics: Optional[BatchMetrics] = None,
+        job_state: Optional[JobStateStore] = None,
+        published: Optional[PublishedRecord] = None,
+        scratch: Optional[ScratchSpace] = None,
+    ):
+        self.work_id = work_id
+        self.batch_number = batch_number
+        self.ocr_engine = ocr_engine
+        self.base_data_dir = base_data_dir
+        self.stage_limits = stage_limits
+        self.catalog = catalog
+        self.sync = sync
+        self.streaming = streaming
+        self.metrics = metrics if metrics is not None else BatchMetrics()
+        self.job_state = job_state
+        self.published = published
+        self.job = (work_id, ocr_engine, batch_number)
+        self.document_id = get_document_id(work_id, ocr_engine, batch_number)
+        self.completed = job_state.get_completed(self.job) if job_state else {}
+        self.data_dir = get_job_data_dir(Path(base_data_dir), self.job)
+        self.work_path = self.data_dir / work_id
+        # Streaming never writes to the data directory
+        self.scratch_entry = ScratchEntry(
+            None if streaming else scratch,
+            self.work_path,
+            get_manifest_path(work_id, str(self.data_dir)),
+        )
+        self.metadata: Optional[Dict[str, Any]] = self.completed.get("metadata")
+        self.zip_path: Optional[str] = self.completed.get("zip")
+        self.archive: Optional[IO[bytes]] = None
+
+    def __enter__(self) -> "PipelineJob":
+        if self.scratch_entry.space is not None:
+            self.scratch_entry.estimate = self.estimate_disk_usage()
+        self.scratch_entry.__enter__()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.archive is not None:
+            self.archive.close()
+        self.scratch_entry.__exit__(*exc)
+
+    def estimate_disk_usage(self) -> int:
+        """
+        Estimate the bytes the batch takes in the data directory from the
+        catalog or the S3 listing: its OCR files plus their zip archive,
+        which is about as large as the files are already compressed.
+        """
+        key_filter, _, _ = get_ocr_engine_handlers(self.ocr_engine)
+        s3_prefix = (
+            f"{get_s3_prefix(self.work_id)}{self.ocr_engine}/{self.batch_number}/"
+        )
+        objects = iter_ocr_objects(s3_prefix, key_filter, self.catalog)
+        return 2 * sum(obj.size for obj in objects)
+
+    def checkpoint(self, stage: str, result: Any = None) -> None:
+        if self.job_state:
+            self.job_state.mark_done(self.job, stage, result)
+        if stage == "upload" and self.published:
+            self.published.add(self.document_id, result)
+
+    def get_published_pecha(self) -> Optional[str]:
+        """
+        Return the pecha ID of the batch if it was already published, per the
+        published record or the job state, in which case it must be skipped.
+        """
+        if self.published:
+            pecha_id = self.published.get(self.document_id)
+            if pecha_id is not None:
+                logger.info(f"⏭️ {self.document_id} already published; skipping")
+                return pecha_id
+        if self.completed.get("upload"):
+            pecha_id = self.completed["upload"]
+            logger.info(f"⏭️ Already uploaded as pecha {pecha_id}; skipping")
+            if self.published:
+                self.published.add(self.document_id, pecha_id)
+            return pecha_id
+        return None
+
+    def has_archive(self) -> bool:
+        # An archive left by a previous run, with the metadata it was made for
+        return bool(self.metadata and self.zip_path and Path(self.zip_path).exists())
+
+    def download(self) -> None:
+        """
+        Step 1: Download OCR files (nothing to do when streaming).
+        """
+        if self.streaming:
+            return
+        if self.has_archive():
+            logger.info(f"⏭️ Reusing the archive from a previous run: {self.zip_path}")
+            return
+        if "download" in self.completed and self.work_path.exists() and not self.sync:
+            logger.info("⏭️ OCR data already downloaded; skipping")
+            return
+        logger.info("📥 Downloading OCR data...")
+        with stage_limit(self.stage_limits, "download"), self.metrics.stage("download"):
+            download_result = download_ocr_data(
+                self.work_id,
+                self.batch_number,
+                self.ocr_engine,
+                base_data_dir=str(self.data_dir),
+                catalog=self.catalog,
+                sync=self.sync,
+            )
+        if not download_result.ok:
+            count("objects_failed", len(download_result.failed))
+            raise RuntimeError(
+                f"{len(download_result.failed)} file(s) failed to download for "
+                f"{self.work_id}/{self.ocr_engine}/{self.batch_number}"
+            )
+        self.scratch_entry.update()
+        self.checkpoint("download")
+        # The metadata files are written into the downloaded folder
+        self.metadata = None
+
+    def package(self) -> None:
+        """
+        Steps 2 and 3: Generate metadata and zip the OCR folder, or build the
+        archive straight from S3 when streaming.
+        """
+        if self.streaming:
+            logger.info("📦 Packaging OCR data straight from S3...")
+            with stage_limit(self.stage_limits, "download"), self.metrics.stage(
+                "package"
+            ):
+                self.metadata, self.archive = package_ocr_data_from_s3(
+                    self.work_id,
+                    self.batch_number,
+                    self.ocr_engine,
+                    catalog=self.catalog,
+                )
+                count("bytes_archived", self.archive.seek(0, os.SEEK_END))
+                self.archive.seek(0)
+            return
+        if self.has_archive():
+            assert self.zip_path is not None
+            count("bytes_archived", Path(self.zip_path).stat().st_size)
+            return
+
+        if self.metadata:
+            logger.info("⏭️ Metadata already generated; skipping")
+        else:
+            logger.info("📝 Generating metadata...")
+            with stage_limit(self.stage_limits, "metadata"), self.metrics.stage(
+                "metadata"
+            ):
+                self.metadata = generate_metadata(
+                    self.work_path, self.ocr_engine, self.batch_number
+                )
+            self.checkpoint("metadata", self.metadata)
+
+        logger.info("📦 Creating zip archive...")
+        with stage_limit(self.stage_limits, "zip"), self.metrics.stage("zip"):
+            self.zip_path = str(Path(zip_folder(self.work_path)).resolve())
+        self.scratch_entry.update()
+        self.checkpoint("zip", self.zip_path)
+        count("bytes_archived", Path(self.zip_path).stat().st_size)
+
+    def upload(self) -> Optional[str]:
+        """
+        Step 4: Upload to OpenPecha.
+
+        Returns:
+            The ID of the created pecha, or None if the upload failed.
+
+        Raises:
+            RuntimeError: If the batch has not been packaged.
+        """
+        archive = self.archive if self.streaming else self.zip_path
+        if self.metadata is None or archive is None:
+            raise RuntimeError(f"{self.document_id} has not been packaged")
+        logger.info("☁️ Uploading to OpenPecha API...")
+        with stage_limit(self.stage_limits, "upload"), self.metrics.stage("upload"):
+            if isinstance(archive, str):
+                pecha_id = create_pecha(self.metadata, data_file=Path(archive))
+            else:
+                pecha_id = create_pecha(self.metadata, data_fileobj=archive)
+        if pecha_id:
+            self.scratch_entry.mark_uploaded()
+            self.checkpoint("upload", pecha_id)
+        return pecha_id
 
 
 def run_pipeline(
-    work_id: str, batch_number: str, ocr_engine: str, base_data_dir: str = "./data"
-):
+    work_id: str,
+    batch_number: str,
+    ocr_engine: str,
+    base_data_dir: str = "./data",
+    stage_limits: Optional[Dict[str, Any]] = None,
+    catalog: Optional[Catalog] = None,
+    sync: bool = False,
+    streaming: bool = False,
+    metrics: Optional[BatchMetrics] = None,
+    job_state: Optional[JobStateStore] = None,
+    published: Optional[PublishedRecord] = None,
+    scratch: Optional[ScratchSpace] = None,
+) -> Optional[str]:
     """
     Full pipeline: Download OCR data, extract metadata, zip folder, and send to OpenPecha API.
+
+    Args:
+        base_data_dir: Root of the data directory. The batch's files, download
+            manifest and zip archive go under <base_data_dir>/<ocr_engine>/
+            <batch_number>/ (see get_job_data_dir).
+        stage_limits: Optional mapping of stage name ("download", "metadata",
+            "zip", "upload") to a semaphore-like context manager that bounds how
+            many pipelines may run that stage at once.
+        catalog: Optional local catalog used instead of listing S3.
+        sync: Re-download files whose size or ETag changed since the last run
+            instead of only skipping files that exist.
+        streaming: Stream OCR files from S3 straight into an in-memory zip
+            archive instead of downloading them to base_data_dir.
+        metrics: Optional BatchMetrics receiving the duration of each stage
+            (excluding time spent waiting for a stage limit) and the object and
+            byte counts of the batch.
+        job_state: Optional store in which each finished stage is checkpointed.
+            Stages it records as finished are skipped when their output is
+            still on disk, and a batch already uploaded is not uploaded again.
+        published: Optional record of published document IDs. A batch found
+            there is skipped before anything is downloaded, and a batch
+            uploaded by this call is added to it.
+        scratch: Optional disk-budgeted scratch space. The batch waits for
+            room in it before downloading, and its files become evictable once
+            the pipeline is done with them.
+
+    Returns:
+        The ID of the created pecha, or None if the upload failed.
     """
     logger.info(
         f"\n🚀 Running pipeline for work ID: {work_id}, batch: {batch_number}, engine: {ocr_engine}"
     )
+    job = PipelineJob(
+        work_id,
+        batch_number,
+        ocr_engine,
+        base_data_dir=base_data_dir,
+        stage_limits=stage_limits,
+        catalog=catalog,
+        sync=sync,
+        streaming=streaming,
+        metrics=metrics,
+        job_state=job_state,
+        published=published,
+        scratch=scratch,
+    )
+    pecha_id = job.get_published_pecha()
+    if pecha_id is not None:
+        return pecha_id
 
-    work_path = Path(base_data_dir) / work_id
-
-    # Step 1: Download OCR files
-    logger.info("📥 Downloading OCR data...")
-    download_ocr_data(work_id, batch_number, ocr_engine)
-
-    # Step 2: Generate metadata
-    logger.info("📝 Generating metadata...")
-    metadata = generate_metadata(work_path, ocr_engine, batch_number)
-
-    # Step 3: Zip the OCR folder
-    logger.info("📦 Creating zip archive...")
-    zip_path = zip_folder(work_path)
-
-    # Step 4: Upload to OpenPecha
-    logger.info("☁️ Uploading to OpenPecha API...")
-    create_pecha(metadata, data_file=Path(zip_path))
+    with collecting(job.metrics), job.metrics.stage("total"), job:
+        job.download()
+        job.package()
+        return job.upload()
 
 
-def get_work_batches(work_id: str):
+def get_work_batches(work_id: str, catalog: Optional[Catalog] = None):
     """
     Discover all OCR engines and batch directories for a given work ID.
 
+    When a catalog is given, batches are discovered from it without listing S3.
+
     Returns a list of tuples (work_id, ocr_engine, batch_number) for all combinations found.
     """
     result = []
@@ -169,7 +606,7 @@ def get_work_batches(work_id: str):
         engine_prefix = f"{s3_prefix}{engine}/"
         try:
             # Get all keys in the engine directory
-            engine_keys = get_s3_keys(engine_prefix)
+            engine_keys = list_keys(engine_prefix, catalog)
 
             if not engine_keys:
                 continue
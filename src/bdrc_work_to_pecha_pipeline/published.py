@@ -0,0 +1,148 @@
+"""
+Local record of the batches already published to OpenPecha, keyed by their
+document_id ({work_id}_{ocr_engine}_{batch_number}, see
+metadata.get_document_id), so re-runs over the whole archive can skip them
+before downloading anything.
+
+The record is a SQLite database that several worker processes can share.
+
+# List every published batch
+python -m bdrc_work_to_pecha_pipeline.published --db published.db
+
+# Seed the record from a file of "document_id<TAB>pecha_id" lines
+python -m bdrc_work_to_pecha_pipeline.published --db published.db --import published.tsv
+
+# Forget a batch so that it is published again
+python -m bdrc_work_to_pecha_pipeline.published --db published.db --remove W1234_vision_batch001
+"""
+import argparse
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from bdrc_work_to_pecha_pipeline.logger import get_logger
+from bdrc_work_to_pecha_pipeline.sqlite_store import SQLiteStore
+
+logger = get_logger(__name__)
+
+DEFAULT_PUBLISHED_FILE = "published.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS published (
+    document_id TEXT PRIMARY KEY,
+    pecha_id TEXT,
+    published_at REAL NOT NULL
+);
+"""
+
+
+class PublishedRecord(SQLiteStore):
+    """
+    SQLite-backed set of published document IDs and their pecha IDs. Open
+    one PublishedRecord per process (see sqlite_store.SQLiteStore).
+    """
+
+    def __init__(self, path: str = DEFAULT_PUBLISHED_FILE):
+        super().__init__(path, SCHEMA)
+
+    def get(self, document_id: str) -> Optional[str]:
+        """
+        Return the pecha ID a document was published as, or None if it has
+        not been published. Documents imported without a pecha ID map to "".
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT pecha_id FROM published WHERE document_id = ?", (document_id,)
+            ).fetchone()
+        return (row[0] or "") if row else None
+
+    def __contains__(self, document_id: str) -> bool:
+        return self.get(document_id) is not None
+
+    def add(self, document_id: str, pecha_id: Optional[str] = None) -> None:
+        """
+        Record a published document. The write is committed before returning.
+        """
+        self.add_many([(document_id, pecha_id)])
+
+    def add_many(self, entries: Iterable[Tuple[str, Optional[str]]]) -> int:
+        """
+        Record many (document_id, pecha_id) pairs in one transaction.
+
+        Returns:
+            The number of entries written.
+        """
+        now = time.time()
+        rows = [(document_id, pecha_id, now) for document_id, pecha_id in entries]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO published VALUES (?, ?, ?)", rows
+            )
+        return len(rows)
+
+    def remove(self, document_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM published WHERE document_id = ?", (document_id,)
+            )
+
+    def get_all(self) -> Dict[str, str]:
+        """
+        Return every published document ID mapped to its pecha ID.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT document_id, pecha_id FROM published ORDER BY document_id"
+            ).fetchall()
+        return {document_id: pecha_id or "" for document_id, pecha_id in rows}
+
+
+def read_published_file(path: str) -> Iterable[Tuple[str, Optional[str]]]:
+    """
+    Parse "document_id[<TAB>pecha_id]" lines, ignoring blank lines and '#'
+    comments.
+    """
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            document_id, _, pecha_id = line.partition("\t")
+            yield document_id.strip(), pecha_id.strip() or None
+
+
+def main():
+    """
+    Main function to run the script.
+    """
+    parser = argparse.ArgumentParser(description="Inspect or edit the published record")
+    parser.add_argument(
+        "--db", type=str, default=DEFAULT_PUBLISHED_FILE, help="Published database"
+    )
+    parser.add_argument(
+        "--import",
+        dest="import_file",
+        type=str,
+        metavar="FILE",
+        help="Add the document IDs listed in FILE (one per line, optionally "
+        "followed by a tab and the pecha ID)",
+    )
+    parser.add_argument(
+        "--remove", type=str, metavar="DOCUMENT_ID", help="Forget a document"
+    )
+    args = parser.parse_args()
+
+    with PublishedRecord(args.db) as record:
+        if args.import_file:
+            added = record.add_many(read_published_file(args.import_file))
+            logger.info(f"Imported {added} document ID(s) into {args.db}")
+            return
+        if args.remove:
+            record.remove(args.remove)
+            logger.info(f"Removed {args.remove}")
+            return
+        for document_id, pecha_id in record.get_all().items():
+            print(f"{document_id}\t{pecha_id}")
+
+
+if __name__ == "__main__":
+    main()
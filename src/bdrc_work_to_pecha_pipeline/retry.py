@@ -0,0 +1,332 @@
+"""
+Shared retry policy and adaptive concurrency limiting for S3 and OpenPecha
+API calls.
+
+A RetryPolicy retries transient failures (throttling, 5xx responses,
+connection errors) with exponential backoff and full jitter, honouring the
+server's Retry-After when it sends one. An AdaptiveLimiter bounds how many
+calls to a service run at once and adjusts the bound AIMD-style: it grows by
+one slot per window of successful calls and is halved when the service
+throttles, so concurrency settles just below the service's limit.
+
+Each process has one limiter per service (see get_limiter), shared by every
+thread calling that service.
+"""
+import asyncio
+import random
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from botocore.exceptions import (
+    ClientError,
+    ConnectionClosedError,
+    ConnectTimeoutError,
+    EndpointConnectionError,
+    IncompleteReadError,
+    ReadTimeoutError,
+    ResponseStreamingError,
+)
+
+from bdrc_work_to_pecha_pipeline.logger import get_logger
+from bdrc_work_to_pecha_pipeline.metrics import count
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+# S3 error codes meaning the caller should slow down
+THROTTLING_CODES = {
+    "SlowDown",
+    "Throttling",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "RequestThrottled",
+    "TooManyRequests",
+    "503",
+}
+
+# HTTP statuses meaning the service is rate limiting us
+THROTTLING_STATUS_CODES = {429, 503}
+# HTTP statuses of requests that were not processed and may be sent again.
+# 502 and 504 are left out: the gateway may already have passed the request
+# on, and sending a pecha again could create it twice.
+RETRY_STATUS_CODES = {429, 503}
+
+
+@lru_cache(maxsize=None)
+def get_transient_errors() -> Tuple[type, ...]:
+    # s3transfer and requests are slow to import and only needed once an
+    # error has happened
+    import requests
+    from s3transfer.exceptions import RetriesExceededError
+
+    return (
+        ConnectionClosedError,
+        ConnectTimeoutError,
+        EndpointConnectionError,
+        # A response body cut short while it was being read
+        IncompleteReadError,
+        ReadTimeoutError,
+        ResponseStreamingError,
+        RetriesExceededError,
+        # Raised before the request is sent, so retrying cannot duplicate it
+        requests.ConnectTimeout,
+    )
+
+
+class RetryableHTTPError(Exception):
+    """
+    Raised for an HTTP response whose status means the request can be sent
+    again (see RETRY_STATUS_CODES). Keeps the response for the caller.
+
+    Args:
+        response: A requests response, or an aiohttp one along with its
+            status (aiohttp responses have no status_code).
+        status_code: The response's status, if not response.status_code.
+    """
+
+    def __init__(self, response: Any, status_code: Optional[int] = None):
+        if status_code is None:
+            status_code = response.status_code
+        super().__init__(f"HTTP {status_code} from {response.url}")
+        self.response = response
+        self.status_code = status_code
+        self.retry_after = parse_retry_after(response.headers.get("Retry-After"))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header given in seconds. HTTP dates are ignored.
+    """
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+def is_throttling_error(error: BaseException) -> bool:
+    """
+    Whether an error means the service is rate limiting us.
+    """
+    if isinstance(error, RetryableHTTPError):
+        return error.status_code in THROTTLING_STATUS_CODES
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code")
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        return code in THROTTLING_CODES or status in THROTTLING_STATUS_CODES
+    return False
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """
+    Whether an error is transient: throttling, a 5xx from S3, a retryable HTTP
+    status or a connection failure. Missing objects, denied access and other
+    4xx errors are not retried.
+    """
+    if isinstance(error, (RetryableHTTPError, *get_transient_errors())):
+        return True
+    if isinstance(error, ClientError):
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        return is_throttling_error(error) or (status or 0) >= 500
+    return False
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit adjusted by additive increase, multiplicative decrease.
+
+    Use as a context manager around each call; report throttling with
+    on_throttle() and successes with on_success(). The limit grows by one
+    after `limit` consecutive successes and is multiplied by decrease_factor
+    on throttling, at most once per cooldown seconds so that a burst of
+    throttled calls that were already in flight only counts once.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int = 1,
+        maximum: Optional[int] = None,
+        decrease_factor: float = 0.5,
+        cooldown: float = 1.0,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum if maximum is not None else initial
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.limit = max(minimum, min(initial, self.maximum))
+        self.in_flight = 0
+        self._successes = 0
+        self._last_decrease = float("-inf")
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    def try_acquire(self) -> bool:
+        with self._condition:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    async def acquire_async(self, poll_interval: float = 0.05) -> None:
+        """
+        Wait for a slot without blocking the event loop. Polls rather than
+        waiting in a thread, so a cancelled waiter never takes a slot.
+        """
+        while not self.try_acquire():
+            await asyncio.sleep(poll_interval)
+
+    def release(self) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def __enter__(self) -> "AdaptiveLimiter":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+    def on_success(self) -> None:
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify()
+
+    def on_throttle(self) -> None:
+        with self._condition:
+            self._successes = 0
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            limit = max(self.minimum, int(self.limit * self.decrease_factor))
+            if limit < self.limit:
+                logger.warning(f"Throttled; lowering concurrency to {limit}")
+                self.limit = limit
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: before retry n (from 0) the caller
+    sleeps a random time between 0 and min(max_delay, base_delay * 2 ** n),
+    or at least the Retry-After the server asked for.
+    """
+
+    max_attempts: int = 5
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    retryable: Callable[[BaseException], bool] = is_retryable_error
+
+    def get_delay(self, attempt: int, error: BaseException) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def _should_retry(
+        self,
+        attempt: int,
+        error: BaseException,
+        limiter: Optional[AdaptiveLimiter],
+    ) -> bool:
+        if is_throttling_error(error):
+            count("throttled")
+            if limiter:
+                limiter.on_throttle()
+        if attempt + 1 >= self.max_attempts or not self.retryable(error):
+            return False
+        count("retries")
+        logger.info(f"Attempt {attempt + 1} failed ({error}); retrying")
+        return True
+
+    def call(
+        self,
+        func: Callable[..., T],
+        *args,
+        limiter: Optional[AdaptiveLimiter] = None,
+        **kwargs,
+    ) -> T:
+        """
+        Call func, retrying retryable errors. Each attempt holds a slot of the
+        limiter, if given; the backoff sleep does not.
+        """
+        for attempt in range(self.max_attempts):
+            try:
+                if limiter:
+                    with limiter:
+                        result = func(*args, **kwargs)
+                    limiter.on_success()
+                    return result
+                return func(*args, **kwargs)
+            except Exception as e:
+                if not self._should_retry(attempt, e, limiter):
+                    raise
+                time.sleep(self.get_delay(attempt, e))
+        raise AssertionError("unreachable")
+
+    async def call_async(
+        self,
+        func: Callable[..., Awaitable[T]],
+        *args,
+        limiter: Optional[AdaptiveLimiter] = None,
+        **kwargs,
+    ) -> T:
+        """
+        Await func(*args, **kwargs), retrying retryable errors. Each attempt
+        holds a slot of the limiter, if given, like call().
+        """
+        for attempt in range(self.max_attempts):
+            try:
+                if limiter:
+                    await limiter.acquire_async()
+                    try:
+                        result = await func(*args, **kwargs)
+                    finally:
+                        limiter.release()
+                    limiter.on_success()
+                    return result
+                return await func(*args, **kwargs)
+            except Exception as e:
+                if not self._should_retry(attempt, e, limiter):
+                    raise
+                await asyncio.sleep(self.get_delay(attempt, e))
+        raise AssertionError("unreachable")
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def configure_limiter(service: str, **options: Any) -> AdaptiveLimiter:
+    """
+    Create (or replace) this process's limiter for a service.
+    """
+    with _limiters_lock:
+        _limiters[service] = AdaptiveLimiter(**options)
+        return _limiters[service]
+
+
+def get_limiter(service: str, initial: int) -> AdaptiveLimiter:
+    """
+    Return this process's limiter for a service, creating it with the given
+    initial (and maximum) limit on first use.
+    """
+    with _limiters_lock:
+        if service not in _limiters:
+            _limiters[service] = AdaptiveLimiter(initial)
+        return _limiters[service]
@@ -0,0 +1,432 @@
+"""
+Disk-budgeted scratch space for downloaded works and their archives.
+
+Every work directory the pipeline downloads into is tracked in a SQLite
+database together with its size on disk (the directory and its <work>.zip).
+Before a work is downloaded the pipeline waits until the space it is
+estimated to need fits in the budget, evicting works to make room: first the
+least recently used works whose pecha was uploaded, then failed ones, which a
+later run downloads again. Works still being processed are never evicted and
+count for at least their estimate until they are released.
+
+The database can be shared by the worker processes of one machine. Each
+active work records the process processing it; works left active by a
+process that has exited (e.g. after a crash) are treated as failed.
+
+# Show the tracked works and their sizes
+python -m bdrc_work_to_pecha_pipeline.scratch --db data/.scratch.db
+
+# Evict uploaded and failed works until less than 10 GB are used
+python -m bdrc_work_to_pecha_pipeline.scratch --db data/.scratch.db --evict-to 10
+"""
+import argparse
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from bdrc_work_to_pecha_pipeline.logger import get_logger
+from bdrc_work_to_pecha_pipeline.sqlite_store import SQLiteStore
+
+logger = get_logger(__name__)
+
+# Scratch database, under the data directory
+SCRATCH_DB_NAME = ".scratch.db"
+
+# Seconds between checks while waiting for space
+DEFAULT_POLL_INTERVAL = 5.0
+
+GB = 1024**3
+
+ACTIVE = "active"
+UPLOADED = "uploaded"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS works (
+    path TEXT PRIMARY KEY,
+    manifest_path TEXT,
+    size INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL,
+    last_used REAL NOT NULL,
+    reserved INTEGER NOT NULL DEFAULT 0,
+    owner_pid INTEGER,
+    owner_started TEXT
+);
+"""
+
+# Columns added to the works table since it was first created, for databases
+# created before
+ADDED_COLUMNS = {
+    "reserved": "INTEGER NOT NULL DEFAULT 0",
+    "owner_pid": "INTEGER",
+    "owner_started": "TEXT",
+}
+
+# Bytes a work counts for: its estimate while active, its size on disk after
+USAGE_SQL = "COALESCE(SUM(MAX(size, reserved)), 0)"
+
+
+def get_disk_usage(path: Path) -> int:
+    """
+    Total size in bytes of a file or of every file under a directory.
+    """
+    if path.is_file():
+        return path.stat().st_size
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.stat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def get_process_start(pid: int) -> Optional[str]:
+    """
+    Return when a process started, in clock ticks since boot, or None if it
+    cannot be told (no such process, or no /proc file system).
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # Field 22; the command name before it, in parentheses, may hold spaces
+    return stat.rsplit(")", 1)[1].split()[19]
+
+
+def is_process_running(pid: int, started: Optional[str]) -> bool:
+    """
+    Whether the process that had this pid and start time is still running,
+    as opposed to having exited or its pid having been reused.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running as another user
+        pass
+    if started is None:
+        return True
+    return get_process_start(pid) in (None, started)
+
+
+def get_zip_path(work_path: Path) -> Path:
+    # Where utils.zip_folder writes the archive by default
+    return work_path.with_name(f"{work_path.name}.zip")
+
+
+def remove_work_files(work_path: Path, manifest_path: Optional[Path]) -> None:
+    shutil.rmtree(work_path, ignore_errors=True)
+    get_zip_path(work_path).unlink(missing_ok=True)
+    if manifest_path:
+        manifest_path.unlink(missing_ok=True)
+
+
+class ScratchEntry:
+    """
+    A work tracked by a ScratchSpace while the pipeline processes it. Without
+    a ScratchSpace its methods do nothing.
+
+    estimate is the disk space in bytes the work is expected to take, which
+    is reserved on entry; it may be set until then.
+    """
+
+    def __init__(
+        self,
+        space: Optional["ScratchSpace"],
+        work_path: Path,
+        manifest_path: Optional[Path] = None,
+        estimate: int = 0,
+    ):
+        self.space = space
+        self.work_path = work_path
+        self.manifest_path = manifest_path
+        self.estimate = estimate
+        self.uploaded = False
+
+    def __enter__(self) -> "ScratchEntry":
+        if self.space:
+            self.space.reserve(self.work_path, self.manifest_path, self.estimate)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.space:
+            self.space.release(self.work_path, UPLOADED if self.uploaded else FAILED)
+
+    def update(self) -> None:
+        """
+        Record the work's current size on disk.
+        """
+        if self.space:
+            self.space.update(self.work_path)
+
+    def mark_uploaded(self) -> None:
+        self.uploaded = True
+
+
+class ScratchSpace(SQLiteStore):
+    """
+    SQLite-backed accounting of the disk used by downloaded works, with a byte
+    budget and LRU eviction. Open one per process (see
+    sqlite_store.SQLiteStore).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        budget: int,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+    ):
+        # Autocommit, as reserve and evict issue BEGIN IMMEDIATE themselves
+        super().__init__(path, SCHEMA, isolation_level=None)
+        self.budget = budget
+        self.poll_interval = poll_interval
+        self._add_columns()
+
+    def _add_columns(self) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                columns = {
+                    row[1] for row in self._conn.execute("PRAGMA table_info(works)")
+                }
+                for column, definition in ADDED_COLUMNS.items():
+                    if column not in columns:
+                        self._conn.execute(
+                            f"ALTER TABLE works ADD COLUMN {column} {definition}"
+                        )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def track(
+        self,
+        work_path: Path,
+        manifest_path: Optional[Path] = None,
+        estimate: int = 0,
+    ) -> ScratchEntry:
+        """
+        Context manager reserving space for a work on entry and releasing it,
+        as uploaded or failed, on exit.
+        """
+        return ScratchEntry(self, work_path, manifest_path, estimate)
+
+    def get_usage(self) -> int:
+        """
+        Return the bytes used or reserved by the tracked works.
+        """
+        with self._lock:
+            (usage,) = self._conn.execute(f"SELECT {USAGE_SQL} FROM works").fetchone()
+        return usage
+
+    def list_works(self) -> List[Tuple[str, int, str, float]]:
+        """
+        Return (path, size, state, last_used) of every tracked work, least
+        recently used first.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT path, size, state, last_used FROM works ORDER BY last_used"
+            ).fetchall()
+
+    def _expire_locked(self) -> None:
+        """
+        Within a write transaction, mark as failed the active works whose
+        process has exited without releasing them, so they can be evicted.
+        Works recorded before owners were, which have none, are expired too.
+        """
+        rows = self._conn.execute(
+            "SELECT path, owner_pid, owner_started FROM works WHERE state = ?",
+            (ACTIVE,),
+        ).fetchall()
+        for path, pid, started in rows:
+            if pid is not None and is_process_running(pid, started):
+                continue
+            logger.warning(f"Process {pid} exited while processing {path}")
+            self._conn.execute(
+                "UPDATE works SET state = ?, reserved = 0 WHERE path = ?",
+                (FAILED, path),
+            )
+
+    def _evict_locked(
+        self, target: int, keep: Optional[str] = None
+    ) -> Tuple[bool, List[Tuple[str, str]]]:
+        """
+        Within a write transaction, drop uploaded then failed works other than
+        `keep`, least recently used first, until the works other than `keep`
+        use less than `target` bytes.
+
+        Returns:
+            Whether the usage is now below the target and the (path,
+            manifest_path) of the evicted works, whose files are still to be
+            removed.
+        """
+        self._expire_locked()
+        (usage,) = self._conn.execute(
+            f"SELECT {USAGE_SQL} FROM works WHERE path IS NOT ?", (keep,)
+        ).fetchone()
+        evicted = []
+        candidates = self._conn.execute(
+            "SELECT path, manifest_path, size FROM works "
+            "WHERE state != ? AND path IS NOT ? "
+            "ORDER BY state = ? DESC, last_used",
+            (ACTIVE, keep, UPLOADED),
+        ).fetchall()
+        for path, manifest_path, size in candidates:
+            if usage < target:
+                break
+            self._conn.execute("DELETE FROM works WHERE path = ?", (path,))
+            evicted.append((path, manifest_path))
+            usage -= size
+        return usage < target, evicted
+
+    def _remove(self, evicted: List[Tuple[str, str]]) -> None:
+        for path, manifest_path in evicted:
+            logger.info(f"🧹 Evicting {path} from the scratch space")
+            remove_work_files(
+                Path(path), Path(manifest_path) if manifest_path else None
+            )
+
+    def evict(self, target: int) -> bool:
+        """
+        Evict uploaded and failed works until less than `target` bytes are
+        used.
+
+        Returns:
+            Whether the target was reached.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                reached, evicted = self._evict_locked(target)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._remove(evicted)
+        return reached
+
+    def reserve(
+        self,
+        work_path: Path,
+        manifest_path: Optional[Path] = None,
+        estimate: int = 0,
+    ) -> None:
+        """
+        Block until `estimate` more bytes fit in the budget, evicting works as
+        needed, then track work_path as active, owned by this process and
+        counting for at least `estimate` bytes until it is released.
+
+        A work is always admitted when no other work is active, so a budget
+        smaller than a single work slows the pipeline down but cannot stall it.
+        """
+        path = str(Path(work_path).resolve())
+        waiting_since = None
+        while True:
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    reached, evicted = self._evict_locked(
+                        self.budget - estimate, keep=path
+                    )
+                    (active,) = self._conn.execute(
+                        "SELECT COUNT(*) FROM works WHERE state = ? AND path != ?",
+                        (ACTIVE, path),
+                    ).fetchone()
+                    admitted = reached or not active
+                    if admitted:
+                        self._conn.execute(
+                            "INSERT INTO works (path, manifest_path, state, "
+                            "last_used, reserved, owner_pid, owner_started) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                            "ON CONFLICT (path) DO UPDATE SET state = excluded.state, "
+                            "last_used = excluded.last_used, "
+                            "reserved = excluded.reserved, "
+                            "owner_pid = excluded.owner_pid, "
+                            "owner_started = excluded.owner_started",
+                            (
+                                path,
+                                str(manifest_path) if manifest_path else None,
+                                ACTIVE,
+                                time.time(),
+                                estimate,
+                                os.getpid(),
+                                get_process_start(os.getpid()),
+                            ),
+                        )
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            self._remove(evicted)
+            if admitted:
+                if waiting_since is not None:
+                    logger.info(
+                        f"Waited {time.monotonic() - waiting_since:.0f}s for scratch space"
+                    )
+                return
+            if waiting_since is None:
+                waiting_since = time.monotonic()
+                logger.info(f"⏳ Scratch space over budget; waiting to download {path}")
+            time.sleep(self.poll_interval)
+
+    def update(self, work_path: Path) -> None:
+        """
+        Record the current size on disk of a work, its archive included.
+        """
+        work_path = Path(work_path).resolve()
+        size = get_disk_usage(work_path) if work_path.exists() else 0
+        zip_path = get_zip_path(work_path)
+        if zip_path.exists():
+            size += zip_path.stat().st_size
+        with self._lock:
+            self._conn.execute(
+                "UPDATE works SET size = ?, last_used = ? WHERE path = ?",
+                (size, time.time(), str(work_path)),
+            )
+
+    def release(self, work_path: Path, state: str) -> None:
+        """
+        Stop treating a work as active, making it evictable and counting it
+        for its size on disk only.
+        """
+        self.update(work_path)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE works SET state = ?, reserved = 0 WHERE path = ?",
+                (state, str(Path(work_path).resolve())),
+            )
+
+
+def main():
+    """
+    Main function to run the script.
+    """
+    parser = argparse.ArgumentParser(description="Inspect or trim the scratch space")
+    parser.add_argument(
+        "--db", type=str, default=f"./data/{SCRATCH_DB_NAME}", help="Scratch database"
+    )
+    parser.add_argument(
+        "--evict-to",
+        type=float,
+        metavar="GB",
+        help="Evict uploaded and failed works until less than GB gigabytes are used",
+    )
+    args = parser.parse_args()
+
+    with ScratchSpace(args.db, budget=0) as scratch:
+        if args.evict_to is not None:
+            scratch.evict(int(args.evict_to * GB))
+        for path, size, state, _ in scratch.list_works():
+            print(f"{path}\t{state}\t{size}")
+        print(f"Total: {scratch.get_usage() / GB:.2f} GB")
+
+
+if __name__ == "__main__":
+    main()
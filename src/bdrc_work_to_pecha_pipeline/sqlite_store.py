@@ -0,0 +1,60 @@
+"""
+Base class of the pipeline's SQLite-backed stores: the bucket catalog, the
+job state, the published record and the scratch space.
+
+Each store opens a single connection, shared between threads and guarded by a
+lock, so one store per process can be used from thread pools. The databases
+are in WAL mode so that processes can read while another one writes, and a
+writer waits up to LOCK_TIMEOUT seconds for another process's transaction.
+"""
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Literal, Optional, TypeVar
+
+# Seconds a writer waits for another process's transaction to finish
+LOCK_TIMEOUT = 60.0
+
+S = TypeVar("S", bound="SQLiteStore")
+
+
+class SQLiteStore:
+    """
+    A SQLite database created with a schema on opening.
+
+    Args:
+        path: Database file; its parent directory is created if needed.
+        schema: SQL script run on opening, made of CREATE ... IF NOT EXISTS
+            statements.
+        isolation_level: As for sqlite3.connect. None puts the connection in
+            autocommit mode, for stores that issue BEGIN IMMEDIATE themselves.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        schema: str,
+        isolation_level: Optional[Literal["DEFERRED", "IMMEDIATE"]] = "DEFERRED",
+    ):
+        self.path = path
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(
+            path,
+            timeout=LOCK_TIMEOUT,
+            check_same_thread=False,
+            isolation_level=isolation_level,
+        )
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(schema)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self: S) -> S:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,339 @@
+"""
+Run many batches through the pipeline as three overlapping stages: download,
+package (metadata and zip) and upload.
+
+Each stage has its own worker threads and hands batches to the next stage
+through a bounded queue, so while one batch uploads the next one is zipped
+and the one after that downloaded, keeping the network and the CPU busy at
+the same time. When a downstream stage falls behind its queue fills up and
+the stage feeding it blocks, which bounds the number of batches on disk (or,
+when streaming, of archives in memory) to the stage workers plus the queued
+batches.
+
+# Process every work ID listed in a file
+python -m bdrc_work_to_pecha_pipeline.staged_pipeline --input work_ids.txt
+
+# Download 4 batches at once and let at most 2 zipped batches wait for upload
+python -m bdrc_work_to_pecha_pipeline.staged_pipeline --input work_ids.txt --download-workers 4 --queue-size 2
+
+# Resume from job state and keep downloaded works under 50 GB
+python -m bdrc_work_to_pecha_pipeline.staged_pipeline --input work_ids.txt --state job_state.db --scratch-budget 50
+"""
+import argparse
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from bdrc_work_to_pecha_pipeline.batch_runner import (
+    Job,
+    add_run_arguments,
+    plan_jobs,
+    read_input_work_ids,
+    write_summary,
+)
+from bdrc_work_to_pecha_pipeline.catalog import Catalog
+from bdrc_work_to_pecha_pipeline.job_state import JobStateStore
+from bdrc_work_to_pecha_pipeline.logger import get_logger
+from bdrc_work_to_pecha_pipeline.metrics import BatchMetrics, MetricsSink, collecting
+from bdrc_work_to_pecha_pipeline.pecha_upload import PipelineJob
+from bdrc_work_to_pecha_pipeline.published import PublishedRecord
+from bdrc_work_to_pecha_pipeline.scratch import GB, SCRATCH_DB_NAME, ScratchSpace
+
+logger = get_logger(__name__)
+
+STAGES = ("download", "package", "upload")
+
+# Downloads wait on the network and uploads on the OpenPecha API, so they get
+# more threads than packaging, which is CPU-bound
+DEFAULT_STAGE_WORKERS = {"download": 2, "package": 1, "upload": 2}
+
+# Batches that may wait between two stages
+DEFAULT_QUEUE_SIZE = 2
+
+# Put on a queue once per worker of the next stage when no batches are left
+_DONE = object()
+
+
+class StagedRun:
+    """
+    The stage threads and queues of one run_staged call, and the records of
+    the batches that have left the pipeline.
+    """
+
+    def __init__(
+        self,
+        data_dir: Path,
+        queue_size: int,
+        catalog: Optional[Catalog],
+        sync: bool,
+        streaming: bool,
+        job_state: Optional[JobStateStore],
+        published: Optional[PublishedRecord],
+        scratch: Optional[ScratchSpace],
+        metrics_sink: Optional[MetricsSink],
+    ):
+        self.data_dir = data_dir
+        self.catalog = catalog
+        self.sync = sync
+        self.streaming = streaming
+        self.job_state = job_state
+        self.published = published
+        self.scratch = scratch
+        self.metrics_sink = metrics_sink
+        # Jobs waiting to be downloaded hold no data yet, so this one is unbounded
+        self.queues: Dict[str, queue.Queue] = {
+            stage: queue.Queue(maxsize=0 if stage == "download" else queue_size)
+            for stage in STAGES
+        }
+        self.records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._started: Dict[PipelineJob, float] = {}
+
+    def create_job(self, job: Job) -> PipelineJob:
+        work_id, ocr_engine, batch_number = job
+        return PipelineJob(
+            work_id,
+            batch_number,
+            ocr_engine,
+            base_data_dir=str(self.data_dir),
+            catalog=self.catalog,
+            sync=self.sync,
+            streaming=self.streaming,
+            metrics=BatchMetrics(),
+            job_state=self.job_state,
+            published=self.published,
+            scratch=self.scratch,
+        )
+
+    def finish(
+        self,
+        job: PipelineJob,
+        pecha_id: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        """
+        Release the job's scratch space and record its outcome. Errors doing
+        so are logged, not raised, so the stage thread keeps running.
+        """
+        name = f"{job.work_id}/{job.ocr_engine}/{job.batch_number}"
+        with self._lock:
+            started = self._started.pop(job, None)
+        duration = 0.0
+        if started is not None:
+            try:
+                job.__exit__(None, None, None)
+            except Exception:
+                logger.exception(f"Failed to release {name}")
+            duration = time.monotonic() - started
+            job.metrics.add_time("total", duration)
+        if not pecha_id and not error:
+            error = "Pecha upload failed"
+        record: Dict[str, Any] = {
+            "work_id": job.work_id,
+            "ocr_engine": job.ocr_engine,
+            "batch_number": job.batch_number,
+            "status": "failed" if error else "succeeded",
+            "pecha_id": pecha_id,
+            "error": error,
+            "duration": round(duration, 3),
+            "metrics": job.metrics.to_dict(),
+        }
+        if error:
+            logger.error(f"❌ Error processing {name}: {error}")
+        else:
+            logger.info(f"✅ Successfully processed {name}")
+        with self._lock:
+            self.records.append(record)
+            if self.metrics_sink:
+                try:
+                    self.metrics_sink.add(record)
+                except Exception:
+                    logger.exception(f"Failed to write the metrics of {name}")
+
+    def download(self, job: PipelineJob) -> bool:
+        pecha_id = job.get_published_pecha()
+        if pecha_id is not None:
+            self.finish(job, pecha_id)
+            return False
+        started = time.monotonic()
+        # Waits for room in the scratch space, if any
+        job.__enter__()
+        with self._lock:
+            self._started[job] = started
+        job.download()
+        return True
+
+    def package(self, job: PipelineJob) -> bool:
+        job.package()
+        return True
+
+    def upload(self, job: PipelineJob) -> bool:
+        self.finish(job, job.upload())
+        return False
+
+    def work(self, stage: str, next_stage: Optional[str]) -> None:
+        """
+        Worker thread of a stage: take jobs from the stage's queue until
+        _DONE, run the stage on each and pass it on, blocking while the next
+        stage's queue is full. A job that fails leaves the pipeline.
+        Errors, including those recording a job's outcome, never stop the
+        thread: with no threads left, a stage's full queue would block the
+        stage feeding it forever.
+        """
+        run_stage: Callable[[PipelineJob], bool] = getattr(self, stage)
+        while True:
+            job = self.queues[stage].get()
+            if job is _DONE:
+                return
+            try:
+                with collecting(job.metrics):
+                    passed_on = run_stage(job)
+            except Exception as e:
+                try:
+                    self.finish(job, error=str(e))
+                except Exception:
+                    logger.exception(f"Failed to finish {job.document_id}")
+                continue
+            if passed_on and next_stage:
+                self.queues[next_stage].put(job)
+
+
+def run_staged(
+    jobs: List[Job],
+    data_dir: str = "./data",
+    stage_workers: Optional[Dict[str, int]] = None,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    catalog: Optional[Catalog] = None,
+    sync: bool = False,
+    streaming: bool = False,
+    job_state: Optional[JobStateStore] = None,
+    published: Optional[PublishedRecord] = None,
+    scratch: Optional[ScratchSpace] = None,
+    metrics_sink: Optional[MetricsSink] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Run jobs through the download, package and upload stages, each with its
+    own threads, connected by bounded queues.
+
+    Args:
+        jobs: (work_id, ocr_engine, batch_number) tuples to process, in the
+            order they should be downloaded.
+        data_dir: Root directory for downloaded data and zip files.
+        stage_workers: Threads per stage, keyed by stage name (see STAGES);
+            stages not given use DEFAULT_STAGE_WORKERS.
+        queue_size: Batches that may wait between two stages before the
+            earlier stage blocks.
+        catalog: Optional local catalog used instead of listing S3.
+        sync: Only download new, changed or incomplete files.
+        streaming: Package OCR files straight from S3 without using data_dir;
+            the download stage then has nothing to do.
+        job_state: Optional store in which finished stages are checkpointed.
+        published: Optional record of published batches, consulted before a
+            batch is downloaded and updated after it is uploaded.
+        scratch: Optional disk-budgeted scratch space the download stage
+            waits on.
+        metrics_sink: Optional sink each job record is written to as it
+            finishes.
+
+    Returns:
+        One summary record per job, as batch_runner.run_job builds them.
+    """
+    workers = {**DEFAULT_STAGE_WORKERS, **(stage_workers or {})}
+    if queue_size < 1 or any(workers[stage] < 1 for stage in STAGES):
+        raise ValueError("Every stage needs at least one worker and queue slot")
+    run = StagedRun(
+        Path(data_dir).resolve(),
+        queue_size,
+        catalog,
+        sync,
+        streaming,
+        job_state,
+        published,
+        scratch,
+        metrics_sink,
+    )
+    for job in jobs:
+        run.queues["download"].put(run.create_job(job))
+
+    next_stages = dict(zip(STAGES, (*STAGES[1:], None)))
+    threads = {
+        stage: [
+            threading.Thread(
+                target=run.work,
+                args=(stage, next_stages[stage]),
+                name=f"{stage}-{i}",
+                daemon=True,
+            )
+            for i in range(workers[stage])
+        ]
+        for stage in STAGES
+    }
+    for stage_threads in threads.values():
+        for thread in stage_threads:
+            thread.start()
+    # A stage is told to stop once every thread feeding it has stopped
+    for stage in STAGES:
+        for _ in threads[stage]:
+            run.queues[stage].put(_DONE)
+        for thread in threads[stage]:
+            thread.join()
+    return run.records
+
+
+def main():
+    """
+    Main function to run the script.
+    """
+    parser = argparse.ArgumentParser(
+        description="Run the pipeline for a list of work IDs with overlapping stages"
+    )
+    add_run_arguments(parser)
+    for stage in STAGES:
+        parser.add_argument(
+            f"--{stage}-workers",
+            type=int,
+            default=DEFAULT_STAGE_WORKERS[stage],
+            help=f"Threads running the {stage} stage",
+        )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        help="Batches that may wait between two stages",
+    )
+    args = parser.parse_args()
+
+    work_ids = read_input_work_ids(args.input)
+
+    started_at = datetime.now(timezone.utc)
+    catalog = Catalog(args.catalog) if args.catalog else None
+    job_state = JobStateStore(args.state) if args.state else None
+    published = PublishedRecord(args.published) if args.published else None
+    scratch = None
+    if args.scratch_budget is not None:
+        scratch = ScratchSpace(
+            str(Path(args.data_dir) / SCRATCH_DB_NAME), int(args.scratch_budget * GB)
+        )
+    jobs = plan_jobs(work_ids, catalog, published)
+
+    records = run_staged(
+        jobs,
+        data_dir=args.data_dir,
+        stage_workers={stage: getattr(args, f"{stage}_workers") for stage in STAGES},
+        queue_size=args.queue_size,
+        catalog=catalog,
+        sync=args.sync,
+        streaming=args.streaming,
+        job_state=job_state,
+        published=published,
+        scratch=scratch,
+        metrics_sink=MetricsSink(args.metrics, args.prometheus_textfile),
+    )
+    write_summary(records, started_at, args.summary)
+
+
+if __name__ == "__main__":
+    main()
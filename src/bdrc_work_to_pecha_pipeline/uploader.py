@@ -0,0 +1,223 @@
+"""
+Client for the OpenPecha API pecha upload endpoint.
+
+Uploads go through a shared requests.Session, so keep-alive connections are
+pooled and reused across pechas, and the multipart/form-data body is streamed
+from the archive file instead of being assembled in memory. Throttled or
+unavailable responses (429, 503) and connect timeouts are retried with
+backoff, under the adaptive "openpecha" concurrency limiter. Gateway errors
+(502, 504) are not, as the pecha may have been created anyway.
+"""
+import os
+import uuid
+from typing import IO, TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from bdrc_work_to_pecha_pipeline.retry import (
+    DEFAULT_RETRY_POLICY,
+    RETRY_STATUS_CODES,
+    RetryableHTTPError,
+    RetryPolicy,
+    get_limiter,
+)
+
+if TYPE_CHECKING:
+    import requests
+
+OPENPECHA_API_URL = "https://api-l25bgmwqoa-uc.a.run.app"
+
+# (connect, read) timeouts in seconds; reading covers the server processing the pecha
+DEFAULT_TIMEOUT: Tuple[float, float] = (10, 600)
+
+# Number of keep-alive connections kept per host
+DEFAULT_POOL_SIZE = 10
+
+# Size of the chunks the multipart body is sent in
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# (form field, file name, binary file object, content type) of a file part
+FilePart = Tuple[str, str, IO[bytes], str]
+
+
+class MultipartStream:
+    """
+    A multipart/form-data body that is read incrementally.
+
+    Form fields are encoded up front; file parts are read from their file
+    objects only as the body is consumed. The total length is known in
+    advance, so requests sends a Content-Length header rather than chunking.
+    """
+
+    def __init__(
+        self,
+        fields: List[Tuple[str, str]],
+        files: List[FilePart],
+        boundary: Optional[str] = None,
+    ):
+        self.boundary = boundary or uuid.uuid4().hex
+        self._parts: List[Union[bytes, IO[bytes]]] = []
+        self._length = 0
+
+        for name, value in fields:
+            self._add(
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"'
+                f"\r\n\r\n".encode() + value.encode() + b"\r\n"
+            )
+        for name, filename, fileobj, content_type in files:
+            self._add(
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                f'filename="{filename}"\r\nContent-Type: {content_type}\r\n\r\n'.encode()
+            )
+            start = fileobj.tell()
+            size = fileobj.seek(0, os.SEEK_END) - start
+            fileobj.seek(start)
+            self._parts.append(fileobj)
+            self._length += size
+            self._add(b"\r\n")
+        self._add(f"--{self.boundary}--\r\n".encode())
+
+        self._current = 0
+        self._buffer = b""
+
+    def _add(self, data: bytes) -> None:
+        self._parts.append(data)
+        self._length += len(data)
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return self._length
+
+    def read(self, size: int = -1) -> bytes:
+        chunks = []
+        remaining = size if size is not None and size >= 0 else self._length
+        while remaining > 0 and self._current < len(self._parts):
+            part = self._parts[self._current]
+            if isinstance(part, bytes):
+                if not self._buffer:
+                    self._buffer = part
+                chunk, self._buffer = self._buffer[:remaining], self._buffer[remaining:]
+                if not self._buffer:
+                    self._current += 1
+            else:
+                chunk = part.read(remaining)
+                if not chunk:
+                    self._current += 1
+                    continue
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b"".join(chunks)
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in iter(lambda: self.read(UPLOAD_CHUNK_SIZE), b""):
+            yield chunk
+
+
+class PechaUploader:
+    """
+    Uploads pechas to the OpenPecha API over a pooled, keep-alive session.
+
+    A session must not be shared across processes; use get_uploader() to get
+    the current process's instance.
+    """
+
+    def __init__(
+        self,
+        base_url: str = OPENPECHA_API_URL,
+        timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.retry_policy = retry_policy
+        self.limiter = get_limiter("openpecha", pool_size)
+        # Imported here as requests is slow to import and only uploads need it
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self) -> "PechaUploader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def create_pecha(
+        self, metadata_json: str, file: Optional[FilePart] = None
+    ) -> "requests.Response":
+        """
+        POST a pecha to /pecha, streaming the file object of the file part.
+
+        Responses with a status in retry.RETRY_STATUS_CODES are retried,
+        re-reading the file object from its initial position; if every attempt
+        fails the last such response is returned.
+
+        Args:
+            metadata_json: The JSON-encoded pecha metadata.
+            file: The file part, whose form field is "data" or "text" and
+                whose file object is positioned at the start of the content.
+                Without it only the metadata is sent.
+
+        Returns:
+            The API response.
+        """
+        start = file[2].tell() if file else 0
+
+        def post() -> "requests.Response":
+            if file:
+                file[2].seek(start)
+            body = MultipartStream(
+                [("metadata", metadata_json)], [file] if file else []
+            )
+            response = self.session.post(
+                f"{self.base_url}/pecha",
+                data=body,
+                headers={"Content-Type": body.content_type},
+                timeout=self.timeout,
+            )
+            if response.status_code in RETRY_STATUS_CODES:
+                raise RetryableHTTPError(response)
+            return response
+
+        try:
+            return self.retry_policy.call(post, limiter=self.limiter)
+        except RetryableHTTPError as e:
+            return e.response
+
+
+_uploader: Optional[PechaUploader] = None
+_uploader_pid: Optional[int] = None
+_uploader_options: Dict[str, Any] = {}
+
+
+def configure_uploader(**options) -> None:
+    """
+    Set the PechaUploader arguments (base_url, timeout, pool_size) used by
+    get_uploader(). Applies to uploaders created afterwards, including those
+    of forked worker processes.
+    """
+    global _uploader
+    _uploader_options.clear()
+    _uploader_options.update(options)
+    _uploader = None
+
+
+def get_uploader() -> PechaUploader:
+    """
+    Return this process's shared uploader, creating it on first use (and again
+    in forked child processes, which must not reuse the parent's sockets).
+    """
+    global _uploader, _uploader_pid
+    if _uploader is None or _uploader_pid != os.getpid():
+        _uploader = PechaUploader(**_uploader_options)
+        _uploader_pid = os.getpid()
+    return _uploader
@@ -1,42 +1,34 @@
 import os
-import subprocess
 
+from bdrc_work_to_pecha_pipeline.archive import build_archive_from_folder
+from bdrc_work_to_pecha_pipeline.logger import get_logger
 
-def zip_folder(folder_path, output_path=None):
+logger = get_logger(__name__)
+
+
+def zip_folder(folder_path, output_path=None, max_workers=None):
     """
     This function creates a zip file containing all files inside a folder, including files in subfolders,
-    without including the top-level folder in the zip archive.
+    with the folder itself as the top-level directory of the zip archive.
+
+    The archive is built in-process: members are compressed in parallel across
+    max_workers threads (defaults to the CPU count), already-gzipped files are
+    stored as-is, and the process working directory is never changed, so it is
+    safe to zip several folders concurrently.
+
+    By default the zip file is written next to the folder, as <folder>.zip.
     """
     if output_path is None:
-        output_path = os.path.basename(folder_path) + ".zip"
+        output_path = os.path.join(
+            os.path.dirname(folder_path), os.path.basename(folder_path) + ".zip"
+        )
 
     if not os.path.isdir(folder_path):
         raise ValueError(f"The folder '{folder_path}' does not exist.")
 
-    parent_dir = os.path.dirname(folder_path)
-    folder_name = os.path.basename(folder_path)
-
-    try:
-        # Change the current working directory to the parent directory of the folder
-        os.chdir(parent_dir)
-
-        # Use subprocess to call the zip command
-        # -r to include files recursively
-        subprocess.run(
-            ["zip", "-r", output_path]
-            + [f"{folder_name}/{f}" for f in os.listdir(folder_name)],
-            check=True,
-        )
-        print(f"Folder '{folder_name}' has been zipped successfully.")
-
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Error while zipping the folder: {e}")
-    except Exception as e:
-        print(f"❌ Error: {e}")
-    finally:
-        # Change back to the original directory (good practice)
-        original_cwd = os.getcwd()
-        if original_cwd != parent_dir:
-            os.chdir(original_cwd)
+    build_archive_from_folder(folder_path, output_path, max_workers=max_workers)
+    logger.info(
+        f"Folder '{os.path.basename(folder_path)}' has been zipped successfully."
+    )
 
     return output_path
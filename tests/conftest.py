@@ -0,0 +1,4 @@
+import os
+
+# Keep test runs out of the project's logs/pipeline.log
+os.environ.setdefault("BDRC_PIPELINE_LOG_FILE", "")
@@ -0,0 +1,240 @@
+import asyncio
+import hashlib
+import io
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from bdrc_work_to_pecha_pipeline.async_pipeline import AsyncPipeline
+from bdrc_work_to_pecha_pipeline.download import (
+    download_gv_ocr_files,
+    download_ocr_keys,
+    iter_s3_keys,
+)
+
+OBJECTS = {
+    "Works/a1/W1234/vision/batch001/info.json": b'{"timestamp": "2022"}',
+    "Works/a1/W1234/vision/batch001/output/I5678/1.json.gz": b"page1",
+    "Works/a1/W1234/vision/batch001/output/I5678/2.json.gz": b"page2",
+    "Works/a1/W1234/vision/batch002/output/I5678/1.json.gz": b"page1",
+}
+
+
+class FakeBody:
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+    async def read(self, size=-1):
+        return self.stream.read(size)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+class FakePaginator:
+    async def paginate(self, Bucket, Prefix):
+        keys = sorted(key for key in OBJECTS if key.startswith(Prefix))
+        # Two listing pages, to check downloads start before the listing ends
+        for page in (keys[:1], keys[1:]):
+            await asyncio.sleep(0)
+            yield {
+                "Contents": [
+                    {
+                        "Key": key,
+                        "Size": len(OBJECTS[key]),
+                        # S3 quotes ETags; single-part ones are the content MD5
+                        "ETag": f'"{hashlib.md5(OBJECTS[key]).hexdigest()}"',
+                    }
+                    for key in page
+                ]
+            }
+
+
+class FakeS3Client:
+    def __init__(self):
+        self.fetched = []
+
+    def get_paginator(self, operation):
+        return FakePaginator()
+
+    async def get_object(self, Bucket, Key):
+        self.fetched.append(Key)
+        return {"Body": FakeBody(OBJECTS[Key])}
+
+
+def test_get_work_batches():
+    async def discover():
+        async with AsyncPipeline(s3_client=FakeS3Client(), http_session=object()) as p:
+            return await p.get_work_batches("W1234")
+
+    with patch(
+        "bdrc_work_to_pecha_pipeline.async_pipeline.get_s3_prefix",
+        return_value="Works/a1/W1234/",
+    ):
+        assert asyncio.run(discover()) == [
+            ("W1234", "vision", "batch001"),
+            ("W1234", "vision", "batch002"),
+        ]
+
+
+@patch("bdrc_work_to_pecha_pipeline.async_pipeline.zip_folder")
+@patch("bdrc_work_to_pecha_pipeline.async_pipeline.generate_metadata")
+@patch(
+    "bdrc_work_to_pecha_pipeline.async_pipeline.get_s3_prefix",
+    return_value="Works/a1/W1234/",
+)
+def test_run_job(mock_prefix, mock_generate_metadata, mock_zip_folder, tmp_path):
+    s3_client = FakeS3Client()
+    zip_path = tmp_path / "W1234.zip"
+    zip_path.write_bytes(b"PK")
+    mock_zip_folder.return_value = str(zip_path)
+
+    async def run():
+        async with AsyncPipeline(
+            s3_client=s3_client,
+            http_session=object(),
+            stage_concurrency={"download": 1},
+        ) as pipeline:
+            with patch.object(
+                pipeline, "create_pecha", AsyncMock(return_value="P0001")
+            ):
+                return await pipeline.run_job(("W1234", "vision", "batch001"), tmp_path)
+
+    record = asyncio.run(run())
+    assert record["status"] == "succeeded"
+    assert record["pecha_id"] == "P0001"
+    assert record["metrics"]["counters"]["objects_downloaded"] == 3
+    assert record["metrics"]["counters"]["bytes_downloaded"] == 31
+    assert {"download", "metadata", "zip", "total"} <= set(record["metrics"]["stages"])
+
+    work_path = tmp_path / "vision" / "batch001" / "W1234"
+    assert (work_path / "info.json").read_bytes() == b'{"timestamp": "2022"}'
+    assert (work_path / "I5678" / "2.json.gz").read_bytes() == b"page2"
+    assert len(s3_client.fetched) == 3
+    mock_generate_metadata.assert_called_once_with(work_path, "vision", "batch001")
+    mock_zip_folder.assert_called_once_with(work_path)
+
+
+class FakeFormData:
+    def add_field(self, *args, **kwargs):
+        pass
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+        self.ok = status < 400
+        self.url = "https://example.org/pecha"
+        self.headers = {}
+
+    async def json(self):
+        return {"id": "P0001"}
+
+    async def text(self):
+        return "error"
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+class FakeSession:
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+
+    def post(self, url, data):
+        return FakeResponse(self.statuses.pop(0))
+
+
+@patch("bdrc_work_to_pecha_pipeline.retry.asyncio.sleep", AsyncMock())
+@patch("bdrc_work_to_pecha_pipeline.async_pipeline.register_pecha")
+@patch(
+    "bdrc_work_to_pecha_pipeline.async_pipeline.require_async_dependencies",
+    return_value=(SimpleNamespace(FormData=FakeFormData), None, None),
+)
+def test_create_pecha_retries_throttling(mock_require, mock_register, tmp_path):
+    zip_path = tmp_path / "W1234.zip"
+    zip_path.write_bytes(b"PK")
+    session = FakeSession([503, 429, 200])
+
+    async def create(metadata):
+        async with AsyncPipeline(s3_client=object(), http_session=session) as p:
+            return await p.create_pecha(metadata, zip_path)
+
+    metadata = {"bdrc": {"ocr_import_info": {"bdrc_scan_id": "W1234"}}}
+    assert asyncio.run(create(metadata)) == "P0001"
+    assert session.statuses == []
+    mock_register.assert_called_once_with("W1234", "P0001")
+
+    # Gateway errors are not retried, and a missing scan ID is not an error
+    session.statuses = [502, 200]
+    assert asyncio.run(create({})) is None
+    assert session.statuses == [200]
+    session.statuses = [200]
+    assert asyncio.run(create({})) == "P0001"
+    mock_register.assert_called_once()
+
+
+@patch("bdrc_work_to_pecha_pipeline.download.get_s3_client")
+def test_sync_manifest_round_trip(mock_get_s3_client, tmp_path):
+    prefix = "Works/a1/W1234/vision/batch001/"
+
+    def paginate(Bucket, Prefix):
+        keys = sorted(key for key in OBJECTS if key.startswith(Prefix))
+        return [
+            {
+                "Contents": [
+                    {
+                        "Key": key,
+                        "Size": len(OBJECTS[key]),
+                        "ETag": f'"{hashlib.md5(OBJECTS[key]).hexdigest()}"',
+                    }
+                    for key in keys
+                ]
+            }
+        ]
+
+    def fake_download_file(bucket, key, local_file_path, Config=None):
+        with open(local_file_path, "wb") as f:
+            f.write(OBJECTS[key])
+
+    mock_s3_client = mock_get_s3_client.return_value
+    mock_s3_client.get_paginator.return_value.paginate.side_effect = paginate
+    mock_s3_client.download_file.side_effect = fake_download_file
+
+    async def list_and_sync(s3_client):
+        async with AsyncPipeline(
+            s3_client=s3_client, http_session=object(), sync=True
+        ) as pipeline:
+            objects = [obj async for obj in pipeline.iter_objects(prefix)]
+            result = await pipeline.download_ocr_data(
+                "W1234", "batch001", "vision", str(tmp_path)
+            )
+            return objects, result
+
+    # Both pipelines see the same objects, with unquoted ETags
+    s3_client = FakeS3Client()
+    with patch(
+        "bdrc_work_to_pecha_pipeline.async_pipeline.get_s3_prefix",
+        return_value="Works/a1/W1234/",
+    ):
+        objects, result = asyncio.run(list_and_sync(s3_client))
+        assert objects == list(iter_s3_keys(prefix))
+        assert len(result.downloaded) == 3
+
+        # A manifest written by the async pipeline is honoured by the sync one
+        result = download_ocr_keys(
+            objects, download_gv_ocr_files, base_data_dir=str(tmp_path), sync=True
+        )
+        assert len(result.skipped) == 3
+        mock_s3_client.download_file.assert_not_called()
+
+        # Files without a manifest entry are adopted when their MD5 matches
+        (tmp_path / ".manifests" / "W1234.json").unlink()
+        _, result = asyncio.run(list_and_sync(s3_client))
+        assert len(result.skipped) == 3
+        assert len(s3_client.fetched) == 3
@@ -0,0 +1,81 @@
+import argparse
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from bdrc_work_to_pecha_pipeline import batch_runner
+from bdrc_work_to_pecha_pipeline.published import PublishedRecord
+
+
+def test_read_work_ids():
+    lines = [
+        "W1234\n",
+        "\n",
+        "# a comment\n",
+        "2024-01-01 10:00:00 - list_works - INFO - Found 2 work IDs\n",
+        "W5678\n",
+        "W1234\n",
+    ]
+    assert batch_runner.read_work_ids(lines) == ["W1234", "W5678"]
+
+
+@patch("bdrc_work_to_pecha_pipeline.batch_runner.run_pipeline")
+def test_run_job(mock_run_pipeline):
+    mock_run_pipeline.return_value = "P0001"
+    record = batch_runner.run_job(("W1234", "vision", "batch001"), "/data")
+    assert record["status"] == "succeeded"
+    assert record["pecha_id"] == "P0001"
+    assert mock_run_pipeline.call_args.kwargs["base_data_dir"] == "/data"
+
+    mock_run_pipeline.side_effect = RuntimeError("Simulated download error")
+    record = batch_runner.run_job(("W1234", "vision", "batch002"), "/data")
+    assert record["status"] == "failed"
+    assert record["error"] == "Simulated download error"
+
+
+def test_build_summary():
+    records = [
+        {
+            "work_id": "W2",
+            "ocr_engine": "vision",
+            "batch_number": "batch001",
+            "status": "failed",
+        },
+        {
+            "work_id": "W1",
+            "ocr_engine": "vision",
+            "batch_number": "batch001",
+            "status": "succeeded",
+        },
+    ]
+    now = datetime.now(timezone.utc)
+    summary = batch_runner.build_summary(records, now, now)
+    assert summary["total"] == 2
+    assert summary["succeeded"] == 1
+    assert summary["failed"] == 1
+    assert [job["work_id"] for job in summary["jobs"]] == ["W1", "W2"]
+
+
+def test_filter_published(tmp_path):
+    jobs = [("W1", "vision", "batch001"), ("W1", "vision", "batch002")]
+    with PublishedRecord(str(tmp_path / "published.db")) as published:
+        assert batch_runner.filter_published(jobs, published) == jobs
+        published.add("W1_vision_batch001", "P0001")
+        assert batch_runner.filter_published(jobs, published) == jobs[1:]
+
+
+@patch("bdrc_work_to_pecha_pipeline.batch_runner.prefetch_buda_data")
+@patch("bdrc_work_to_pecha_pipeline.batch_runner.discover_jobs")
+def test_plan_jobs(mock_discover_jobs, mock_prefetch_buda_data, tmp_path):
+    jobs = [("W1", "vision", "batch001"), ("W2", "vision", "batch001")]
+    mock_discover_jobs.return_value = jobs
+    with PublishedRecord(str(tmp_path / "published.db")) as published:
+        published.add("W1_vision_batch001", "P0001")
+        assert batch_runner.plan_jobs(["W1", "W2"], published=published) == jobs[1:]
+    assert list(mock_prefetch_buda_data.call_args.args[0]) == ["W2"]
+
+
+def test_add_run_arguments():
+    parser = argparse.ArgumentParser()
+    batch_runner.add_run_arguments(parser, ("--input", "--sync"))
+    args = parser.parse_args(["--input", "work_ids.txt", "--sync"])
+    assert args.input == "work_ids.txt" and args.sync
@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+from bdrc_work_to_pecha_pipeline.buda_cache import BudaCache
+from bdrc_work_to_pecha_pipeline.metadata import prefetch_buda_data
+
+
+def test_get_or_fetch_caches_on_disk(tmp_path):
+    fetch = MagicMock(return_value={"source_metadata": {"id": "W1234"}})
+    cache = BudaCache(tmp_path)
+    assert cache.get_or_fetch("W1234", fetch) == {"source_metadata": {"id": "W1234"}}
+    # A new cache on the same directory (e.g. a re-run) does not refetch
+    assert BudaCache(tmp_path).get_or_fetch("W1234", fetch)["source_metadata"]
+    fetch.assert_called_once_with("W1234")
+
+
+def test_expired_entries_are_refetched(tmp_path):
+    fetch = MagicMock(side_effect=[{"v": 1}, {"v": 2}])
+    cache = BudaCache(tmp_path, ttl=60)
+    assert cache.get_or_fetch("W1234", fetch) == {"v": 1}
+    later = time.time() + 61
+    with patch("bdrc_work_to_pecha_pipeline.buda_cache.time.time", return_value=later):
+        assert cache.get_or_fetch("W1234", fetch) == {"v": 2}
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = BudaCache(tmp_path)
+    for i, work_id in enumerate(["W1", "W2", "W3"]):
+        cache.put(work_id, {"data": "x" * 100})
+        os.utime(cache.get_path(work_id), (1000 + i, 1000 + i))
+    cache.get("W1")  # W1 is now the most recently used
+
+    cache.max_size = sum(cache.get_path(w).stat().st_size for w in ("W1", "W3"))
+    assert cache.evict() == 1
+    assert sorted(p.stem for p in tmp_path.glob("*.json")) == ["W1", "W3"]
+
+
+def test_put_scans_the_cache_only_when_needed(tmp_path):
+    cache = BudaCache(tmp_path)
+    with patch.object(cache, "evict", wraps=cache.evict) as evict:
+        for i in range(10):
+            cache.put(f"W{i}", {"data": "x" * 100})
+        # Only the first put scans the directory while it is below the limit
+        assert evict.call_count == 1
+
+        # Entry sizes vary by a byte or two with the digits of fetched_at
+        cache.max_size = 5 * max(p.stat().st_size for p in tmp_path.glob("*.json"))
+        cache.put("W10", {"data": "x" * 100})
+        assert evict.call_count == 2
+    assert len(list(tmp_path.glob("*.json"))) == 5
+
+
+def test_concurrent_puts_of_the_same_work(tmp_path):
+    cache = BudaCache(tmp_path)
+    errors = []
+
+    def put(i):
+        try:
+            for _ in range(50):
+                cache.put("W1", {"writer": i})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=put, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert [p.name for p in tmp_path.iterdir()] == ["W1.json"]
+
+
+@patch("bdrc_work_to_pecha_pipeline.metadata.get_buda_cache")
+@patch("bdrc_work_to_pecha_pipeline.metadata.get_buda_scan_info")
+def test_prefetch_buda_data(mock_get_buda_scan_info, mock_get_buda_cache, tmp_path):
+    mock_get_buda_cache.return_value = BudaCache(tmp_path)
+    mock_get_buda_scan_info.side_effect = lambda work_id: (
+        {"id": work_id} if work_id != "W_BAD" else 1 / 0
+    )
+
+    failed = prefetch_buda_data(["W1", "W2", "W1", "W_BAD"])
+
+    assert list(failed) == ["W_BAD"]
+    assert mock_get_buda_scan_info.call_count == 3
+    assert BudaCache(tmp_path).get("W2") == {"id": "W2"}
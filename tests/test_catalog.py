@@ -0,0 +1,88 @@
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import pytest
+
+from bdrc_work_to_pecha_pipeline.catalog import Catalog, parse_key
+
+LISTINGS = {
+    "Works/a1/": [
+        {
+            "Key": "Works/a1/W1234/vision/batch001/output/I1/1.json.gz",
+            "Size": 10,
+            "ETag": '"etag-1"',
+            "LastModified": datetime(2024, 1, 1, tzinfo=timezone.utc),
+        },
+        {
+            "Key": "Works/a1/W1234/vision/batch002/info.json",
+            "Size": 20,
+            "ETag": '"etag-2"',
+            "LastModified": datetime(2024, 1, 2, tzinfo=timezone.utc),
+        },
+    ],
+    "Works/b2/": [
+        {
+            "Key": "Works/b2/W5678/google_books/batch001/info.json",
+            "Size": 30,
+            "ETag": '"etag-3"',
+        },
+    ],
+}
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    with Catalog(str(tmp_path / "catalog.db")) as catalog:
+        yield catalog
+
+
+def test_parse_key():
+    assert parse_key("Works/a1/W1234/vision/batch001/info.json") == (
+        "Works/a1/",
+        "W1234",
+        "vision",
+        "batch001",
+    )
+    assert parse_key("Works/a1/W1234/info.json") == ("Works/a1/", "W1234", None, None)
+
+
+@patch("bdrc_work_to_pecha_pipeline.catalog.iter_s3_objects")
+@patch("bdrc_work_to_pecha_pipeline.catalog.list_all_hash_directories")
+def test_refresh_and_query(mock_list_hash_dirs, mock_iter_s3_objects, catalog):
+    mock_list_hash_dirs.return_value = sorted(LISTINGS)
+    mock_iter_s3_objects.side_effect = lambda prefix: iter(LISTINGS[prefix])
+
+    assert catalog.refresh() == ["Works/a1/", "Works/b2/"]
+    assert catalog.list_work_ids() == ["W1234", "W5678"]
+    assert catalog.get_keys("Works/a1/W1234/vision/") == [
+        "Works/a1/W1234/vision/batch001/output/I1/1.json.gz",
+        "Works/a1/W1234/vision/batch002/info.json",
+    ]
+    assert catalog.get_objects("Works/b2/W5678/") == [
+        ("Works/b2/W5678/google_books/batch001/info.json", 30, "etag-3")
+    ]
+    # An empty prefix lists everything
+    assert catalog.get_keys("") == sorted(
+        obj["Key"] for listing in LISTINGS.values() for obj in listing
+    )
+    assert catalog.get_work_details()["W1234"]["engine_batches"] == {
+        "vision": ["batch001", "batch002"]
+    }
+
+    # An unchanged listing is not reported as a change
+    assert catalog.refresh() == []
+
+    # Recently refreshed hash directories are not listed again
+    mock_iter_s3_objects.reset_mock()
+    assert catalog.refresh(max_age=3600) == []
+    mock_iter_s3_objects.assert_not_called()
+
+
+@patch("bdrc_work_to_pecha_pipeline.catalog.iter_s3_objects")
+def test_refresh_work_ids(mock_iter_s3_objects, catalog):
+    mock_iter_s3_objects.side_effect = lambda prefix: iter(LISTINGS[prefix])
+
+    # get_hash("W1234") == "a1"
+    assert catalog.refresh(work_ids=["W1234"]) == ["Works/a1/"]
+    mock_iter_s3_objects.assert_called_once_with("Works/a1/")
+    assert catalog.list_work_ids() == ["W1234"]
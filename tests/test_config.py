@@ -0,0 +1,67 @@
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+
+from bdrc_work_to_pecha_pipeline import config
+
+
+def test_import_does_not_create_clients():
+    code = (
+        "import sys, bdrc_work_to_pecha_pipeline.download; "
+        "print('boto3' in sys.modules)"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+    assert output.strip() == "False"
+
+
+def test_get_s3_client_is_cached_per_process():
+    client = config.get_s3_client()
+    assert config.get_s3_client() is client
+    assert client.meta.config.max_pool_connections == config.S3_MAX_POOL_CONNECTIONS
+
+    # A forked worker gets its own session and client
+    with patch("bdrc_work_to_pecha_pipeline.config.os.getpid", return_value=-1):
+        assert config.get_s3_client() is not client
+
+
+def test_single_attempt_client():
+    client = config.get_s3_client()
+    single_attempt = config.get_s3_client(single_attempt=True)
+    assert single_attempt is not client
+    assert config.get_s3_client(single_attempt=True) is single_attempt
+    assert single_attempt.meta.config.retries["total_max_attempts"] == 1
+    assert "total_max_attempts" not in client.meta.config.retries
+
+
+def test_configure_s3_thread_scope():
+    try:
+        config.configure_s3(scope="thread", max_pool_connections=8, max_concurrency=2)
+        client = config.get_s3_client()
+        assert config.get_s3_client() is client
+        assert client.meta.config.max_pool_connections == 8
+        assert config.get_transfer_config().max_request_concurrency == 2
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            other = executor.submit(config.get_s3_client).result()
+        assert other is not client
+
+        with pytest.raises(ValueError):
+            config.configure_s3(scope="global")
+    finally:
+        config.configure_s3()
+    assert config.get_s3_client() is not client
+
+
+def test_deprecated_module_attributes():
+    with pytest.warns(DeprecationWarning, match="get_s3_client"):
+        assert config.s3_client is config.get_s3_client()
+    with pytest.warns(DeprecationWarning):
+        from bdrc_work_to_pecha_pipeline.config import ocr_output_bucket
+    assert ocr_output_bucket.name == config.OCR_OUTPUT_BUCKET
+    with pytest.raises(AttributeError):
+        config.no_such_attribute
@@ -1,8 +1,28 @@
+import hashlib
+import io
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from bdrc_work_to_pecha_pipeline import download
+from bdrc_work_to_pecha_pipeline.config import configure_s3
 from bdrc_work_to_pecha_pipeline.download import (
+    ChecksumError,
+    S3Object,
+    UnverifiableETag,
+    compute_etag,
+    download_gv_ocr_files,
+    download_ocr_keys,
+    download_s3_file,
     filter_gb_ocr_keys,
     filter_gv_ocr_keys,
+    get_etag_part_size,
     get_hash,
     get_s3_prefix,
+    is_gv_ocr_key,
+    iter_s3_keys,
 )
 
 
@@ -42,6 +62,249 @@ def test_filter_gv_ocr_keys():
     assert filtered_keys == ["Works/a1/W1234/123.json.gz", "Works/a1/W1234/info.json"]
 
 
+@patch("bdrc_work_to_pecha_pipeline.download.get_s3_client")
+def test_iter_s3_keys(mock_get_s3_client):
+    mock_s3_client = mock_get_s3_client.return_value
+    pages_listed = []
+
+    def paginate(**kwargs):
+        for i, page in enumerate(
+            [
+                {
+                    "Contents": [
+                        {"Key": "W1234/1.json.gz", "Size": 1, "ETag": '"a"'},
+                        {"Key": "W1234/images.zip", "Size": 2, "ETag": '"b"'},
+                    ]
+                },
+                {"Contents": [{"Key": "W1234/info.json", "Size": 3, "ETag": '"c"'}]},
+            ]
+        ):
+            pages_listed.append(i)
+            yield page
+
+    mock_s3_client.get_paginator.return_value.paginate.side_effect = paginate
+
+    stream = iter_s3_keys("W1234/", is_gv_ocr_key)
+    first = next(stream)
+    assert first == ("W1234/1.json.gz", 1, "a")
+    # The second page is only requested once the first one is consumed
+    assert pages_listed == [0]
+    assert [obj.key for obj in stream] == ["W1234/info.json"]
+    assert pages_listed == [0, 1]
+
+
+@patch("bdrc_work_to_pecha_pipeline.download.get_s3_client")
+def test_download_ocr_keys(mock_get_s3_client, tmp_path):
+    mock_s3_client = mock_get_s3_client.return_value
+
+    def fake_download_file(bucket, key, local_file_path, Config=None):
+        if key.endswith("bad.json.gz"):
+            raise Exception("Simulated S3 error")
+        Path(local_file_path).write_text(key)
+
+    mock_s3_client.download_file.side_effect = fake_download_file
+    existing = tmp_path / "W1234" / "I5678" / "2.json.gz"
+    existing.parent.mkdir(parents=True)
+    existing.write_text("already here")
+
+    keys = [
+        "Works/a1/W1234/vision/batch001/output/I5678/1.json.gz",
+        "Works/a1/W1234/vision/batch001/output/I5678/2.json.gz",
+        "Works/a1/W1234/vision/batch001/output/I5678/bad.json.gz",
+        "Works/a1/W1234/vision/batch001/info.json",
+    ]
+    result = download_ocr_keys(
+        keys, download_gv_ocr_files, max_workers=4, base_data_dir=str(tmp_path)
+    )
+
+    assert sorted(result.downloaded) == [keys[3], keys[0]]
+    assert result.skipped == [keys[1]]
+    assert list(result.failed) == [keys[2]]
+    assert not result.ok
+    assert (tmp_path / "W1234" / "I5678" / "1.json.gz").exists()
+    assert (tmp_path / "W1234" / "info.json").exists()
+    assert existing.read_text() == "already here"
+
+
+@patch("bdrc_work_to_pecha_pipeline.download.get_s3_client")
+def test_download_ocr_keys_bounds_keys_in_flight(
+    mock_get_s3_client, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(download, "DOWNLOAD_WINDOW_FACTOR", 2)
+    finished = []
+    ahead = []
+
+    def fake_download_file(bucket, key, local_file_path, Config=None):
+        time.sleep(0.001)
+        Path(local_file_path).write_text(key)
+        finished.append(key)
+
+    def keys():
+        for i in range(50):
+            # Keys pulled from the listing but not downloaded yet
+            ahead.append(i - len(finished))
+            yield f"Works/a1/W1234/vision/batch001/output/I5678/{i}.json.gz"
+
+    mock_get_s3_client.return_value.download_file.side_effect = fake_download_file
+    result = download_ocr_keys(
+        keys(), download_gv_ocr_files, max_workers=2, base_data_dir=str(tmp_path)
+    )
+
+    assert len(result.downloaded) == 50
+    # Two workers with a window of twice as many keys
+    assert max(ahead) <= 4
+
+
+@patch("bdrc_work_to_pecha_pipeline.download.get_s3_client")
+def test_download_ocr_keys_sync(mock_get_s3_client, tmp_path):
+    mock_s3_client = mock_get_s3_client.return_value
+    contents = {"1.json.gz": b"page one", "2.json.gz": b"page two"}
+
+    def fake_download_file(bucket, key, local_file_path, Config=None):
+        Path(local_file_path).write_bytes(contents[key.split("/")[-1]])
+
+    mock_s3_client.download_file.side_effect = fake_download_file
+    prefix = "Works/a1/W1234/vision/batch001/output/I5678/"
+    objects = [
+        S3Object(f"{prefix}1.json.gz", 8, "etag-1"),
+        S3Object(f"{prefix}2.json.gz", 8, "etag-2"),
+    ]
+
+    def sync(objects):
+        return download_ocr_keys(
+            objects, download_gv_ocr_files, base_data_dir=str(tmp_path), sync=True
+        )
+
+    result = sync(objects)
+    assert sorted(result.downloaded) == [objects[0].key, objects[1].key]
+    assert (tmp_path / ".manifests" / "W1234.json").exists()
+
+    # Unchanged objects are skipped
+    result = sync(objects)
+    assert sorted(result.skipped) == [objects[0].key, objects[1].key]
+
+    # A truncated local file and an object with a new ETag are fetched again
+    (tmp_path / "W1234" / "I5678" / "1.json.gz").write_bytes(b"page")
+    objects[1] = S3Object(f"{prefix}2.json.gz", 8, "etag-2b")
+    result = sync(objects)
+    assert sorted(result.downloaded) == [objects[0].key, objects[1].key]
+    assert (tmp_path / "W1234" / "I5678" / "1.json.gz").read_bytes() == b"page one"
+    assert not list((tmp_path / "W1234").rglob("*.part"))
+
+
+@patch("bdrc_work_to_pecha_pipeline.download.get_s3_client")
+def test_download_ocr_keys_sync_without_etag(mock_get_s3_client, tmp_path):
+    def fake_download_file(bucket, key, local_file_path, Config=None):
+        Path(local_file_path).write_bytes(b"page one")
+
+    mock_get_s3_client.return_value.download_file.side_effect = fake_download_file
+    key = "Works/a1/W1234/vision/batch001/output/I5678/1.json.gz"
+    local_file_path = tmp_path / "W1234" / "I5678" / "1.json.gz"
+    local_file_path.parent.mkdir(parents=True)
+    local_file_path.write_bytes(b"page two")
+
+    # A catalog row without an ETag cannot be compared, so it is fetched again
+    result = download_ocr_keys(
+        [S3Object(key, 8, None)],
+        download_gv_ocr_files,
+        base_data_dir=str(tmp_path),
+        sync=True,
+    )
+    assert result.downloaded == [key]
+    assert local_file_path.read_bytes() == b"page one"
+
+
+def test_compute_etag(tmp_path):
+    path = tmp_path / "html.zip"
+    path.write_bytes(b"abcdefghij")
+    assert compute_etag(path) == hashlib.md5(b"abcdefghij").hexdigest()
+    part_md5s = b"".join(
+        hashlib.md5(part).digest() for part in (b"abcd", b"efgh", b"ij")
+    )
+    assert compute_etag(path, 4) == f"{hashlib.md5(part_md5s).hexdigest()}-3"
+
+
+@patch("bdrc_work_to_pecha_pipeline.download.get_s3_client")
+def test_get_etag_part_size(mock_get_s3_client):
+    head_object = mock_get_s3_client.return_value.head_object
+    head_object.return_value = {"ContentLength": 8 * 1024 * 1024}
+    etag = hashlib.md5(b"").hexdigest()
+
+    assert get_etag_part_size("key", etag) is None
+    assert get_etag_part_size("key", f"{etag}-3") == 8 * 1024 * 1024
+    assert head_object.call_args.kwargs["PartNumber"] == 1
+    assert head_object.call_args.kwargs["IfMatch"] == f'"{etag}-3"'
+
+    # Neither a non-MD5 ETag nor an SSE-KMS object can be checked
+    with pytest.raises(UnverifiableETag):
+        get_etag_part_size("key", "not-an-md5")
+    head_object.return_value = {"ContentLength": 1, "ServerSideEncryption": "aws:kms"}
+    with pytest.raises(UnverifiableETag):
+        get_etag_part_size("key", etag)
+
+
+@pytest.fixture
+def small_ranges():
+    configure_s3(multipart_chunksize=4, max_concurrency=2, large_object_threshold=8)
+    yield
+    configure_s3()
+
+
+@patch("bdrc_work_to_pecha_pipeline.download.get_s3_client")
+def test_download_s3_file_ranged(mock_get_s3_client, small_ranges, tmp_path):
+    content = b"0123456789abcdefghij"
+    obj = S3Object(
+        "Works/a1/W1234/html.zip", len(content), hashlib.md5(content).hexdigest()
+    )
+    requested = []
+    failing = {"bytes=12-15"}
+
+    def fake_get_object(Bucket, Key, Range, **kwargs):
+        requested.append(Range)
+        if Range in failing:
+            failing.remove(Range)
+            raise Exception("Simulated S3 error")
+        first, last = map(int, Range.split("=")[1].split("-"))
+        end = last + 1
+        body = io.BytesIO(content[first:end])
+        body.iter_chunks = lambda size: iter(lambda: body.read(size), b"")
+        return {"Body": body}
+
+    mock_get_s3_client.return_value.get_object.side_effect = fake_get_object
+    mock_get_s3_client.return_value.head_object.return_value = {
+        "ContentLength": len(content)
+    }
+    local_file_path = tmp_path / "html.zip"
+
+    with pytest.raises(Exception, match="Simulated S3 error"):
+        download_s3_file(obj.key, local_file_path, obj)
+    assert not local_file_path.exists()
+    assert (tmp_path / "html.zip.part.json").exists()
+
+    # Only the range that failed is fetched again
+    requested.clear()
+    assert download_s3_file(obj.key, local_file_path, obj) == "downloaded"
+    assert requested == ["bytes=12-15"]
+    assert local_file_path.read_bytes() == content
+    assert list(tmp_path.iterdir()) == [local_file_path]
+
+    # A file that does not match the ETag is discarded
+    local_file_path.unlink()
+    corrupt = obj._replace(etag=hashlib.md5(b"something else").hexdigest())
+    with pytest.raises(ChecksumError):
+        download_s3_file(obj.key, local_file_path, corrupt)
+    assert list(tmp_path.iterdir()) == []
+
+    # A file whose ETag is not an MD5 is kept unchecked
+    encrypted = obj._replace(etag=hashlib.md5(b"something else").hexdigest())
+    mock_get_s3_client.return_value.head_object.return_value = {
+        "ContentLength": len(content),
+        "ServerSideEncryption": "aws:kms",
+    }
+    assert download_s3_file(obj.key, local_file_path, encrypted) == "downloaded"
+    assert local_file_path.read_bytes() == content
+
+
 if __name__ == "__main__":
     test_get_s3_prefix()
     test_get_hash()
@@ -0,0 +1,90 @@
+from unittest.mock import patch
+
+from bdrc_work_to_pecha_pipeline.download import DownloadResult
+from bdrc_work_to_pecha_pipeline.job_state import JobStateStore
+from bdrc_work_to_pecha_pipeline.pecha_upload import run_pipeline
+
+JOB = ("W1234", "vision", "batch001")
+
+
+def test_mark_done_and_reset(tmp_path):
+    with JobStateStore(str(tmp_path / "state.db")) as store:
+        store.mark_done(JOB, "download")
+        store.mark_done(JOB, "metadata", {"title": "t"})
+        store.mark_done(("W1234", "vision", "batch002"), "download")
+        assert store.get_completed(JOB) == {
+            "download": None,
+            "metadata": {"title": "t"},
+        }
+
+        store.reset(JOB, ["metadata"])
+        assert store.get_completed(JOB) == {"download": None}
+        store.reset(JOB)
+        assert store.get_completed(JOB) == {}
+        assert list(store.list_jobs()) == [("W1234", "vision", "batch002")]
+
+    # The state survives reopening the database
+    with JobStateStore(str(tmp_path / "state.db")) as store:
+        assert store.get_completed(("W1234", "vision", "batch002")) == {
+            "download": None
+        }
+
+
+@patch("bdrc_work_to_pecha_pipeline.pecha_upload.create_pecha")
+@patch("bdrc_work_to_pecha_pipeline.pecha_upload.zip_folder")
+@patch("bdrc_work_to_pecha_pipeline.pecha_upload.generate_metadata")
+@patch("bdrc_work_to_pecha_pipeline.pecha_upload.download_ocr_data")
+def test_run_pipeline_resumes(
+    mock_download, mock_generate_metadata, mock_zip_folder, mock_create_pecha, tmp_path
+):
+    # Each batch has its own work directory and archive
+    work_path = tmp_path / "vision" / "batch001" / "W1234"
+    work_path.mkdir(parents=True)
+    zip_path = work_path.with_name("W1234.zip")
+    mock_download.return_value = DownloadResult(downloaded=["a"], skipped=[], failed={})
+    mock_generate_metadata.return_value = {"title": "t"}
+
+    def zip_folder(work_path):
+        archive = work_path.with_name(f"{work_path.name}.zip")
+        archive.write_bytes(b"PK")
+        return str(archive)
+
+    mock_zip_folder.side_effect = zip_folder
+    mock_create_pecha.return_value = None
+
+    def run():
+        return run_pipeline(
+            "W1234", "batch001", "vision", str(tmp_path), job_state=store
+        )
+
+    with JobStateStore(str(tmp_path / "state.db")) as store:
+        # The upload fails: every stage before it is checkpointed
+        assert run() is None
+        assert set(store.get_completed(JOB)) == {"download", "metadata", "zip"}
+
+        # The retry goes straight to the upload with the stored archive
+        mock_create_pecha.return_value = "P0001"
+        assert run() == "P0001"
+        assert mock_download.call_count == 1
+        assert mock_generate_metadata.call_count == 1
+        assert mock_zip_folder.call_count == 1
+        mock_create_pecha.assert_called_with({"title": "t"}, data_file=zip_path)
+
+        # A finished job is not uploaded again
+        assert run() == "P0001"
+        assert mock_create_pecha.call_count == 2
+
+        # Without its archive, the job is zipped again from the downloaded files
+        store.reset(JOB, ["upload"])
+        zip_path.unlink()
+        run()
+        assert mock_download.call_count == 1
+        assert mock_zip_folder.call_count == 2
+
+        # Another batch of the work gets its own archive
+        (tmp_path / "vision" / "batch002" / "W1234").mkdir(parents=True)
+        mock_create_pecha.return_value = None
+        run_pipeline("W1234", "batch002", "vision", str(tmp_path), job_state=store)
+        other_zip_path = tmp_path / "vision" / "batch002" / "W1234.zip"
+        mock_create_pecha.assert_called_with({"title": "t"}, data_file=other_zip_path)
+        assert store.get_completed(JOB)["zip"] == str(zip_path.resolve())
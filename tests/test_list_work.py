@@ -1,12 +1,16 @@
+import gzip
+import tempfile
 import unittest
+from pathlib import Path
 from unittest.mock import patch
 
 import bdrc_work_to_pecha_pipeline.list_works as lw
 
 
 class TestListWorks(unittest.TestCase):
-    @patch("bdrc_work_to_pecha_pipeline.list_works.s3_client")
-    def test_list_all_hash_directories(self, mock_s3_client):
+    @patch("bdrc_work_to_pecha_pipeline.list_works.get_s3_client")
+    def test_list_all_hash_directories(self, mock_get_s3_client):
+        mock_s3_client = mock_get_s3_client.return_value
         # Setup mock response
         mock_s3_client.list_objects_v2.return_value = {
             "CommonPrefixes": [
@@ -19,8 +23,9 @@ class TestListWorks(unittest.TestCase):
         # Assert the result
         self.assertEqual(result, ["Works/a1/", "Works/b2/"])
 
-    @patch("bdrc_work_to_pecha_pipeline.list_works.s3_client")
-    def test_list_work_ids_in_hash_dir(self, mock_s3_client):
+    @patch("bdrc_work_to_pecha_pipeline.list_works.get_s3_client")
+    def test_list_work_ids_in_hash_dir(self, mock_get_s3_client):
+        mock_s3_client = mock_get_s3_client.return_value
         # Setup mock response
         mock_s3_client.list_objects_v2.return_value = {
             "CommonPrefixes": [
@@ -31,6 +36,68 @@ class TestListWorks(unittest.TestCase):
         result = lw.list_work_ids_in_hash_dir("Works/a1/")
         self.assertEqual(result, ["W1234", "W5678"])
 
+    @patch("bdrc_work_to_pecha_pipeline.list_works.list_work_ids_in_hash_dir")
+    @patch("bdrc_work_to_pecha_pipeline.list_works.list_all_hash_directories")
+    def test_list_all_work_ids(self, mock_list_hash_dirs, mock_list_work_ids):
+        mock_list_hash_dirs.return_value = ["Works/a1/", "Works/b2/", "Works/c3/"]
+        work_ids_by_hash_dir = {
+            "Works/a1/": ["W1234", "W5678"],
+            "Works/b2/": ["W0001"],
+            "Works/c3/": [],
+        }
+        mock_list_work_ids.side_effect = work_ids_by_hash_dir.get
+
+        result = lw.list_all_work_ids(max_workers=3)
+        self.assertEqual(result, ["W1234", "W5678", "W0001"])
+
+        streamed = list(lw.iter_all_work_ids(max_workers=3))
+        self.assertEqual(sorted(streamed), sorted(result))
+
+    def test_build_work_details(self):
+        keys = [
+            "Works/a1/W1234/vision/batch001/output/I1/1.json.gz",
+            "Works/a1/W1234/vision/batch002/info.json",
+            "Works/a1/W1234/google_books/readme.txt",
+            "Works/a1/W1234/info.json",
+            "Works/0f/W5678/GoogleVisionEngine/batch001/info.json",
+            "Works/b2/W0001/vision/notes.txt",
+        ]
+        result = lw.build_work_details(keys)
+        self.assertEqual(list(result), ["W5678", "W1234"])
+        self.assertEqual(
+            result["W1234"],
+            {
+                "ocr_engines": ["google_books", "vision"],
+                "engine_batches": {"vision": ["batch001", "batch002"]},
+            },
+        )
+        self.assertNotIn("W0001", result)
+
+    @patch("bdrc_work_to_pecha_pipeline.list_works.get_s3_client")
+    def test_get_work_details_from_scan(self, mock_get_s3_client):
+        mock_s3_client = mock_get_s3_client.return_value
+        mock_s3_client.get_paginator.return_value.paginate.return_value = [
+            {"Contents": [{"Key": "Works/a1/W1234/vision/batch001/info.json"}]},
+            {"Contents": [{"Key": "Works/a1/W1234/vision/batch002/info.json"}]},
+        ]
+        result = lw.get_work_details_from_scan()
+        self.assertEqual(
+            result["W1234"]["engine_batches"], {"vision": ["batch001", "batch002"]}
+        )
+
+    def test_get_work_details_from_inventory(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data_dir = Path(tmp_dir) / "data"
+            data_dir.mkdir()
+            with gzip.open(data_dir / "part-0.csv.gz", "wt") as f:
+                f.write('"ocr.bdrc.io","Works/a1/W1234/vision/batch%20001/info.json"\n')
+            manifest = Path(tmp_dir) / "manifest.json"
+            manifest.write_text(
+                '{"files": [{"key": "inventory/ocr.bdrc.io/all/data/part-0.csv.gz"}]}'
+            )
+            result = lw.get_work_details_from_scan(str(manifest))
+        self.assertEqual(result["W1234"]["engine_batches"], {"vision": ["batch 001"]})
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,47 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+from bdrc_work_to_pecha_pipeline.metrics import (
+    BatchMetrics,
+    MetricsSink,
+    collecting,
+    count,
+    timed,
+)
+
+
+def test_collecting_reaches_worker_threads():
+    metrics = BatchMetrics()
+    with collecting(metrics):
+        with timed("download"):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                for _ in range(10):
+                    executor.submit(copy_context().run, count, "bytes_downloaded", 5)
+    # Outside the block nothing is recorded
+    count("bytes_downloaded", 100)
+
+    assert metrics.counters == {"bytes_downloaded": 50}
+    assert metrics.stages["download"] >= 0
+
+
+def test_metrics_sink_writes_jsonl_and_prometheus(tmp_path):
+    sink = MetricsSink(tmp_path / "metrics.jsonl", tmp_path / "pipeline.prom")
+    for status, seconds in (("succeeded", 1.5), ("failed", 0.25)):
+        sink.add(
+            {
+                "work_id": "W1234",
+                "status": status,
+                "metrics": {
+                    "stages": {"download": seconds},
+                    "counters": {"objects_downloaded": 2},
+                },
+            }
+        )
+
+    lines = (tmp_path / "metrics.jsonl").read_text().splitlines()
+    assert [json.loads(line)["status"] for line in lines] == ["succeeded", "failed"]
+    prom = (tmp_path / "pipeline.prom").read_text()
+    assert 'bdrc_pipeline_batches_total{status="failed"} 1' in prom
+    assert 'bdrc_pipeline_stage_seconds_total{stage="download"} 1.750' in prom
+    assert "bdrc_pipeline_objects_downloaded_total 4" in prom
@@ -0,0 +1,75 @@
+import gzip
+import io
+from unittest.mock import patch
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+from botocore.exceptions import ClientError
+
+from bdrc_work_to_pecha_pipeline.download import S3Object
+from bdrc_work_to_pecha_pipeline.packaging import build_archive_from_s3, read_s3_object
+
+OBJECTS = {
+    "Works/a1/W1234/vision/batch001/output/I5678/1.json.gz": gzip.compress(b"{}"),
+    "Works/a1/W1234/vision/batch001/info.json": b'{"timestamp": "2022"}',
+}
+
+
+@patch("bdrc_work_to_pecha_pipeline.packaging.get_s3_client")
+def test_build_archive_from_s3(mock_get_s3_client):
+    mock_s3_client = mock_get_s3_client.return_value
+    mock_s3_client.get_object.side_effect = lambda Bucket, Key: {
+        "Body": io.BytesIO(OBJECTS[Key])
+    }
+    members = [
+        ("W1234/I5678/1.json.gz", S3Object(key, len(data), "etag"))
+        for key, data in OBJECTS.items()
+        if key.endswith(".gz")
+    ] + [
+        ("W1234/info.json", S3Object(key, len(data), "etag"))
+        for key, data in OBJECTS.items()
+        if key.endswith("info.json")
+    ]
+
+    with build_archive_from_s3(
+        members, {"W1234/buda_data.json": b"{}"}, max_workers=2
+    ) as archive:
+        with ZipFile(archive) as zip_file:
+            assert zip_file.namelist() == [
+                "W1234/I5678/1.json.gz",
+                "W1234/info.json",
+                "W1234/buda_data.json",
+            ]
+            page = zip_file.getinfo("W1234/I5678/1.json.gz")
+            assert page.compress_type == ZIP_STORED
+            assert zip_file.getinfo("W1234/info.json").compress_type == ZIP_DEFLATED
+            assert zip_file.read(page) == OBJECTS[members[0][1].key]
+            assert zip_file.read("W1234/info.json") == b'{"timestamp": "2022"}'
+            assert zip_file.testzip() is None
+
+
+@patch("bdrc_work_to_pecha_pipeline.retry.time.sleep")
+@patch("bdrc_work_to_pecha_pipeline.packaging.get_s3_client")
+def test_s3_reads_are_retried(mock_get_s3_client, mock_sleep):
+    slow_down = ClientError(
+        {
+            "Error": {"Code": "SlowDown"},
+            "ResponseMetadata": {"HTTPStatusCode": 503},
+        },
+        "GetObject",
+    )
+    key = "Works/a1/W1234/vision/batch001/info.json"
+    mock_get_s3_client.return_value.get_object.side_effect = [
+        slow_down,
+        {"Body": io.BytesIO(OBJECTS[key])},
+        slow_down,
+        {"Body": io.BytesIO(OBJECTS[key])},
+    ]
+    assert read_s3_object(key) == OBJECTS[key]
+    mock_get_s3_client.assert_called_with(single_attempt=True)
+
+    with build_archive_from_s3(
+        [("W1234/info.json", S3Object(key, len(OBJECTS[key]), "etag"))], {}
+    ) as archive:
+        with ZipFile(archive) as zip_file:
+            assert zip_file.read("W1234/info.json") == OBJECTS[key]
+    assert mock_sleep.call_count == 2
@@ -1,7 +1,10 @@
+import io
 import json
+import time
 from unittest.mock import patch
 
 import pytest
+from botocore.exceptions import ClientError
 
 from bdrc_work_to_pecha_pipeline import pecha_registry
 
@@ -11,7 +14,10 @@ def dummy_registry(tmp_path, monkeypatch):
     # Use a temp file for the registry
     reg_file = tmp_path / "pecha_registry.json"
     monkeypatch.setattr(pecha_registry, "REGISTRY_FILE", reg_file)
-    return reg_file
+    monkeypatch.setattr(pecha_registry, "SHARDED_REGISTRY", False)
+    pecha_registry.clear_registry_cache()
+    yield reg_file
+    pecha_registry.clear_registry_cache()
 
 
 @patch("bdrc_work_to_pecha_pipeline.pecha_registry.download_registry_from_s3")
@@ -36,3 +42,213 @@ def test_get_first_pecha_for_nonexistent_work(mock_download, dummy_registry):
     with open(dummy_registry, "w") as f:
         json.dump({"W111": "P222"}, f)
     assert pecha_registry.get_first_pecha_for_work("W999") is None
+
+
+@patch("bdrc_work_to_pecha_pipeline.pecha_registry.get_s3_client")
+def test_get_registry_uses_cache_and_conditional_fetch(
+    mock_get_s3_client, dummy_registry
+):
+    mock_s3_client = mock_get_s3_client.return_value
+    mock_s3_client.get_object.return_value = {
+        "Body": io.BytesIO(b'{"W111": "P222"}'),
+        "ETag": '"abc"',
+    }
+    assert pecha_registry.get_first_pecha_for_work("W111") == "P222"
+    # Within the TTL, lookups are served from memory
+    assert pecha_registry.get_first_pecha_for_work("W111") == "P222"
+    assert mock_s3_client.get_object.call_count == 1
+
+    # Revalidation sends the ETag and keeps the cached copy on 304
+    mock_s3_client.get_object.side_effect = ClientError(
+        {"Error": {"Code": "304", "Message": "Not Modified"}}, "GetObject"
+    )
+    assert pecha_registry.get_registry(max_age=0) == {"W111": "P222"}
+    mock_s3_client.get_object.assert_called_with(
+        Bucket=pecha_registry.S3_BUCKET, Key=pecha_registry.S3_KEY, IfNoneMatch='"abc"'
+    )
+
+
+def test_unreadable_registry_is_not_cached(fake_s3):
+    fake_s3.objects[pecha_registry.S3_KEY] = ('"0"', b'{"W1": "P1"}')
+    assert pecha_registry.get_registry() == {"W1": "P1"}
+
+    # S3 is unavailable and the local copy is unreadable: nothing is kept
+    pecha_registry.REGISTRY_FILE.write_text('{"W1": ')
+    error = fake_s3._error("InternalError", "GetObject")
+    with patch.object(fake_s3, "get_object", side_effect=error):
+        with pytest.raises(ValueError):
+            pecha_registry.get_registry(max_age=0)
+    assert pecha_registry._cache.etag is None
+
+    # The next lookup downloads the registry in full rather than getting a 304
+    assert pecha_registry.get_registry() == {"W1": "P1"}
+
+
+def test_invalid_registry_in_s3_is_not_written(fake_s3):
+    fake_s3.objects[pecha_registry.S3_KEY] = ('"0"', b'{"W1": "P1"}')
+    assert pecha_registry.get_registry() == {"W1": "P1"}
+    fake_s3.objects[pecha_registry.S3_KEY] = ('"1"', b'{"W1": ')
+    with pytest.raises(ValueError):
+        pecha_registry.get_registry(max_age=0)
+    assert json.loads(pecha_registry.REGISTRY_FILE.read_text()) == {"W1": "P1"}
+
+
+class FakeS3:
+    """Minimal S3 stand-in honouring conditional GET and PUT requests."""
+
+    def __init__(self):
+        self.objects = {}
+        self.versions = 0
+        self.before_put = None
+
+    def _error(self, code, operation):
+        return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        if Key not in self.objects:
+            raise self._error("NoSuchKey", "GetObject")
+        etag, body = self.objects[Key]
+        if IfNoneMatch == etag:
+            raise self._error("304", "GetObject")
+        return {"Body": io.BytesIO(body), "ETag": etag}
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None, **kwargs):
+        if self.before_put:
+            before_put, self.before_put = self.before_put, None
+            before_put()
+        current = self.objects.get(Key)
+        if (IfNoneMatch == "*" and current) or (
+            IfMatch and (not current or current[0] != IfMatch)
+        ):
+            raise self._error("PreconditionFailed", "PutObject")
+        self.versions += 1
+        self.objects[Key] = (f'"{self.versions}"', Body)
+        return {"ETag": self.objects[Key][0]}
+
+    def read_json(self, key):
+        return json.loads(self.objects[key][1])
+
+
+@pytest.fixture
+def fake_s3(tmp_path, monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(pecha_registry, "get_s3_client", lambda: s3)
+    monkeypatch.setattr(pecha_registry, "REGISTRY_FILE", tmp_path / "registry.json")
+    pecha_registry.clear_registry_cache()
+    yield s3
+    pecha_registry.clear_registry_cache()
+
+
+def test_sharded_register_and_get_first_pecha(fake_s3):
+    pecha_registry.register_pecha("W123", "P456")
+    pecha_registry.register_pecha("W123", "P789")
+    assert pecha_registry.get_first_pecha_for_work("W123") == "P456"
+    assert list(fake_s3.objects) == [pecha_registry.get_shard_key("W123")]
+    assert pecha_registry.get_first_pecha_for_work("W999") is None
+
+
+def test_sharded_register_merges_concurrent_write(fake_s3):
+    shard_key = pecha_registry.get_shard_key("W123")
+    pecha_registry.register_pecha("W123", "P456")
+
+    def concurrent_register():
+        # Another worker registers a work in the same shard first
+        etag = fake_s3.objects[shard_key][0]
+        shard = {**fake_s3.read_json(shard_key), "W_OTHER": "P000"}
+        fake_s3.put_object("b", shard_key, json.dumps(shard).encode(), IfMatch=etag)
+
+    fake_s3.before_put = concurrent_register
+    with patch.object(pecha_registry, "get_shard_key", return_value=shard_key):
+        pecha_registry.register_pecha("W777", "P777")
+
+    assert fake_s3.read_json(shard_key) == {
+        "W123": "P456",
+        "W_OTHER": "P000",
+        "W777": "P777",
+    }
+
+
+def test_sharded_registry_falls_back_to_legacy_file(fake_s3):
+    legacy = {"W1": "P1"}
+    fake_s3.objects[pecha_registry.S3_KEY] = ('"0"', json.dumps(legacy).encode())
+
+    # Before migration, works only in the single file are still found
+    assert pecha_registry.get_first_pecha_for_work("W1") == "P1"
+    # and registering a later pecha writes the legacy one to the shard
+    pecha_registry.register_pecha("W1", "P_NEWER")
+    assert fake_s3.read_json(pecha_registry.get_shard_key("W1")) == {"W1": "P1"}
+
+
+def test_migrate_registry_to_shards(fake_s3):
+    legacy = {"W1": "P1", "W2": "P2", "W3": "P3"}
+    # A shard written by a worker that did not consult the single file
+    shard_key = pecha_registry.get_shard_key("W2")
+    fake_s3.objects[shard_key] = ('"1"', json.dumps({"W2": "P_NEWER"}).encode())
+    fake_s3.objects[pecha_registry.S3_KEY] = ('"0"', json.dumps(legacy).encode())
+
+    assert pecha_registry.migrate_registry_to_shards() == 3
+    for work_id in legacy:
+        shard = fake_s3.read_json(pecha_registry.get_shard_key(work_id))
+        # The single file holds the true first pecha of its works
+        assert shard[work_id] == legacy[work_id]
+
+
+def test_registry_batch_flushes_at_close(fake_s3, tmp_path):
+    journal = tmp_path / "journal" / "1.jsonl"
+    with pecha_registry.RegistryBatch(journal, flush_interval=3600):
+        pecha_registry.register_pecha("W1", "P1")
+        pecha_registry.register_pecha("W2", "P2")
+        pecha_registry.register_pecha("W1", "P_LATER")
+        assert fake_s3.objects == {}
+        assert len(journal.read_text().splitlines()) == 2
+        # Pending registrations are visible to lookups
+        assert pecha_registry.get_first_pecha_for_work("W1") == "P1"
+
+    assert not journal.exists()
+    assert pecha_registry._active_batch is None
+    for work_id, pecha_id in (("W1", "P1"), ("W2", "P2")):
+        shard = fake_s3.read_json(pecha_registry.get_shard_key(work_id))
+        assert shard[work_id] == pecha_id
+
+
+def test_flush_journals_recovers_unflushed_registrations(
+    fake_s3, tmp_path, monkeypatch
+):
+    journal_dir = tmp_path / "journal"
+    batch = pecha_registry.RegistryBatch(journal_dir / "1.jsonl", flush_interval=3600)
+    monkeypatch.setattr(pecha_registry, "_active_batch", batch)
+    pecha_registry.register_pecha("W1", "P1")
+    # Simulate a crash mid-write of the next entry
+    with open(journal_dir / "1.jsonl", "a") as f:
+        f.write('{"work_id": "W2", "pe')
+
+    assert pecha_registry.flush_journals(journal_dir) == 1
+    assert list(journal_dir.iterdir()) == []
+    shard = fake_s3.read_json(pecha_registry.get_shard_key("W1"))
+    assert shard["W1"] == "P1"
+
+
+def test_registry_batch_flushes_periodically(fake_s3, tmp_path):
+    batch = pecha_registry.RegistryBatch(tmp_path / "1.jsonl", flush_interval=0.05)
+    batch.add("W1", "P1")
+    for _ in range(100):
+        if fake_s3.objects:
+            break
+        time.sleep(0.01)
+    # Flushed without any further registration
+    assert fake_s3.read_json(pecha_registry.get_shard_key("W1")) == {"W1": "P1"}
+    batch.close()
+
+
+def test_lookup_sees_other_workers_journals(fake_s3, tmp_path, monkeypatch):
+    other = pecha_registry.RegistryBatch(tmp_path / "1.jsonl", flush_interval=3600)
+    other.add("W1", "P1")
+    batch = pecha_registry.RegistryBatch(tmp_path / "2.jsonl", flush_interval=3600)
+    monkeypatch.setattr(pecha_registry, "_active_batch", batch)
+    assert pecha_registry.get_first_pecha_for_work("W1") == "P1"
+
+    # Once flushed by the other worker, it is found in the revalidated shard
+    assert pecha_registry.get_first_pecha_for_work("W2") is None
+    other.add("W2", "P2")
+    other.flush()
+    assert pecha_registry.get_first_pecha_for_work("W2") == "P2"
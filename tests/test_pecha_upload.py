@@ -1,6 +1,15 @@
+from pathlib import Path
 from unittest.mock import patch
 
-from bdrc_work_to_pecha_pipeline.pecha_upload import OcrEngine, get_work_batches
+from bdrc_work_to_pecha_pipeline.download import S3Object
+from bdrc_work_to_pecha_pipeline.pecha_upload import (
+    OcrEngine,
+    PipelineJob,
+    create_pecha,
+    get_job_data_dir,
+    get_work_batches,
+)
+from bdrc_work_to_pecha_pipeline.scratch import ScratchSpace
 
 
 @patch("bdrc_work_to_pecha_pipeline.pecha_upload.get_s3_prefix")
@@ -178,6 +187,51 @@ def test_get_work_batches_exception_handling(mock_get_s3_prefix):
         assert sorted(result) == sorted(expected_result)
 
 
+def test_get_job_data_dir():
+    job = ("W1234", "vision", "batch001")
+    data_dir = get_job_data_dir(Path("/data"), job)
+    assert data_dir == Path("/data/vision/batch001")
+    job = PipelineJob("W1234", "batch001", "vision", base_data_dir="/data")
+    assert job.work_path == Path("/data/vision/batch001/W1234")
+
+
+@patch("bdrc_work_to_pecha_pipeline.pecha_upload.iter_ocr_objects")
+def test_pipeline_job_reserves_estimated_space(mock_iter_ocr_objects, tmp_path):
+    mock_iter_ocr_objects.return_value = iter(
+        [S3Object("1.json.gz", 100, "etag-1"), S3Object("2.json.gz", 50, "etag-2")]
+    )
+    with ScratchSpace(str(tmp_path / ".scratch.db"), budget=1000) as scratch:
+        job = PipelineJob(
+            "W1234",
+            "batch001",
+            OcrEngine.GOOGLE_VISION,
+            base_data_dir=str(tmp_path),
+            scratch=scratch,
+        )
+        with job:
+            # The listed files and their archive
+            assert scratch.get_usage() == 300
+        assert scratch.get_usage() == 0
+
+
+@patch("bdrc_work_to_pecha_pipeline.pecha_upload.register_pecha")
+@patch("bdrc_work_to_pecha_pipeline.pecha_upload.get_uploader")
+def test_create_pecha_metadata_only(mock_get_uploader, mock_register_pecha):
+    response = mock_get_uploader.return_value.create_pecha.return_value
+    response.ok = True
+    response.json.return_value = {"id": "P0001", "title": "Test"}
+
+    metadata = {"bdrc": {"ocr_import_info": {"bdrc_scan_id": "W1234"}}}
+    assert create_pecha(metadata) == "P0001"
+    assert mock_get_uploader.return_value.create_pecha.call_args.args[1] is None
+    mock_register_pecha.assert_called_once_with("W1234", "P0001")
+
+    # Metadata without a scan ID is still sent, but the pecha is not registered
+    mock_register_pecha.reset_mock()
+    assert create_pecha({"bdrc": {}}) == "P0001"
+    mock_register_pecha.assert_not_called()
+
+
 if __name__ == "__main__":
     import pytest
 
@@ -0,0 +1,49 @@
+import io
+from unittest.mock import patch
+
+from bdrc_work_to_pecha_pipeline.pecha_upload import run_pipeline
+from bdrc_work_to_pecha_pipeline.published import PublishedRecord, read_published_file
+
+
+def test_published_record(tmp_path):
+    path = str(tmp_path / "published.db")
+    with PublishedRecord(path) as record:
+        assert record.get("W1_vision_batch001") is None
+        record.add("W1_vision_batch001", "P0001")
+        assert "W1_vision_batch001" in record
+        assert "W1_vision_batch002" not in record
+
+    published_file = tmp_path / "published.tsv"
+    published_file.write_text(
+        "# exported\nW2_vision_batch001\tP0002\n\nW3_vision_batch001\n"
+    )
+    with PublishedRecord(path) as record:
+        assert record.add_many(read_published_file(str(published_file))) == 2
+        assert record.get_all() == {
+            "W1_vision_batch001": "P0001",
+            "W2_vision_batch001": "P0002",
+            "W3_vision_batch001": "",
+        }
+        record.remove("W1_vision_batch001")
+        assert record.get("W1_vision_batch001") is None
+
+
+@patch("bdrc_work_to_pecha_pipeline.pecha_upload.create_pecha")
+@patch("bdrc_work_to_pecha_pipeline.pecha_upload.package_ocr_data_from_s3")
+@patch("bdrc_work_to_pecha_pipeline.pecha_upload.download_ocr_data")
+def test_run_pipeline_skips_published(
+    mock_download, mock_package, mock_create_pecha, tmp_path
+):
+    mock_package.return_value = ({"title": "t"}, io.BytesIO(b"PK"))
+    mock_create_pecha.return_value = "P0002"
+    with PublishedRecord(str(tmp_path / "published.db")) as record:
+        record.add("W1_vision_batch001", "P0001")
+        assert run_pipeline("W1", "batch001", "vision", published=record) == "P0001"
+        mock_download.assert_not_called()
+
+        # A new batch is published and recorded
+        pecha_id = run_pipeline(
+            "W1", "batch002", "vision", streaming=True, published=record
+        )
+        assert pecha_id == "P0002"
+        assert record.get("W1_vision_batch002") == "P0002"
@@ -0,0 +1,73 @@
+from unittest.mock import Mock, patch
+
+import pytest
+from botocore.exceptions import ClientError
+
+from bdrc_work_to_pecha_pipeline.metrics import BatchMetrics, collecting
+from bdrc_work_to_pecha_pipeline.retry import (
+    AdaptiveLimiter,
+    RetryPolicy,
+    is_retryable_error,
+)
+
+
+def client_error(code, status):
+    return ClientError(
+        {"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}},
+        "GetObject",
+    )
+
+
+def test_is_retryable_error():
+    assert is_retryable_error(client_error("SlowDown", 503))
+    assert is_retryable_error(client_error("InternalError", 500))
+    assert not is_retryable_error(client_error("404", 404))
+    assert not is_retryable_error(ValueError("bad"))
+
+
+@patch("bdrc_work_to_pecha_pipeline.retry.time.sleep")
+def test_retry_policy_backs_off_and_lowers_limit(mock_sleep):
+    func = Mock(side_effect=[client_error("SlowDown", 503), "done"])
+    limiter = AdaptiveLimiter(8)
+    metrics = BatchMetrics()
+    with collecting(metrics):
+        assert RetryPolicy(base_delay=1.0).call(func, "key", limiter=limiter) == "done"
+    func.assert_called_with("key")
+    assert func.call_count == 2
+    assert 0 <= mock_sleep.call_args.args[0] <= 1.0
+    assert limiter.limit == 4
+    assert limiter.in_flight == 0
+    assert metrics.counters == {"throttled": 1, "retries": 1}
+
+
+@patch("bdrc_work_to_pecha_pipeline.retry.time.sleep")
+def test_retry_policy_gives_up(mock_sleep):
+    func = Mock(side_effect=client_error("InternalError", 500))
+    with pytest.raises(ClientError):
+        RetryPolicy(max_attempts=3).call(func)
+    assert func.call_count == 3
+    assert mock_sleep.call_count == 2
+
+    func = Mock(side_effect=client_error("AccessDenied", 403))
+    with pytest.raises(ClientError):
+        RetryPolicy().call(func)
+    assert func.call_count == 1
+
+
+def test_adaptive_limiter():
+    limiter = AdaptiveLimiter(4, minimum=2, maximum=6, cooldown=60)
+    # One more slot after `limit` successes, up to the maximum
+    for _ in range(4):
+        limiter.on_success()
+    assert limiter.limit == 5
+    for _ in range(20):
+        limiter.on_success()
+    assert limiter.limit == 6
+
+    # Halved on throttling, once per cooldown, never below the minimum
+    limiter.on_throttle()
+    limiter.on_throttle()
+    assert limiter.limit == 3
+    limiter._last_decrease -= 60
+    limiter.on_throttle()
+    assert limiter.limit == 2
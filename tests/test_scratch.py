@@ -0,0 +1,133 @@
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+from bdrc_work_to_pecha_pipeline.scratch import ScratchSpace
+
+
+def make_work(data_dir, work_id, size):
+    work_path = data_dir / work_id
+    (work_path / "I1").mkdir(parents=True)
+    (work_path / "I1" / "1.json.gz").write_bytes(b"x" * size)
+    return work_path
+
+
+def test_eviction_order(tmp_path):
+    with ScratchSpace(str(tmp_path / ".scratch.db"), budget=250) as scratch:
+        paths = {}
+        for work_id, uploaded in (("W1", False), ("W2", True), ("W3", True)):
+            paths[work_id] = make_work(tmp_path, work_id, 100)
+            with scratch.track(paths[work_id]) as entry:
+                entry.update()
+                if uploaded:
+                    entry.mark_uploaded()
+        assert scratch.get_usage() == 300
+
+        # Over budget: the least recently used uploaded work goes first
+        with scratch.track(tmp_path / "W4"):
+            assert not paths["W2"].exists()
+            assert paths["W1"].exists() and paths["W3"].exists()
+            assert scratch.get_usage() == 200
+
+        # Failed works are evicted only once no uploaded work is left
+        assert scratch.evict(1)
+        assert not paths["W1"].exists() and not paths["W3"].exists()
+        assert scratch.get_usage() == 0
+
+
+def test_reserve_waits_for_active_works(tmp_path):
+    db = str(tmp_path / ".scratch.db")
+    with ScratchSpace(db, budget=50, poll_interval=0.01) as scratch:
+        work_path = make_work(tmp_path, "W1", 100)
+        entry = scratch.track(work_path)
+        entry.__enter__()
+        entry.update()
+        entry.mark_uploaded()
+
+        reserved = threading.Event()
+
+        def reserve():
+            # Another worker process has its own connection
+            with ScratchSpace(db, budget=50, poll_interval=0.01) as other:
+                other.reserve(tmp_path / "W2")
+            reserved.set()
+
+        thread = threading.Thread(target=reserve)
+        thread.start()
+        time.sleep(0.1)
+        assert not reserved.is_set()
+
+        # Once W1 is uploaded it is evicted to make room for W2
+        entry.__exit__(None, None, None)
+        thread.join(timeout=5)
+        assert reserved.is_set()
+        assert not work_path.exists()
+
+
+def test_reserve_counts_estimates(tmp_path):
+    db = str(tmp_path / ".scratch.db")
+    with ScratchSpace(db, budget=250, poll_interval=0.01) as scratch:
+        first = scratch.track(tmp_path / "W1", estimate=200)
+        first.__enter__()
+        assert scratch.get_usage() == 200
+
+        # A second active work is held back until its estimate fits
+        reserved = threading.Event()
+
+        def reserve():
+            with ScratchSpace(db, budget=250, poll_interval=0.01) as other:
+                other.reserve(tmp_path / "W2", estimate=100)
+            reserved.set()
+
+        thread = threading.Thread(target=reserve)
+        thread.start()
+        time.sleep(0.1)
+        assert not reserved.is_set()
+
+        # Once released, a work counts for its size on disk only
+        first.__exit__(None, None, None)
+        thread.join(timeout=5)
+        assert reserved.is_set()
+        assert scratch.get_usage() == 100
+
+
+def test_works_of_exited_processes_are_expired(tmp_path):
+    with ScratchSpace(str(tmp_path / ".scratch.db"), budget=150) as scratch:
+        work_path = make_work(tmp_path, "W1", 100)
+        scratch.reserve(work_path)
+        scratch.update(work_path)
+        # As if left by a process that crashed
+        process = subprocess.run(
+            [sys.executable, "-c", "import os; print(os.getpid())"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        with scratch._lock:
+            scratch._conn.execute(
+                "UPDATE works SET owner_pid = ?", (int(process.stdout),)
+            )
+
+        scratch.reserve(tmp_path / "W2", estimate=100)
+        assert not work_path.exists()
+        assert [row[0] for row in scratch.list_works()] == [
+            str((tmp_path / "W2").resolve())
+        ]
+
+
+def test_adds_columns_to_existing_database(tmp_path):
+    db = tmp_path / ".scratch.db"
+    with sqlite3.connect(db) as conn:
+        conn.execute(
+            "CREATE TABLE works (path TEXT PRIMARY KEY, manifest_path TEXT, "
+            "size INTEGER NOT NULL DEFAULT 0, state TEXT NOT NULL, "
+            "last_used REAL NOT NULL)"
+        )
+        conn.execute("INSERT INTO works VALUES ('W0', NULL, 10, 'uploaded', 0)")
+    conn.close()
+
+    with ScratchSpace(str(db), budget=100) as scratch:
+        scratch.reserve(tmp_path / "W1", estimate=50)
+        assert scratch.get_usage() == 60
@@ -0,0 +1,16 @@
+from bdrc_work_to_pecha_pipeline.sqlite_store import SQLiteStore
+
+SCHEMA = "CREATE TABLE IF NOT EXISTS items (name TEXT PRIMARY KEY);"
+
+
+def test_sqlite_store(tmp_path):
+    path = tmp_path / "nested" / "store.db"
+    with SQLiteStore(str(path), SCHEMA) as store:
+        with store._lock, store._conn:
+            store._conn.execute("INSERT INTO items VALUES ('a')")
+        (journal_mode,) = store._conn.execute("PRAGMA journal_mode").fetchone()
+    assert journal_mode == "wal"
+
+    # Reopening keeps the existing rows
+    with SQLiteStore(str(path), SCHEMA, isolation_level=None) as store:
+        assert store._conn.execute("SELECT name FROM items").fetchall() == [("a",)]
@@ -0,0 +1,129 @@
+import threading
+import time
+from unittest.mock import patch
+
+from bdrc_work_to_pecha_pipeline import staged_pipeline
+from bdrc_work_to_pecha_pipeline.metrics import MetricsSink
+from bdrc_work_to_pecha_pipeline.pecha_upload import PipelineJob
+from bdrc_work_to_pecha_pipeline.published import PublishedRecord
+
+JOBS = [("W1", "vision", f"batch00{i}") for i in range(1, 5)]
+
+
+class StageRecorder:
+    """
+    Stands in for the PipelineJob stages, recording when each one runs.
+    """
+
+    def __init__(self, delay=0.05, failing=()):
+        self.delay = delay
+        self.failing = failing
+        self.lock = threading.Lock()
+        self.events = []
+        self.max_in_flight = 0
+        self.in_flight = 0
+
+    def run(self, stage, job):
+        with self.lock:
+            self.events.append((stage, job.batch_number))
+            if stage == "download":
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.events.append((f"{stage} done", job.batch_number))
+            if stage == "upload":
+                self.in_flight -= 1
+        if stage == "download" and job.batch_number in self.failing:
+            with self.lock:
+                self.in_flight -= 1
+            raise RuntimeError("Simulated download error")
+        return f"P{job.batch_number[-3:]}" if stage == "upload" else None
+
+    def patch(self):
+        return patch.multiple(
+            PipelineJob,
+            **{
+                stage: lambda job, stage=stage: self.run(stage, job)
+                for stage in staged_pipeline.STAGES
+            },
+        )
+
+
+def test_run_staged(tmp_path):
+    recorder = StageRecorder(failing=("batch002",))
+    with recorder.patch():
+        records = staged_pipeline.run_staged(
+            JOBS,
+            data_dir=str(tmp_path),
+            stage_workers={"download": 1, "package": 1, "upload": 1},
+            queue_size=1,
+        )
+
+    by_batch = {record["batch_number"]: record for record in records}
+    assert by_batch["batch001"]["status"] == "succeeded"
+    assert by_batch["batch001"]["pecha_id"] == "P001"
+    assert by_batch["batch002"]["status"] == "failed"
+    assert by_batch["batch002"]["error"] == "Simulated download error"
+    assert ("package", "batch002") not in recorder.events
+    assert by_batch["batch004"]["status"] == "succeeded"
+
+    # Later batches download while earlier ones are packaged and uploaded
+    events = recorder.events
+    assert events.index(("download", "batch003")) < events.index(
+        ("upload done", "batch001")
+    )
+    assert events.index(("download", "batch004")) < events.index(
+        ("upload done", "batch003")
+    )
+
+
+def test_run_staged_backpressure(tmp_path):
+    recorder = StageRecorder(delay=0.01)
+    slow_upload = recorder.run
+
+    def run(stage, job):
+        if stage == "upload":
+            time.sleep(0.1)
+        return slow_upload(stage, job)
+
+    recorder.run = run
+    jobs = [("W1", "vision", f"batch{i:03}") for i in range(10)]
+    with recorder.patch():
+        records = staged_pipeline.run_staged(
+            jobs,
+            data_dir=str(tmp_path),
+            stage_workers={"download": 2, "package": 1, "upload": 1},
+            queue_size=1,
+        )
+
+    assert len(records) == 10
+    # At most the stage workers plus one queued batch per queue
+    assert recorder.max_in_flight <= 2 + 1 + 1 + 1 + 1
+
+
+def test_run_staged_skips_published(tmp_path):
+    recorder = StageRecorder(delay=0)
+    with PublishedRecord(str(tmp_path / "published.db")) as published:
+        published.add("W1_vision_batch001", "P0001")
+        with recorder.patch():
+            records = staged_pipeline.run_staged(
+                JOBS[:1], data_dir=str(tmp_path), published=published
+            )
+
+    assert records[0]["status"] == "succeeded"
+    assert records[0]["pecha_id"] == "P0001"
+    assert recorder.events == []
+
+
+def test_run_staged_survives_finish_errors(tmp_path):
+    recorder = StageRecorder(delay=0)
+    sink = MetricsSink()
+    with recorder.patch(), patch.object(
+        sink, "add", side_effect=OSError("Simulated disk full")
+    ):
+        records = staged_pipeline.run_staged(
+            JOBS, data_dir=str(tmp_path), queue_size=1, metrics_sink=sink
+        )
+
+    assert [record["status"] for record in records] == ["succeeded"] * len(JOBS)
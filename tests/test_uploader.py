@@ -0,0 +1,148 @@
+import io
+import json
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from bdrc_work_to_pecha_pipeline.retry import RetryPolicy
+from bdrc_work_to_pecha_pipeline.uploader import MultipartStream, PechaUploader
+
+
+class FakeOpenPechaHandler(BaseHTTPRequestHandler):
+    """Local stand-in for the OpenPecha API /pecha endpoint."""
+
+    protocol_version = "HTTP/1.1"
+    requests_received: list = []
+    # Number of requests answered with unavailable_status before the first success
+    unavailable_count = 0
+    unavailable_status = 503
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+        )
+        parts = {
+            part.get_param("name", header="content-disposition"): part
+            for part in message.iter_parts()
+        }
+        self.requests_received.append(
+            {
+                "path": self.path,
+                "client_port": self.client_address[1],
+                "metadata": json.loads(parts["metadata"].get_content()),
+                "filename": parts["data"].get_filename() if "data" in parts else None,
+                "data": (
+                    parts["data"].get_payload(decode=True) if "data" in parts else None
+                ),
+            }
+        )
+        if len(self.requests_received) <= self.unavailable_count:
+            self.send_response(self.unavailable_status)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        response = json.dumps({"id": "P0001", "title": "Test"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def openpecha_api():
+    FakeOpenPechaHandler.requests_received = []
+    FakeOpenPechaHandler.unavailable_count = 0
+    FakeOpenPechaHandler.unavailable_status = 503
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOpenPechaHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_multipart_stream_length_matches_body():
+    body = MultipartStream(
+        [("metadata", '{"a": 1}')],
+        [("data", "W1234.zip", io.BytesIO(b"x" * 10000), "application/zip")],
+    )
+    data = b"".join(iter(lambda: body.read(777), b""))
+    assert len(data) == len(body)
+    assert data.endswith(f"--{body.boundary}--\r\n".encode())
+
+
+def test_create_pecha_streams_and_reuses_connection(openpecha_api):
+    archive = b"PK\x03\x04" + bytes(range(256)) * 4096
+    with PechaUploader(base_url=openpecha_api, timeout=(5, 5)) as uploader:
+        for _ in range(2):
+            response = uploader.create_pecha(
+                json.dumps({"document_id": "W1234_vision_batch001"}),
+                ("data", "W1234.zip", io.BytesIO(archive), "application/zip"),
+            )
+            assert response.ok
+            assert response.json()["id"] == "P0001"
+
+    first, second = FakeOpenPechaHandler.requests_received
+    assert first["path"] == "/pecha"
+    assert first["metadata"] == {"document_id": "W1234_vision_batch001"}
+    assert first["filename"] == "W1234.zip"
+    assert first["data"] == archive
+    # Both uploads went over the same keep-alive connection
+    assert first["client_port"] == second["client_port"]
+
+
+def test_create_pecha_without_file(openpecha_api):
+    with PechaUploader(base_url=openpecha_api, timeout=(5, 5)) as uploader:
+        assert uploader.create_pecha(json.dumps({"document_id": "W1234"})).ok
+    (request,) = FakeOpenPechaHandler.requests_received
+    assert request["metadata"] == {"document_id": "W1234"}
+    assert request["data"] is None
+
+
+def test_create_pecha_retries_unavailable(openpecha_api):
+    FakeOpenPechaHandler.unavailable_count = 2
+    archive = b"PK\x03\x04" + bytes(range(256)) * 16
+    policy = RetryPolicy(base_delay=0.01)
+    with PechaUploader(
+        base_url=openpecha_api, timeout=(5, 5), retry_policy=policy
+    ) as uploader:
+        response = uploader.create_pecha(
+            "{}", ("data", "W1234.zip", io.BytesIO(archive), "application/zip")
+        )
+    assert response.ok
+    # The archive was sent in full with every attempt
+    assert [r["data"] for r in FakeOpenPechaHandler.requests_received] == [archive] * 3
+
+    FakeOpenPechaHandler.requests_received = []
+    FakeOpenPechaHandler.unavailable_count = 5
+    with PechaUploader(
+        base_url=openpecha_api, timeout=(5, 5), retry_policy=RetryPolicy(2, 0.01)
+    ) as uploader:
+        response = uploader.create_pecha(
+            "{}", ("data", "W1234.zip", io.BytesIO(archive), "application/zip")
+        )
+    assert response.status_code == 503
+    assert len(FakeOpenPechaHandler.requests_received) == 2
+
+
+def test_create_pecha_does_not_retry_gateway_errors(openpecha_api):
+    # A 502 may come after the API created the pecha, so it is not sent again
+    FakeOpenPechaHandler.unavailable_count = 1
+    FakeOpenPechaHandler.unavailable_status = 502
+    with PechaUploader(
+        base_url=openpecha_api, timeout=(5, 5), retry_policy=RetryPolicy(3, 0.01)
+    ) as uploader:
+        response = uploader.create_pecha(
+            "{}", ("data", "W1234.zip", io.BytesIO(b"PK"), "application/zip")
+        )
+    assert response.status_code == 502
+    assert len(FakeOpenPechaHandler.requests_received) == 1